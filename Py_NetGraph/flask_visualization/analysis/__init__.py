@@ -1,8 +1,14 @@
+from .graph_snapshot import get_snapshot, invalidate_snapshot
+from .user_directory import get_user_directory, get_user_directory_stats
 from .centrality_analysis import analyze_centrality
 from .friend_analysis import analyze_friends, analyze_friend_distribution
 from .message_analysis import analyze_messages
 from .pagerank_analysis import analyze_user_interactions_pagerank
 from .hits_analysis import analyze_messages_hits, get_messages_hits_data
 from .community_analysis import analyze_community
-from .shortest_path import analyze_Djs
+from .shortest_path import analyze_Djs, analyze_shortest_paths
+from .landmark_index import analyze_influence_path
 from .time_series_analysis import analyze_by_timestamp,analyze_user_behavior
+from .incremental_influence import refresh_influence_scores, refresh_messages_pagerank, refresh_messages_hits
+from .graph_view import apply_graph_view
+from .graph_layout import with_layout, precompute_layout
@@ -1,82 +1,326 @@
 """
 用户中心性分析相关
+在共享快照的消息交互稀疏矩阵上计算多种中心性指标，均为整列（整批）的向量化计算：
+    - in_degree / out_degree: 加权入度 / 出度（接收 / 发送的消息数）
+    - eigenvector: 特征向量中心性（沿入边传递，带权重的幂迭代）
+    - kcore: k-核数（忽略方向和权重，按度数分层整批剥离）
+    - betweenness / closeness: 近似介数 / 接近中心性（无权最短路径），从随机抽样的起点做多源批量 BFS，
+      两项指标共用同一批 BFS；抽样数不少于活跃用户数时为精确值
+每项指标的精度 / 时间预算见 CENTRALITY_CONFIG["budgets"]，可由请求参数覆盖（不超过 limits）。
 """
-import networkx as nx
+import math
+import time
 import numpy as np
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-from database import fetch_data
-
-
-def analyze_centrality():
-    """计算用户中心性（接收消息的数量）"""
-    # 查询所有用户信息
-    query_users = "SELECT id, username FROM users"
-    df_users = fetch_data(query_users)
-
-
-    # 查询消息数据，计算每个用户接收到的消息数量
-    query_messages = """
-        SELECT m.sender_id, u1.username AS sender_name,
-               m.receiver_id, u2.username AS receiver_name,
-               COUNT(*) AS weight
-        FROM messages m
-        JOIN users u1 ON m.sender_id = u1.id
-        JOIN users u2 ON m.receiver_id = u2.id
-        WHERE m.timestamp >= DATE_SUB(NOW(), INTERVAL 1 MONTH)  -- 仅查询最近 1 个月的数据
-        GROUP BY m.sender_id, m.receiver_id
-    """
-    df_messages = fetch_data(query_messages)
-
-    # 构建有向图
-    G = nx.DiGraph()
-    user_map = {row["id"]: row["username"] for _, row in df_users.iterrows()}
-
-    # 添加边（消息数据）
-    for _, row in df_messages.iterrows():
-        G.add_edge(row["sender_id"], row["receiver_id"], weight=row["weight"])
-
-    # 计算每个用户的中心性（接收消息的数量）
-    node_centrality = {node: sum(d["weight"] for _, _, d in G.in_edges(node, data=True)) for node in G.nodes()}
-
-    # 确保所有用户都包含，即使没有接收消息
-    for user_id in user_map.keys():
-        if user_id not in node_centrality:
-            node_centrality[user_id] = 0
-
-    centrality_values = list(node_centrality.values())
-    vmin, vmax = min(centrality_values), max(centrality_values)
-
-    # 🎨 颜色划分
-    bins = np.linspace(vmin, vmax, 6)
-    colors = [cm.viridis(i / 5) for i in range(6)]
-
-    # 为每个节点分配颜色
-    node_colors = [
-        mcolors.to_hex(colors[np.digitize(node_centrality[user_id], bins) - 1])
-        for user_id in user_map.keys()
-    ]
-
-    # 为每个节点分配大小
-    node_sizes = [
-        np.interp(node_centrality[user_id], (vmin, vmax), (1000, 6000))
-        for user_id in user_map.keys()
-    ]
-
-    # 构造 JSON 格式的节点数据
-    nodes = [{
-        "id": int(user_id),
-        "username": user_map[user_id],
-        "size": node_sizes[i],
-        "color": node_colors[i],
-        "centrality": node_centrality[user_id]
-    } for i, user_id in enumerate(user_map.keys())]
-
-    # 构造边数据
-    edges = [{
-        "source": int(u),
-        "target": int(v),
-        "weight": G[u][v]["weight"]
-    } for u, v in G.edges()]
-
-    return {"nodes": nodes, "edges": edges}
+import scipy.sparse as sp
+from config import CENTRALITY_CONFIG
+from metrics import record, timed
+from .graph_snapshot import get_snapshot
+from .payload import value_range, color_levels, scale_sizes, build_nodes, message_edges
+
+CENTRALITY_METRICS = ("in_degree", "out_degree", "eigenvector", "kcore", "betweenness", "closeness")
+_SAMPLED = ("betweenness", "closeness")
+
+
+def eigenvector_centrality(adjacency, active, tol=1.0e-6, max_iter=100):
+    """
+    特征向量中心性（与 networkx.eigenvector_centrality 一致：迭代 (A^T + I)·x 并按 L2 范数归一化）。
+    :param adjacency: N×N 加权邻接矩阵，行为起点、列为终点
+    :param active: 参与计算的节点（布尔数组），其余节点为 0
+    :param tol: 收敛阈值（相邻两轮差的 L1 范数不超过 活跃节点数 × tol）
+    :return: (中心性数组, 迭代次数, 是否收敛)
+    """
+    n_active = int(active.sum())
+    x = active / max(n_active, 1)
+    if n_active == 0:
+        return x, 0, True
+    adjacency_T = sp.csr_matrix(adjacency.T, dtype=np.float64)
+    converged = False
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        new_x = adjacency_T @ x + x
+        new_x /= np.linalg.norm(new_x) or 1.0
+        converged = np.abs(new_x - x).sum() < n_active * tol
+        x = new_x
+        if converged:
+            break
+    record("iterations", iterations)
+    return x, iterations, converged
+
+
+def core_number(adjacency):
+    """
+    k-核数（与 networkx.core_number 一致）。
+    :param adjacency: 对称、无自环的 CSR 邻接矩阵（只使用稀疏结构）
+    每一层先取剩余节点的最小度数 k，整批删除度数不超过 k 的节点并更新其邻居的度数，
+    只检查度数刚被减少的邻居，直到没有度数不超过 k 的节点再进入下一层。
+    """
+    n = adjacency.shape[0]
+    indptr, indices = adjacency.indptr, adjacency.indices
+    degree = np.diff(indptr).astype(np.int64)
+    core = np.zeros(n, dtype=np.int64)
+    removed = np.zeros(n, dtype=bool)
+    remaining = n
+    k = 0
+    while remaining:
+        k = max(k, int(degree[~removed].min()))
+        frontier = np.flatnonzero(~removed & (degree <= k))
+        while len(frontier):
+            removed[frontier] = True
+            core[frontier] = k
+            remaining -= len(frontier)
+            neighbors, counts = np.unique(adjacency[frontier].indices, return_counts=True)
+            degree[neighbors] -= counts
+            neighbors = neighbors[~removed[neighbors]]
+            frontier = neighbors[degree[neighbors] <= k]
+    return core
+
+
+def _bfs_batch(pattern, pattern_T, sources, accumulate_dependency):
+    """
+    从一批起点同时做 BFS（N×B 稠密矩阵，每层一次稀疏矩阵乘法）。
+    :return: (距离矩阵（不可达为 -1）, 依赖值矩阵 δ（Brandes 反向累积，不需要时为 None）)
+    """
+    n, b = pattern.shape[0], len(sources)
+    columns = np.arange(b)
+    dist = np.full((n, b), -1, dtype=np.int32)
+    sigma = np.zeros((n, b))
+    dist[sources, columns] = 0
+    sigma[sources, columns] = 1.0
+    frontier = sigma.copy()
+    depth = 0
+    while True:
+        # reach[v, j]：第 j 个起点经过当前层到达 v 的最短路径数
+        reach = pattern_T @ frontier
+        new = (reach > 0) & (dist < 0)
+        if not new.any():
+            break
+        depth += 1
+        dist[new] = depth
+        frontier = np.where(new, reach, 0.0)
+        sigma += frontier
+    record("iterations", depth)
+    if not accumulate_dependency:
+        return dist, None
+
+    # 按层反向累积依赖值：δ(v) = Σ_{v→w, d(w)=d(v)+1} σ(v) / σ(w) · (1 + δ(w))
+    delta = np.zeros((n, b))
+    safe_sigma = np.where(sigma > 0, sigma, 1.0)
+    for level in range(depth, 0, -1):
+        coefficient = np.where(dist == level, (1.0 + delta) / safe_sigma, 0.0)
+        delta += np.where(dist == level - 1, sigma * (pattern @ coefficient), 0.0)
+    delta[sources, columns] = 0.0
+    return dist, delta
+
+
+def required_samples(n, epsilon, confidence):
+    """
+    抽样数：每个节点的归一化估计值与精确值之差不超过 epsilon 的概率不低于 confidence
+    （Hoeffding 不等式 + 对 n 个节点的联合界），即 ln(2n / (1 - confidence)) / (2·epsilon²)。
+    :param epsilon: 大于 0；confidence 在 (0, 1) 内（由 _budget_error 检查）
+    """
+    return math.ceil(math.log(2 * max(n, 1) / (1 - confidence)) / (2 * epsilon ** 2))
+
+
+def sampled_path_centrality(pattern, budgets, seed=0):
+    """
+    近似介数中心性与接近中心性（有向无权最短路径，归一化方式与 networkx 一致），两项指标共用同一批 BFS。
+    :param pattern: 活跃节点之间的 0/1 邻接矩阵（CSR，行为起点、列为终点）
+    :param budgets: {指标名: 预算}，指标为 betweenness / closeness，预算包含 epsilon、confidence、
+                    max_samples、max_seconds；抽样数达到 epsilon 所需的数量或超过 max_seconds 后停止
+    :return: {指标名: (中心性数组, 统计信息)}
+    """
+    n = pattern.shape[0]
+    pattern_T = pattern.T.tocsr()
+    order = np.random.default_rng(seed).permutation(n)
+    batch_size = max(1, CENTRALITY_CONFIG["batch_elements"] // max(n, 1))
+
+    state = {}
+    for name, budget in budgets.items():
+        state[name] = {"target": max(min(required_samples(n, budget["epsilon"], budget["confidence"]),
+                                         budget["max_samples"], n), 1),
+                       "max_seconds": budget["max_seconds"], "used": 0, "seconds": 0.0}
+    betweenness = np.zeros(n)
+    reached = np.zeros(n)        # 抽样起点中能到达该节点的个数（不含节点自身）
+    distance_sum = np.zeros(n)   # 抽样起点到该节点的距离之和
+    as_source = np.zeros(n)      # 节点自身被抽为起点的次数
+
+    start = time.perf_counter()
+    position = 0
+    while True:
+        # 未达到抽样数、且没有超时的指标继续参与（每项指标至少一批）
+        running = [name for name, s in state.items()
+                   if s["used"] < s["target"] and (s["used"] == 0 or time.perf_counter() - start < s["max_seconds"])]
+        if not running or position >= n:
+            break
+        count = min(batch_size, max(state[name]["target"] - state[name]["used"] for name in running))
+        sources = order[position:position + count]
+        position += len(sources)
+
+        dist, delta = _bfs_batch(pattern, pattern_T, sources, "betweenness" in running)
+        # 每项指标只使用本批中不超过其剩余抽样数的前若干个起点
+        take = {name: min(len(sources), state[name]["target"] - state[name]["used"]) for name in running}
+        if "betweenness" in take:
+            betweenness += delta[:, :take["betweenness"]].sum(axis=1)
+        if "closeness" in take:
+            reachable = dist[:, :take["closeness"]] > 0
+            reached += reachable.sum(axis=1)
+            distance_sum += np.where(reachable, dist[:, :take["closeness"]], 0).sum(axis=1)
+            as_source[sources[:take["closeness"]]] += 1
+        for name in running:
+            state[name]["used"] += take[name]
+            state[name]["seconds"] = time.perf_counter() - start
+
+    results = {}
+    for name, s in state.items():
+        used = s["used"]
+        budget = budgets[name]
+        if name == "betweenness":
+            scale = 1.0 / ((n - 1) * (n - 2)) * n / used if n > 2 and used else 0.0
+            values = betweenness * scale
+        else:
+            # 接近中心性（Wasserman-Faust）：(r - 1) / Σd · (r - 1) / (n - 1)，r - 1 与 n - 1 按抽样比例估计
+            others = np.maximum(used - as_source, 1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.where(distance_sum > 0, reached / distance_sum * reached / others, 0.0)
+        exact = used >= n
+        results[name] = (values, {
+            "samples": used,
+            "exact": exact,
+            "error_bound": 0.0 if exact or not used else round(
+                math.sqrt(math.log(2 * n / (1 - budget["confidence"])) / (2 * used)), 6),
+            "seconds": round(s["seconds"], 4)
+        })
+    return results
+
+
+def _budget_error(overrides):
+    """
+    检查请求中的预算覆盖值：必须是有限的正数，confidence 还必须小于 1。
+    :return: 错误信息，全部有效时返回 None
+    """
+    for metric, budget in (overrides or {}).items():
+        for key, value in budget.items():
+            if not math.isfinite(value) or value <= 0 or (key == "confidence" and value >= 1):
+                expected = "(0, 1) 内的数" if key == "confidence" else "有限的正数"
+                return f"无效的预算 {metric}_{key}={value}（应为{expected}）"
+    return None
+
+
+def _budgets(overrides):
+    """各指标的预算：默认值（CENTRALITY_CONFIG["budgets"]）合并请求中的覆盖值，迭代次数、抽样数和耗时不超过 limits"""
+    limits = CENTRALITY_CONFIG["limits"]
+    budgets = {}
+    for metric, defaults in CENTRALITY_CONFIG["budgets"].items():
+        budget = dict(defaults, **(overrides or {}).get(metric, {}))
+        for key, limit in limits.items():
+            if key in budget:
+                budget[key] = min(budget[key], limit)
+        budgets[metric] = budget
+    return budgets
+
+
+def _active_pattern(snapshot):
+    """有消息往来的用户（布尔数组）以及这些用户之间的 0/1 有向邻接矩阵（每个快照只构建一次）"""
+    def build():
+        adjacency = snapshot.message_adj
+        active = (np.diff(adjacency.indptr) > 0) | (np.bincount(adjacency.indices, minlength=snapshot.num_users) > 0)
+        index = np.flatnonzero(active)
+        pattern = adjacency[index][:, index].tocsr()
+        pattern.data = np.ones_like(pattern.data)
+        return active, pattern
+    return snapshot.cached("centrality_active_pattern", build)
+
+
+def compute_centrality(snapshot, metrics, budgets=None):
+    """
+    计算快照上的多项中心性指标。结果按指标和预算缓存在快照上（抽样使用固定种子，结果可复现）。
+    :param metrics: 指标名列表（CENTRALITY_METRICS 的子集）
+    :param budgets: {指标名: {预算项: 值}}，覆盖默认预算
+    :return: ({指标名: 与快照用户对齐的数组}, {指标名: 统计信息})
+    """
+    budgets = _budgets(budgets)
+    values, stats = {}, {}
+
+    def degree(axis):
+        start = time.perf_counter()
+        result = np.asarray(snapshot.message_adj.sum(axis=axis)).ravel()
+        return result, {"seconds": round(time.perf_counter() - start, 4)}
+
+    def eigenvector():
+        start = time.perf_counter()
+        budget = budgets["eigenvector"]
+        active, _ = _active_pattern(snapshot)
+        result, iterations, converged = eigenvector_centrality(snapshot.message_adj, active, budget["tol"],
+                                                               budget["max_iter"])
+        return result, {"iterations": iterations, "converged": bool(converged),
+                        "seconds": round(time.perf_counter() - start, 4)}
+
+    def kcore():
+        start = time.perf_counter()
+        active, pattern = _active_pattern(snapshot)
+        undirected = (pattern + pattern.T).tocsr()
+        undirected.setdiag(0)
+        undirected.eliminate_zeros()
+        result = np.zeros(snapshot.num_users, dtype=np.int64)
+        result[active] = core_number(undirected)
+        return result, {"seconds": round(time.perf_counter() - start, 4)}
+
+    builders = {"in_degree": lambda: degree(0), "out_degree": lambda: degree(1),
+                "eigenvector": eigenvector, "kcore": kcore}
+    for metric in metrics:
+        if metric in builders:
+            key = ("centrality", metric, tuple(sorted(budgets.get(metric, {}).items())))
+            values[metric], stats[metric] = snapshot.cached(key, builders[metric])
+
+    sampled = {metric: budgets[metric] for metric in _SAMPLED if metric in metrics}
+    if sampled:
+        key = ("centrality_sampled", tuple((metric, tuple(sorted(budget.items()))) for metric, budget in sampled.items()))
+
+        def paths():
+            active, pattern = _active_pattern(snapshot)
+            results = {}
+            for metric, (result, info) in sampled_path_centrality(pattern, sampled, CENTRALITY_CONFIG["seed"]).items():
+                full = np.zeros(snapshot.num_users)
+                full[active] = result
+                results[metric] = (full, info)
+            return results
+
+        for metric, (result, info) in snapshot.cached(key, paths).items():
+            values[metric], stats[metric] = result, info
+    return values, stats
+
+
+@timed
+def analyze_centrality(metrics=None, budgets=None, snapshot=None):
+    """
+    计算用户中心性。
+    :param metrics: 指标名列表，默认只计算加权入度（接收消息的数量）；每项指标按名称各占一列，
+                    第一项指标同时写入 centrality 列并决定节点颜色和大小
+    :param budgets: {指标名: {预算项: 值}}，覆盖 CENTRALITY_CONFIG 中的默认精度 / 时间预算
+    :param snapshot: 共享图快照，默认使用进程内的最新快照
+    :return: {"nodes", "edges", "centrality_metrics": 各指标的统计信息（耗时、迭代次数、抽样数、误差上界等）}；
+             指标名或预算值无效时返回 error
+    """
+    metrics = list(dict.fromkeys(metrics or CENTRALITY_CONFIG["default_metrics"]))
+    unknown = [metric for metric in metrics if metric not in CENTRALITY_METRICS]
+    if unknown:
+        return {"error": f"未知的中心性指标：{', '.join(unknown)}（可选：{', '.join(CENTRALITY_METRICS)}）"}
+    error = _budget_error(budgets)
+    if error:
+        return {"error": error}
+    snapshot = snapshot or get_snapshot()
+
+    values, stats = compute_centrality(snapshot, metrics, budgets)
+    centrality = values[metrics[0]]
+    vmin, vmax = value_range(centrality)
+
+    # 🎨 颜色划分与节点大小（整列一次完成）
+    node_colors = color_levels(centrality, "viridis", vmin, vmax)
+    node_sizes = scale_sizes(centrality, (1000, 6000), vmin, vmax)
+
+    # 构造 JSON 格式的节点数据与边数据
+    extra = {metric: values[metric] for metric in metrics}
+    nodes = build_nodes(snapshot, size=node_sizes, color=node_colors, centrality=centrality, **extra)
+    edges = message_edges(snapshot)
+
+    return {"nodes": nodes, "edges": edges, "centrality_metrics": {metric: stats[metric] for metric in metrics}}
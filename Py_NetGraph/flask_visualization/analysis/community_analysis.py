@@ -1,38 +1,104 @@
 import colorsys
+import threading
+import time
 from collections import defaultdict
-import networkx as nx
+import numpy as np
 from community import community_louvain
-from database import fetch_data
-
-def analyze_community():
-    """获取用户社区划分数据"""
-
-    # 查询所有用户信息
-    query_users = "SELECT id, username FROM users"
-    df_users = fetch_data(query_users)
-
-    # 查询好友关系数据
-    query_friends = """
-        SELECT f.user_id, u1.username AS user_name_1, 
-               f.friend_id, u2.username AS user_name_2
-        FROM friends f
-        JOIN users u1 ON f.user_id = u1.id
-        JOIN users u2 ON f.friend_id = u2.id
+from config import LOUVAIN_CONFIG
+from metrics import record, timed
+from .graph_snapshot import get_snapshot
+from .payload import build_nodes, build_edges
+
+# 最近一次 Louvain 划分的最细一层 {用户 ID: 社区编号}，用于下一个快照的热启动
+_previous_partition = None
+_previous_lock = threading.Lock()
+
+
+def _warm_start_partition(graph, previous):
+    """
+    以上一个快照的最细一层划分为初始划分：已有用户沿用原社区，新用户各自成为一个社区。
+    :return: (初始划分, 沿用社区的用户比例)
+    """
+    next_id = max(previous.values(), default=-1) + 1
+    part_init, reused = {}, 0
+    for node in graph.nodes():
+        if node in previous:
+            part_init[node] = previous[node]
+            reused += 1
+        else:
+            part_init[node] = next_id
+            next_id += 1
+    return part_init, reused / max(graph.number_of_nodes(), 1)
+
+
+def louvain_dendrogram(snapshot):
+    """
+    好友关系图上的 Louvain 层次划分（每个快照只计算一次，固定随机种子，结果可复现）。
+    好友关系变化不大时以上一个快照的最细一层划分为初值热启动，只需少量移动即可收敛。
+    :return: {"levels": [每层的 {用户 ID: 社区编号}，从最细到最粗], "stats": [每层的社区数和模块度],
+              "seconds": 计算耗时, "warm_start": 是否热启动, "reused": 沿用社区的用户比例}，调用方不得修改
     """
-    df_friends = fetch_data(query_friends)
+    def compute():
+        global _previous_partition
+        start = time.time()
+        graph = snapshot.friend_graph()
+        with _previous_lock:
+            previous = _previous_partition
 
-    # 构建无向图（每个用户为一个节点，好友关系为一条边）
-    G = nx.Graph()
+        part_init, reused = None, 0.0
+        if previous is not None and graph.number_of_edges() > 0:
+            part_init, reused = _warm_start_partition(graph, previous)
+            if reused < LOUVAIN_CONFIG["warm_start_min_reuse"]:
+                part_init = None
 
-    # 创建一个用户映射，将用户ID与用户名进行关联
-    user_map = {row["id"]: row["username"] for _, row in df_users.iterrows()}
+        dendrogram = community_louvain.generate_dendrogram(graph, part_init=part_init,
+                                                           resolution=LOUVAIN_CONFIG["resolution"],
+                                                           random_state=LOUVAIN_CONFIG["seed"])
+        levels = [community_louvain.partition_at_level(dendrogram, level) for level in range(len(dendrogram))]
+        record("iterations", len(dendrogram))
+        seconds = time.time() - start
+        stats = [{
+            "level": level,
+            "communities": len(set(partition.values())),
+            "modularity": round(community_louvain.modularity(partition, graph), 6) if graph.number_of_edges() else 0.0
+        } for level, partition in enumerate(levels)]
 
-    # 在图中添加边（好友关系）
-    for _, row in df_friends.iterrows():
-        G.add_edge(row["user_id"], row["friend_id"])
+        with _previous_lock:
+            _previous_partition = levels[0]
+        print(f"🧩 Louvain 社区划分完成：{len(levels)} 层，最终 {stats[-1]['communities']} 个社区，"
+              f"模块度 {stats[-1]['modularity']}（{'热启动' if part_init is not None else '冷启动'}），"
+              f"耗时 {seconds:.3f} 秒")
+        return {"levels": levels, "stats": stats, "seconds": round(seconds, 3),
+                "warm_start": part_init is not None, "reused": round(reused, 4)}
 
-    # 使用 Louvain 算法进行社区划分
-    partition = community_louvain.best_partition(G)
+    return snapshot.cached("louvain_dendrogram", compute)
+
+
+def louvain_partition(snapshot, level=None):
+    """
+    好友关系图上的 Louvain 社区划分，返回 {用户 ID: 社区编号}，调用方不得修改。
+    :param level: 层次划分的层号（0 为最细），默认使用最粗的一层（与 best_partition 相同）
+    """
+    levels = louvain_dendrogram(snapshot)["levels"]
+    if level is None:
+        return levels[-1]
+    return levels[min(max(int(level), 0), len(levels) - 1)]
+
+
+@timed
+def analyze_community(snapshot=None, level=None):
+    """
+    获取用户社区划分数据
+    :param level: 层次划分的层号（0 为最细），默认使用最粗的一层；超出范围时取最接近的一层
+    """
+    snapshot = snapshot or get_snapshot()
+
+    # 用户映射（用户ID -> 用户名），来自共享快照
+    user_map = snapshot.user_map
+
+    # 使用 Louvain 算法进行社区划分（层次划分在快照内缓存，切换层号不需要重新计算）
+    dendrogram = louvain_dendrogram(snapshot)
+    partition = dict(louvain_partition(snapshot, level))
 
     # 将每个社区的用户进行分组
     community_map = defaultdict(list)
@@ -53,15 +119,16 @@ def analyze_community():
     ]
 
     # 构造节点数据（每个用户的社区ID和对应的颜色）
-    nodes = [
-        {"id": int(user_id), "username": user_map.get(user_id, "未知用户"),
-         "community": partition.get(user_id), "color": colors[partition[user_id]]}
-        for user_id in user_map.keys()
-    ]
+    community_ids = np.array([partition[user_id] for user_id in user_map.keys()], dtype=np.int64)
+    nodes = build_nodes(snapshot, community=community_ids, color=np.array(colors, dtype=object)[community_ids])
 
     # 构造边数据，表示好友关系的连接
-    edges = [{"source": int(u), "target": int(v)} for u, v in G.edges()]
+    edges = build_edges(snapshot, *snapshot.friend_edges())
 
-    # 返回分析结果：节点数据、边数据、社区映射、每个社区的颜色
-    return {"nodes": nodes, "edges": edges, "community_map": community_map, "colors": colors}
+    # 返回分析结果：节点数据、边数据、社区映射、每个社区的颜色，以及各层的社区数、模块度和计算耗时
+    num_levels = len(dendrogram["levels"])
+    return {"nodes": nodes, "edges": edges, "community_map": community_map, "colors": colors,
+            "level": num_levels - 1 if level is None else min(max(int(level), 0), num_levels - 1),
+            "levels": dendrogram["stats"], "louvain_seconds": dendrogram["seconds"],
+            "warm_start": dendrogram["warm_start"]}
 
@@ -0,0 +1,207 @@
+"""
+服务端力导向布局
+在好友关系图和消息交互图上计算 ForceAtlas2 风格的节点坐标（斥力使用网格聚合的 Barnes–Hut 近似，
+全部为整体数组运算），每个快照每种图只计算一次。新快照以上一个快照的坐标为初值热启动，
+图变化不大时只需少量迭代即可收敛。前端拿到坐标后直接静态渲染，不必在浏览器中运行力导向布局。
+"""
+import threading
+import time
+import numpy as np
+from config import LAYOUT_CONFIG
+from metrics import record, timed
+from .graph_snapshot import get_snapshot
+from .payload import ColumnTable
+
+# 每种图最近一次的布局结果 {图类型: (用户 ID 数组, 坐标数组)}，用于下一个快照的热启动
+_previous_layouts = {}
+_previous_lock = threading.Lock()
+
+
+def _repulsion(pos, mass, grid_size, scaling, chunk_size=8192):
+    """
+    斥力（与质量乘积成正比、与距离成反比）的网格近似：节点按坐标落入 grid_size × grid_size 的网格，
+    每个节点只与各网格的质心作用（自身所在网格的质心扣除节点自身），复杂度 O(N · 网格数)。
+    """
+    lo, hi = pos.min(axis=0), pos.max(axis=0)
+    cell_size = np.maximum((hi - lo) / grid_size, 1e-9)
+    cell_xy = np.minimum(((pos - lo) / cell_size).astype(np.int64), grid_size - 1)
+    _, cell_of = np.unique(cell_xy[:, 0] * grid_size + cell_xy[:, 1], return_inverse=True)
+
+    cell_mass = np.bincount(cell_of, weights=mass)
+    moment_x = np.bincount(cell_of, weights=mass * pos[:, 0])
+    moment_y = np.bincount(cell_of, weights=mass * pos[:, 1])
+    centroid_x = (moment_x / cell_mass).astype(np.float32)
+    centroid_y = (moment_y / cell_mass).astype(np.float32)
+    weights = cell_mass.astype(np.float32)
+    softening = np.float32((0.5 * cell_size.mean()) ** 2)  # 避免距离过近时斥力发散
+
+    # 1. 所有节点与所有网格质心作用（分块计算，控制临时数组大小）
+    force = np.empty_like(pos)
+    x, y = pos[:, 0].astype(np.float32), pos[:, 1].astype(np.float32)
+    for start in range(0, len(pos), chunk_size):
+        stop = min(start + chunk_size, len(pos))
+        dx = x[start:stop, None] - centroid_x[None, :]
+        dy = y[start:stop, None] - centroid_y[None, :]
+        inv = dx * dx
+        inv += dy * dy
+        inv += softening
+        np.divide(weights, inv, out=inv)
+        force[start:stop, 0] = np.einsum("ij,ij->i", dx, inv)
+        force[start:stop, 1] = np.einsum("ij,ij->i", dy, inv)
+
+    # 2. 自身所在网格：去掉按整格质心计算的部分，换成扣除节点自身后的质量和质心
+    own_mass = cell_mass[cell_of]
+    full_dx = pos[:, 0] - moment_x[cell_of] / own_mass
+    full_dy = pos[:, 1] - moment_y[cell_of] / own_mass
+    full = own_mass / (full_dx ** 2 + full_dy ** 2 + softening)
+    rest_mass = own_mass - mass
+    safe_mass = np.maximum(rest_mass, 1e-12)
+    rest_dx = np.where(rest_mass > 1e-9, pos[:, 0] - (moment_x[cell_of] - mass * pos[:, 0]) / safe_mass, 0.0)
+    rest_dy = np.where(rest_mass > 1e-9, pos[:, 1] - (moment_y[cell_of] - mass * pos[:, 1]) / safe_mass, 0.0)
+    rest = rest_mass / (rest_dx ** 2 + rest_dy ** 2 + softening)
+    force[:, 0] += rest_dx * rest - full_dx * full
+    force[:, 1] += rest_dy * rest - full_dy * full
+
+    force *= (scaling * mass)[:, None]
+    return force
+
+
+def force_layout(num_nodes, src, dst, weight, init_pos=None, iterations=100, grid_size=16, scaling=2.0,
+                 gravity=1.0, max_step=None, seed=0):
+    """
+    ForceAtlas2 风格的力导向布局（线性引力、质量 = 度数 + 1、常量重力）。
+    :param src / dst / weight: 无向边（每条边只需出现一次）
+    :param init_pos: N×2 初始坐标（热启动），默认随机初始化
+    :param iterations: 迭代次数
+    :param max_step: 首轮单个节点的最大位移，之后逐轮衰减；默认按布局尺寸自动确定
+    :return: N×2 坐标数组
+    """
+    rng = np.random.default_rng(seed)
+    mass = np.bincount(src, minlength=num_nodes) + np.bincount(dst, minlength=num_nodes) + 1.0
+    radius = np.sqrt(num_nodes) * 10
+    pos = rng.uniform(-radius, radius, (num_nodes, 2)) if init_pos is None else np.array(init_pos, dtype=np.float64)
+    if num_nodes <= 1:
+        return np.zeros((num_nodes, 2)) if init_pos is None else pos
+
+    step = radius / 10 if max_step is None else max_step
+    for _ in range(iterations):
+        force = _repulsion(pos, mass, grid_size, scaling)
+
+        # 引力：沿边线性吸引（与边权重成正比）
+        delta = pos[src] - pos[dst]
+        pull = delta * weight[:, None]
+        for axis in range(2):
+            force[:, axis] -= np.bincount(src, weights=pull[:, axis], minlength=num_nodes)
+            force[:, axis] += np.bincount(dst, weights=pull[:, axis], minlength=num_nodes)
+
+        # 重力：把孤立节点和小分量拉向中心，大小与质量成正比
+        norm = np.maximum(np.linalg.norm(pos, axis=1), 1e-9)
+        force -= (gravity * mass / norm)[:, None] * pos
+
+        # 位移 = 力 / 质量，单步位移不超过 step，逐轮冷却
+        displacement = force / mass[:, None]
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-12)
+        pos += displacement * (np.minimum(length, step) / length)[:, None]
+        step *= 0.95
+    record("iterations", iterations)
+    return pos
+
+
+def _graph_edges(snapshot, graph):
+    """布局使用的无向边：好友关系（权重 1）或消息交互（正反方向合并，权重取 log(1 + 消息数)）"""
+    if graph == "friends":
+        src, dst = snapshot.friend_edges()
+        src, dst = src.astype(np.int64), dst.astype(np.int64)
+        keep = src != dst
+        return src[keep], dst[keep], np.ones(int(keep.sum()))
+    adjacency = (snapshot.message_adj + snapshot.message_adj.T).tocoo()
+    upper = adjacency.row < adjacency.col
+    return (adjacency.row[upper].astype(np.int64), adjacency.col[upper].astype(np.int64),
+            np.log1p(adjacency.data[upper]))
+
+
+def _warm_start(snapshot, src, dst, previous):
+    """
+    以上一个快照的坐标为初值：已有用户沿用原坐标，新用户放在已定位邻居的平均位置（没有邻居时随机放置）。
+    :return: (初始坐标, 沿用坐标的用户比例)
+    """
+    prev_ids, prev_pos = previous
+    n = snapshot.num_users
+    rng = np.random.default_rng(0)
+    i = np.minimum(np.searchsorted(prev_ids, snapshot.user_ids), max(len(prev_ids) - 1, 0))
+    known = (prev_ids[i] == snapshot.user_ids) if len(prev_ids) else np.zeros(n, dtype=bool)
+
+    spread = prev_pos.std(axis=0).mean() if len(prev_pos) else 1.0
+    pos = rng.normal(0, spread, (n, 2))
+    pos[known] = prev_pos[i[known]]
+
+    # 新用户：取已定位邻居坐标的平均值，加少量抖动避免重合
+    edge_src, edge_dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    placed = known[edge_dst] & ~known[edge_src]
+    counts = np.bincount(edge_src[placed], minlength=n)
+    has_neighbors = (counts > 0) & ~known
+    for axis in range(2):
+        sums = np.bincount(edge_src[placed], weights=pos[edge_dst[placed], axis], minlength=n)
+        pos[has_neighbors, axis] = sums[has_neighbors] / counts[has_neighbors]
+    pos[has_neighbors] += rng.normal(0, spread * 0.01, (int(has_neighbors.sum()), 2))
+    return pos, float(known.mean()) if n else 0.0
+
+
+def compute_layout(snapshot, graph="friends"):
+    """
+    计算快照上好友关系图（graph="friends"）或消息交互图（graph="messages"）的布局坐标（每个快照只计算一次）。
+    :return: N×2 坐标数组，按快照用户下标对齐
+    """
+    def compute():
+        start = time.time()
+        src, dst, weight = _graph_edges(snapshot, graph)
+        with _previous_lock:
+            previous = _previous_layouts.get(graph)
+
+        iterations, init_pos, max_step, reused = LAYOUT_CONFIG["iterations"], None, None, 0.0
+        if previous is not None:
+            init_pos, reused = _warm_start(snapshot, src, dst, previous)
+            if reused >= LAYOUT_CONFIG["warm_start_min_reuse"]:
+                # 大部分节点沿用旧坐标：少量迭代、较小的步长
+                iterations = LAYOUT_CONFIG["warm_iterations"]
+                max_step = init_pos.std(axis=0).mean() / 50
+
+        pos = force_layout(snapshot.num_users, src, dst, weight, init_pos=init_pos, iterations=iterations,
+                           grid_size=LAYOUT_CONFIG["grid_size"], max_step=max_step)
+        with _previous_lock:
+            _previous_layouts[graph] = (snapshot.user_ids.copy(), pos)
+        print(f"🧭 {graph} 布局完成：{snapshot.num_users} 个节点，{iterations} 次迭代"
+              f"（沿用旧坐标 {reused:.0%}），耗时 {time.time() - start:.3f} 秒")
+        return pos
+
+    return snapshot.cached(f"layout_{graph}", compute)
+
+
+@timed
+def with_layout(data, graph, snapshot=None):
+    """
+    为分析结果的节点表加上 x / y 坐标列（按用户 ID 对齐，结果中存在而快照中没有的用户坐标为 NaN）。
+    :return: 新字典，nodes 为加上坐标列的记录表
+    """
+    nodes = data.get("nodes")
+    if not isinstance(nodes, ColumnTable):
+        return data
+    snapshot = snapshot or get_snapshot()
+    pos = compute_layout(snapshot, graph)
+
+    ids = nodes.column("id")
+    i = np.minimum(np.searchsorted(snapshot.user_ids, ids), max(snapshot.num_users - 1, 0))
+    found = (snapshot.user_ids[i] == ids) if snapshot.num_users else np.zeros(len(ids), dtype=bool)
+    xy = np.full((len(ids), 2), np.nan)
+    xy[found] = np.round(pos[i[found]], 2)
+
+    result = dict(data)
+    result["nodes"] = ColumnTable({**nodes.columns, "x": xy[:, 0], "y": xy[:, 1]})
+    return result
+
+
+@timed
+def precompute_layout(graph):
+    """为进程内最新快照预先计算布局（供后台预计算任务调用），返回布局规模"""
+    snapshot = get_snapshot()
+    return {"graph": graph, "nodes": len(compute_layout(snapshot, graph))}
@@ -0,0 +1,308 @@
+"""
+共享图快照
+进程内只加载一次用户、好友关系和时间窗口内的消息交互数据，
+以整数下标的 CSR 稀疏矩阵保存，供所有分析模块复用。
+配置了 SNAPSHOT_CONFIG["shared_dir"] 时，快照写入快照文件（见 snapshot_store.py），
+多个 worker 进程以只读 mmap 打开同一文件，共用一份物理内存，只有一个进程查询数据库并构建。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from config import SNAPSHOT_CONFIG
+import database
+from database import fetch_data, fetch_columns_concurrently
+from metrics import phase, record
+from .user_directory import UserDirectory, get_user_directory
+from .snapshot_store import write_snapshot_file, open_snapshot_file, find_snapshot_file, remove_stale_files, \
+    build_lock
+
+
+class GraphSnapshot:
+    """
+    某一时刻的只读图数据快照。
+
+    - directory: 加载快照时的用户目录（见 user_directory.py）
+    - user_ids: 按 ID 升序排列的用户 ID 数组，数组下标即用户在图中的下标
+    - usernames: 与 user_ids 对齐的用户名列表
+    - friend_src / friend_dst: friends 表中的好友关系（用户下标）
+    - friend_adj: 对称、去重后的好友关系 CSR 邻接矩阵
+    - message_src / message_dst / message_weight: 时间窗口内的消息交互（用户下标，权重为消息数）
+    - message_adj: 有向消息交互 CSR 邻接矩阵（行为发送者，列为接收者）
+    - message_watermark: 快照包含的最大 messages.id，之后的消息不在快照中
+    - data_version: 加载快照时的数据版本（见 fetch_data_version），用于判断数据是否有变化
+    """
+
+    # 写入快照文件的数组（用户目录的数组另见 UserDirectory.to_arrays）
+    _ARRAYS = ("friend_src", "friend_dst", "message_src", "message_dst", "message_weight")
+    _MATRICES = ("friend_adj", "message_adj")
+
+    def __init__(self, directory, friend_pairs, message_edges, window_days, message_watermark=0, data_version=None):
+        self._attach(directory, window_days, message_watermark, data_version, time.time())
+
+        friend_user, friend_other = friend_pairs
+        self.friend_src, self.friend_dst, _ = self._to_index_pairs(friend_user, friend_other)
+        self.friend_adj = self._build_friend_adj()
+
+        sender, receiver, weight = message_edges
+        self.message_src, self.message_dst, keep = self._to_index_pairs(sender, receiver)
+        self.message_weight = np.asarray(weight, dtype=np.float64)[keep]
+        self.message_adj = sp.csr_matrix(
+            (self.message_weight, (self.message_src, self.message_dst)),
+            shape=(self.num_users, self.num_users)
+        )
+
+    def _attach(self, directory, window_days, message_watermark, data_version, loaded_at):
+        self.directory = directory
+        self.user_ids = directory.ids
+        self.usernames = directory.usernames
+        self.num_users = directory.size
+        self.window_days = window_days
+        self.message_watermark = int(message_watermark)
+        self.data_version = data_version
+        self.loaded_at = loaded_at
+        self._derived = {}
+        self._derived_lock = threading.RLock()
+
+    def to_arrays(self):
+        """转换为可写入快照文件的 {名称: 数组}（CSR 矩阵拆为 indptr / indices / data）"""
+        arrays = self.directory.to_arrays()
+        for name in self._ARRAYS:
+            arrays[name] = getattr(self, name)
+        for name in self._MATRICES:
+            matrix = getattr(self, name)
+            arrays.update({f"{name}_indptr": matrix.indptr, f"{name}_indices": matrix.indices,
+                           f"{name}_data": matrix.data})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, window_days, message_watermark=0, data_version=None, loaded_at=None):
+        """由 to_arrays 的结果（如快照文件的只读内存映射视图）创建快照，所有数组和矩阵都不复制"""
+        snapshot = cls.__new__(cls)
+        directory = UserDirectory.from_arrays(arrays)
+        snapshot._attach(directory, window_days, message_watermark, data_version,
+                         time.time() if loaded_at is None else loaded_at)
+        for name in cls._ARRAYS:
+            setattr(snapshot, name, arrays[name])
+        n = directory.size
+        for name in cls._MATRICES:
+            matrix = sp.csr_matrix((arrays[f"{name}_data"], arrays[f"{name}_indices"], arrays[f"{name}_indptr"]),
+                                   shape=(n, n), copy=False)
+            matrix.has_sorted_indices = True  # 写入时已是规范格式，避免在只读数组上原地排序
+            setattr(snapshot, name, matrix)
+        return snapshot
+
+    def _to_index_pairs(self, a, b):
+        """将用户 ID 对转换为用户下标对，丢弃任一端不在用户目录中的边，返回 (下标, 下标, 保留的边)"""
+        src, dst = self.directory.lookup(a), self.directory.lookup(b)
+        keep = (src >= 0) & (dst >= 0)
+        if keep.all():
+            return src, dst, keep
+        return src[keep], dst[keep], keep
+
+    def _build_friend_adj(self):
+        """构建对称、去重的好友关系邻接矩阵"""
+        n = self.num_users
+        ones = np.ones(len(self.friend_src), dtype=np.int8)
+        adj = sp.csr_matrix((ones, (self.friend_src, self.friend_dst)), shape=(n, n))
+        adj = (adj + adj.T).tocsr()
+        adj.data[:] = 1
+        return adj
+
+    def index_of(self, user_id):
+        """用户 ID 转换为下标，不存在时返回 None"""
+        return self.directory.index_of(user_id)
+
+    @property
+    def user_map(self):
+        """{用户 ID: 用户名} 字典（与使用同一用户目录的快照共用）"""
+        return self.directory.user_map
+
+    def friend_edges(self):
+        """去重后的无向好友边 (u_index, v_index)，u <= v"""
+        upper = sp.triu(self.friend_adj, format="coo")
+        return upper.row, upper.col
+
+    def message_graph(self):
+        """消息交互有向图（networkx），节点为用户 ID，仅包含有消息往来的用户"""
+        def build():
+            G = nx.DiGraph()
+            G.add_weighted_edges_from(zip(self.user_ids[self.message_src].tolist(),
+                                          self.user_ids[self.message_dst].tolist(),
+                                          self.message_weight.tolist()))
+            return G
+        return self.cached("message_graph", build)
+
+    def friend_graph(self):
+        """好友关系无向图（networkx），节点为用户 ID，仅包含有好友的用户"""
+        def build():
+            G = nx.Graph()
+            G.add_edges_from(zip(self.user_ids[self.friend_src].tolist(),
+                                 self.user_ids[self.friend_dst].tolist()))
+            return G
+        return self.cached("friend_graph", build)
+
+    def cached(self, key, builder):
+        """
+        获取基于本快照派生的数据结构（图对象、索引等），每个快照只构建一次。
+        派生结构随快照一起失效，调用方不得修改返回对象；构建函数内可以再获取其他派生结构。
+        """
+        value = self._derived.get(key)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = builder()
+                    self._derived[key] = value
+        return value
+
+
+def fetch_message_watermark():
+    """查询当前消息水位线（messages 表的最大自增 ID），没有消息时返回 0"""
+    df = fetch_data("SELECT MAX(id) AS max_id FROM messages")
+    if df is None or df.empty or df["max_id"].isna().iloc[0]:
+        return 0
+    return int(df["max_id"].iloc[0])
+
+
+# 好友关系变更计数器（见 DDL 中的 data_version 表及其触发器），一次主键查找
+_VERSION_QUERY = """
+    SELECT (SELECT MAX(id) FROM messages) AS message_watermark,
+           (SELECT MAX(id) FROM users) AS user_watermark,
+           (SELECT version FROM data_version WHERE table_name = 'friends') AS friend_version
+"""
+
+# 没有计数器表的数据库（旧库、Parquet 导出）：好友关系数和逐对哈希之和，需要扫描整个 friends 表；
+# 每对 (user_id, friend_id) 先取模再平方，交换好友对（如 (1,5),(2,4) 换成 (1,4),(2,5)）也会改变校验和
+_PAIR_KEY = "((user_id * 1000003 + friend_id) % 2147483647)"
+_CHECKSUM_QUERY = f"""
+    SELECT (SELECT MAX(id) FROM messages) AS message_watermark,
+           (SELECT MAX(id) FROM users) AS user_watermark,
+           COUNT(*) AS friend_count,
+           SUM({_PAIR_KEY} * {_PAIR_KEY} % 2147483647) AS friend_checksum
+    FROM friends
+"""
+
+# 已确认没有计数器表的连接工厂（切换存储后端后重新检测）
+_no_counter = set()
+
+
+def fetch_data_version():
+    """
+    查询数据版本：(消息水位线, 用户水位线, 好友关系变更计数)。
+    新消息、新用户以及好友关系的增删改都会改变数据版本，三项都是索引 / 主键查找。
+    数据库中没有 data_version 计数器表时退回为 (消息水位线, 用户水位线, 好友关系数, 好友关系校验和)，
+    校验和需要扫描整个 friends 表，并且只能以很高的概率（而非保证）发现变化。
+    """
+    connect = database.pool.connect
+    df = None
+    if connect not in _no_counter:
+        try:
+            df = fetch_data(_VERSION_QUERY)
+        except Exception:
+            df = fetch_data(_CHECKSUM_QUERY)  # 数据库不可用时这里同样失败，不会误判为没有计数器表
+            _no_counter.add(connect)
+            print("⚠️ 数据库中没有 data_version 计数器表（见 DDL），好友关系版本改用全表校验和")
+    if df is None:
+        df = fetch_data(_CHECKSUM_QUERY)
+    return tuple(0 if value is None or value != value else int(value) for value in df.iloc[0].tolist())
+
+
+@phase("graph_build")
+def load_snapshot(days=None):
+    """从数据库加载好友关系和最近 days 天的消息交互，与用户目录一起构建新的快照"""
+    days = SNAPSHOT_CONFIG["message_window_days"] if days is None else days
+    start_time_str = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    # 先读取数据版本，消息聚合以其中的消息水位线为界（不包含之后新写入的消息）
+    data_version = fetch_data_version()
+    watermark = data_version[0]
+
+    # 用户目录增量刷新（只读取新用户）；边查询只读取整数 ID 列，不再 JOIN users，不在目录中的用户的边在构建时丢弃
+    directory = get_user_directory(fresh=True)
+
+    query_friends = "SELECT user_id, friend_id FROM friends"
+
+    query_messages = f"""
+        SELECT sender_id, receiver_id, COUNT(*) AS weight
+        FROM messages
+        WHERE timestamp >= '{start_time_str}' AND id <= {watermark}
+        GROUP BY sender_id, receiver_id
+    """
+
+    # 两个查询互不依赖，并发执行
+    results = fetch_columns_concurrently({
+        "friends": (query_friends, {"user_id": np.int64, "friend_id": np.int64}),
+        "messages": (query_messages, {"sender_id": np.int64, "receiver_id": np.int64, "weight": np.float64})
+    })
+    friends, messages = results["friends"], results["messages"]
+
+    snapshot = GraphSnapshot(
+        directory,
+        (friends["user_id"], friends["friend_id"]),
+        (messages["sender_id"], messages["receiver_id"], messages["weight"]),
+        days,
+        watermark,
+        data_version
+    )
+    record("nodes", snapshot.num_users)
+    record("edges", len(snapshot.friend_src) + len(snapshot.message_src))
+    return snapshot
+
+
+def open_snapshot(path):
+    """以只读 mmap 打开快照文件，快照的加载时间为文件的构建时间（各进程按同一时间判断过期）"""
+    arrays, meta = open_snapshot_file(path)
+    return GraphSnapshot.from_arrays(arrays, meta["window_days"], meta["message_watermark"], meta["data_version"],
+                                     meta["built_at"])
+
+
+def load_shared_snapshot(days=None):
+    """
+    多进程共用的快照：优先打开其他进程已写好的、数据版本一致且未过期的快照文件；
+    否则取得构建锁后从数据库构建并写入快照文件（等锁期间其他进程已写好时直接打开），
+    构建的进程同样改为打开文件，不再持有私有的一份。
+    """
+    days = SNAPSHOT_CONFIG["message_window_days"] if days is None else days
+    store_dir, ttl = SNAPSHOT_CONFIG["shared_dir"], SNAPSHOT_CONFIG["ttl_seconds"]
+    path = find_snapshot_file(store_dir, days, fetch_data_version(), ttl)
+    if path is None:
+        with build_lock(store_dir, days, SNAPSHOT_CONFIG["build_timeout"]):
+            path = find_snapshot_file(store_dir, days, fetch_data_version(), ttl)
+            if path is None:
+                snapshot = load_snapshot(days)
+                start = time.time()
+                meta = {"window_days": days, "message_watermark": snapshot.message_watermark,
+                        "built_at": snapshot.loaded_at}
+                path = write_snapshot_file(store_dir, days, snapshot.data_version, snapshot.to_arrays(), meta)
+                remove_stale_files(store_dir, days, path, SNAPSHOT_CONFIG["build_timeout"])
+                print(f"💾 快照文件写入完成：{os.path.basename(path)}，{os.path.getsize(path) / 1024 / 1024:.2f} MB，"
+                      f"耗时 {time.time() - start:.3f} 秒")
+    return open_snapshot(path)
+
+
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(days=None):
+    """
+    获取进程内共享的图快照，快照过期（超过 ttl_seconds）时重新加载。
+    并发请求只会触发一次加载，其余请求等待并复用同一个快照；替换快照不影响仍在使用旧快照的请求。
+    """
+    days = SNAPSHOT_CONFIG["message_window_days"] if days is None else days
+    with _snapshot_lock:
+        snapshot = _snapshots.get(days)
+        if snapshot is None or time.time() - snapshot.loaded_at > SNAPSHOT_CONFIG["ttl_seconds"]:
+            snapshot = load_shared_snapshot(days) if SNAPSHOT_CONFIG["shared_dir"] else load_snapshot(days)
+            _snapshots[days] = snapshot
+        return snapshot
+
+
+def invalidate_snapshot():
+    """丢弃所有已缓存的快照，下一次访问时重新加载"""
+    with _snapshot_lock:
+        _snapshots.clear()
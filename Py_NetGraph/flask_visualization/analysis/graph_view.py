@@ -0,0 +1,191 @@
+"""
+大图可视化的服务端裁剪（细节层次控制）
+在分析结果的节点 / 边数组上按查询参数裁剪：最小边权重、k 跳自我网络、按分数取前 K 个节点，
+以及按社区聚合为超级节点（社区之间的边权重求和）。返回的节点数和边数不超过配置的上限。
+"""
+import numpy as np
+import scipy.sparse as sp
+from config import GRAPH_VIEW_CONFIG
+from metrics import timed
+from .graph_snapshot import get_snapshot
+from .community_analysis import louvain_partition
+from .payload import ColumnTable, build_records, color_levels, scale_sizes
+
+
+def _edge_index(nodes, edges):
+    """边的端点（用户 ID）转换为节点表中的行下标（节点表按用户 ID 升序排列）"""
+    def build():
+        ids = nodes.column("id")
+        return np.searchsorted(ids, edges.column("source")), np.searchsorted(ids, edges.column("target"))
+    return edges.cached(("edge_index", len(nodes)), build)
+
+
+def _edge_weight(edges):
+    return edges.column("weight").astype(np.float64) if "weight" in edges.columns else np.ones(len(edges))
+
+
+def _undirected_adjacency(num_nodes, src, dst, weight):
+    """由边数组构造无向 CSR 邻接矩阵（用于 k 跳邻居搜索）"""
+    adj = sp.csr_matrix((weight, (src, dst)), shape=(num_nodes, num_nodes))
+    return (adj + adj.T).tocsr()
+
+
+def _ego_mask(adjacency, center, hops):
+    """center 的 hops 跳以内的节点（逐层扩展 BFS 边界）"""
+    visited = np.zeros(adjacency.shape[0], dtype=bool)
+    visited[center] = True
+    frontier = np.array([center])
+    for _ in range(hops):
+        if len(frontier) == 0:
+            break
+        neighbors = adjacency[frontier].indices
+        frontier = np.unique(neighbors[~visited[neighbors]])
+        visited[frontier] = True
+    return visited
+
+
+def _find_node(nodes, user):
+    """按用户名（或用户 ID）查找节点的行下标，不存在时返回 None"""
+    matches = np.flatnonzero(nodes.column("username") == user)
+    if len(matches):
+        return int(matches[0])
+    if str(user).isdigit():
+        ids = nodes.column("id")
+        i = int(np.searchsorted(ids, int(user)))
+        if i < len(ids) and ids[i] == int(user):
+            return i
+    return None
+
+
+def _top_by_score(candidates, score, k):
+    """在候选节点中取分数最高的 k 个（按分数降序）"""
+    if k <= 0:
+        return candidates[:0]
+    if len(candidates) <= k:
+        return candidates[np.argsort(-score[candidates], kind="stable")]
+    top = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+    return top[np.argsort(-score[top], kind="stable")]
+
+
+def _community_labels(nodes, snapshot):
+    """节点的社区编号：优先使用结果中的社区列，否则使用好友关系图上的 Louvain 划分"""
+    for name in ("community_id", "community"):
+        if name in nodes.columns:
+            return nodes.column(name).astype(np.int64)
+    partition = louvain_partition(snapshot or get_snapshot())
+    labels = np.fromiter((partition.get(uid, -1) for uid in nodes.column("id").tolist()), dtype=np.int64,
+                         count=len(nodes))
+    labels[labels < 0] = labels.max() + 1 if len(labels) else 0  # 没有好友的用户归入同一个默认社区
+    return labels
+
+
+def _aggregate(score, src, dst, weight, labels):
+    """按社区聚合：每个社区成为一个超级节点，社区之间的边权重求和，社区内部的权重记为 internal_weight"""
+    communities, community_of = np.unique(labels, return_inverse=True)
+    k = len(communities)
+    members = np.bincount(community_of, minlength=k)
+    score_sum = np.bincount(community_of, weights=score, minlength=k)
+
+    edge_a, edge_b = community_of[src], community_of[dst]
+    internal = edge_a == edge_b
+    internal_weight = np.bincount(edge_a[internal], weights=weight[internal], minlength=k)
+
+    pair_keys, pair_index = np.unique(edge_a[~internal] * k + edge_b[~internal], return_inverse=True)
+    pair_weight = np.bincount(pair_index, weights=weight[~internal], minlength=len(pair_keys))
+
+    super_nodes = build_records(
+        id=communities,
+        username=np.array([f"社区 {c}" if c >= 0 else "无社区" for c in communities.tolist()], dtype=object),
+        size=scale_sizes(members, (1000, 6000)),
+        color=color_levels(members, "viridis"),
+        members=members,
+        score=score_sum,
+        internal_weight=internal_weight
+    )
+    super_edges = build_records(source=communities[pair_keys // k], target=communities[pair_keys % k],
+                                weight=pair_weight)
+    return super_nodes, super_edges
+
+
+@timed
+def apply_graph_view(data, score=None, top_k=None, min_weight=None, ego=None, hops=1, aggregate=None,
+                     snapshot=None):
+    """
+    按查询参数裁剪图数据（data 为包含 nodes / edges 记录表的分析结果）。
+    :param score: 用于排序的节点数值列名（如 degree、activity、authority），不存在时各节点分数为 0
+    :param top_k: 只保留分数最高的 K 个节点（不超过 max_nodes）
+    :param min_weight: 只保留权重不小于该值的边
+    :param ego: 自我网络的中心用户（用户名或用户 ID），只保留其 hops 跳以内的节点
+    :param hops: 自我网络的跳数
+    :param aggregate: 为 "community" 时按社区聚合为超级节点
+    :param snapshot: 聚合时用于社区划分的快照，默认使用进程内的最新快照
+    :return: 裁剪后的结果（新字典），附带 view 字段说明裁剪前后的规模；
+             score 不是数值列或 ego 用户不存在时返回 error
+    """
+    nodes, edges = data["nodes"], data["edges"]
+    if not isinstance(nodes, ColumnTable) or not isinstance(edges, ColumnTable):
+        return data
+    if score in nodes.columns and not np.issubdtype(nodes.column(score).dtype, np.number):
+        numeric = [name for name in nodes.columns if np.issubdtype(nodes.column(name).dtype, np.number)]
+        return {"error": f"score 必须是数值列：{score}（可选：{', '.join(numeric)}）"}
+
+    max_nodes, max_edges = GRAPH_VIEW_CONFIG["max_nodes"], GRAPH_VIEW_CONFIG["max_edges"]
+    no_filter = top_k is None and min_weight is None and ego is None and aggregate is None
+    if no_filter and len(nodes) <= max_nodes and len(edges) <= max_edges:
+        return data
+    src, dst = _edge_index(nodes, edges)
+    weight = _edge_weight(edges)
+    score_values = nodes.column(score).astype(np.float64) if score in nodes.columns else np.zeros(len(nodes))
+
+    # 1. 最小边权重
+    edge_mask = np.ones(len(edges), dtype=bool) if min_weight is None else weight >= min_weight
+
+    # 2. k 跳自我网络（在满足权重条件的边上搜索）
+    candidates = np.arange(len(nodes))
+    center = None
+    if ego is not None:
+        center = _find_node(nodes, ego)
+        if center is None:
+            return {"error": f"用户 {ego} 不存在"}
+        if min_weight is None:
+            adjacency = edges.cached(("undirected", len(nodes)),
+                                     lambda: _undirected_adjacency(len(nodes), src, dst, weight))
+        else:
+            adjacency = _undirected_adjacency(len(nodes), src[edge_mask], dst[edge_mask], weight[edge_mask])
+        candidates = np.flatnonzero(_ego_mask(adjacency, center, max(int(hops), 0)))
+
+    # 3. 按分数取前 K 个节点（自我网络的中心用户始终保留）；按社区聚合时默认保留全部候选节点
+    if aggregate == "community" and top_k is None:
+        selected = candidates
+    else:
+        k = min(top_k, max_nodes) if top_k is not None else max_nodes
+        selected = _top_by_score(candidates, score_values, max(int(k), 0))
+        if center is not None and center not in selected:
+            selected = np.concatenate([[center], selected[:-1]]) if len(selected) else np.array([center])
+        selected = np.sort(selected)
+
+    # 4. 两端都被保留的边
+    keep = np.zeros(len(nodes), dtype=bool)
+    keep[selected] = True
+    edge_ids = np.flatnonzero(edge_mask & keep[src] & keep[dst])
+
+    result = {key: value for key, value in data.items() if key not in ("nodes", "edges")}
+    if aggregate == "community":
+        # 社区编号与原结果的节点下标对齐，先裁剪再聚合
+        labels = _community_labels(nodes, snapshot)
+        remap = np.full(len(nodes), -1, dtype=np.int64)
+        remap[selected] = np.arange(len(selected))
+        result["nodes"], result["edges"] = _aggregate(
+            score_values[selected], remap[src[edge_ids]], remap[dst[edge_ids]], weight[edge_ids], labels[selected])
+    else:
+        result["nodes"], result["edges"] = nodes.take(selected), edges.take(edge_ids)
+
+    # 边数超过 max_edges 时只保留权重最大的边
+    if len(result["edges"]) > max_edges:
+        edge_weight = _edge_weight(result["edges"])
+        strongest = np.sort(np.argpartition(-edge_weight, max_edges - 1)[:max_edges])
+        result["edges"] = result["edges"].take(strongest)
+
+    result["view"] = {"total_nodes": len(nodes), "total_edges": len(edges),
+                      "nodes": len(result["nodes"]), "edges": len(result["edges"])}
+    return result
@@ -1,33 +1,36 @@
 import numpy as np
-import networkx as nx
-from datetime import datetime, timedelta
-from database import fetch_data
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+import pandas as pd
+from metrics import record, timed
+from .graph_snapshot import get_snapshot
+from .payload import build_nodes, message_edges
 
-def hits_algorithm(G, max_iter=100, tol=1e-8):
+
+def sparse_hits(src, dst, weight, num_nodes, max_iter=100, tol=1e-8, hub_init=None, authority_init=None):
     """
-    计算用户消息交互网络中的 HITS 算法，得到 hub 和 authority 分数。
+    基于稀疏矩阵的 HITS 迭代，每轮迭代代价为 O(E)。
+    :param src: 边的起点下标数组（发送者）
+    :param dst: 边的终点下标数组（接收者）
+    :param weight: 边权重数组
+    :param num_nodes: 节点数量，返回数组按节点下标对齐
+    :param hub_init: hub 初始向量（用于热启动），默认全 1
+    :param authority_init: authority 初始向量（用于热启动），默认全 1
+    :return: (hub 数组, authority 数组)
     """
-    users = list(G.nodes())
-    num_users = len(users)
-    if num_users == 0:
-        return {}, {}
+    if num_nodes == 0:
+        return np.empty(0), np.empty(0)
 
-    user_index = {user: i for i, user in enumerate(users)}
-    index_user = {i: user for user, i in user_index.items()}
-
-    hub_values = np.ones(num_users)
-    authority_values = np.ones(num_users)
-
-    adjacency_matrix = np.zeros((num_users, num_users))
-    for sender, receiver, data in G.edges(data=True):
-        if sender in user_index and receiver in user_index:
-            adjacency_matrix[user_index[sender], user_index[receiver]] = data.get("weight", 1)
+    adjacency_matrix = sp.csr_matrix((weight, (src, dst)), shape=(num_nodes, num_nodes), dtype=np.float64)
+    adjacency_matrix_T = adjacency_matrix.T.tocsr()
 
-    adjacency_matrix_T = adjacency_matrix.T
+    hub_values = np.ones(num_nodes) if hub_init is None else np.array(hub_init, dtype=np.float64)
+    authority_values = np.ones(num_nodes) if authority_init is None else np.array(authority_init, dtype=np.float64)
 
-    for _ in range(max_iter):
-        new_authority_values = np.dot(adjacency_matrix_T, hub_values)
-        new_hub_values = np.dot(adjacency_matrix, authority_values)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        new_authority_values = adjacency_matrix_T @ hub_values
+        new_hub_values = adjacency_matrix @ authority_values
 
         norm_authority = np.linalg.norm(new_authority_values, 2)
         norm_hub = np.linalg.norm(new_hub_values, 2)
@@ -43,93 +46,172 @@ def hits_algorithm(G, max_iter=100, tol=1e-8):
         if diff < tol:
             break
 
-    hub_scores = {index_user[i]: round(hub_values[i], 6) for i in range(num_users)}
-    authority_scores = {index_user[i]: round(authority_values[i], 6) for i in range(num_users)}
+    record("iterations", iterations)
+    return hub_values, authority_values
 
-    return hub_scores, authority_scores
 
-def analyze_messages_hits(days=30):
+def block_hits(src, dst, weight, block, num_blocks, max_iter=100, tol=1e-8, hub_init=None, authority_init=None):
     """
-    分析用户消息交互数据，计算 HITS 算法的 hub 和 authority 值。
+    分块对角 HITS：多个互不相连的子图（如弱连通分量）在同一个稀疏矩阵上一起迭代，
+    结果与对每个子图分别调用 sparse_hits 相同（每块单独归一化，收敛的块不再更新），
+    避免分量数量很多时逐个分量求解的 Python 开销。
+    :param src / dst / weight: 边数组（两端必须属于同一块）
+    :param block: 每个节点所属的块编号（0 ~ num_blocks - 1）
+    :param num_blocks: 块的数量
+    :param hub_init / authority_init: 初始向量（用于热启动），默认全 1
+    :return: (hub 数组, authority 数组)，按节点下标对齐
+    """
+    num_nodes = len(block)
+    if num_nodes == 0:
+        return np.empty(0), np.empty(0)
+
+    adjacency_matrix = sp.csr_matrix((weight, (src, dst)), shape=(num_nodes, num_nodes), dtype=np.float64)
+    adjacency_matrix_T = adjacency_matrix.T.tocsr()
+
+    hub_values = np.ones(num_nodes) if hub_init is None else np.array(hub_init, dtype=np.float64)
+    authority_values = np.ones(num_nodes) if authority_init is None else np.array(authority_init, dtype=np.float64)
+
+    def block_norm(values):
+        return np.sqrt(np.bincount(block, weights=values * values, minlength=num_blocks))
+
+    running = np.ones(num_blocks, dtype=bool)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        new_authority_values = adjacency_matrix_T @ hub_values
+        new_hub_values = adjacency_matrix @ authority_values
+
+        norm_authority = block_norm(new_authority_values)
+        norm_hub = block_norm(new_hub_values)
+        new_authority_values /= np.where(norm_authority > 0, norm_authority, 1.0)[block]
+        new_hub_values /= np.where(norm_hub > 0, norm_hub, 1.0)[block]
+
+        diff = block_norm(new_hub_values - hub_values) + block_norm(new_authority_values - authority_values)
+        update = running[block]
+        hub_values = np.where(update, new_hub_values, hub_values)
+        authority_values = np.where(update, new_authority_values, authority_values)
+
+        running &= diff >= tol
+        if not running.any():
+            break
+
+    record("iterations", iterations)
+    return hub_values, authority_values
+
+
+def hits_algorithm(G, max_iter=100, tol=1e-8):
     """
-    start_time = datetime.now() - timedelta(days=days)
-    start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S')
-
-    query_users = "SELECT id, username FROM users"
-    df_users = fetch_data(query_users)
-
-    query_messages = f"""
-        SELECT m.sender_id, u1.username AS sender_name,
-               m.receiver_id, u2.username AS receiver_name,
-               COUNT(*) as weight
-        FROM messages m
-        JOIN users u1 ON m.sender_id = u1.id
-        JOIN users u2 ON m.receiver_id = u2.id
-        WHERE m.timestamp >= '{start_time_str}'
-        GROUP BY m.sender_id, m.receiver_id
+    计算用户消息交互网络中的 HITS 算法，得到 hub 和 authority 分数。
     """
-    df_messages = fetch_data(query_messages)
+    users = list(G.nodes())
+    num_users = len(users)
+    if num_users == 0:
+        return {}, {}
 
-    if df_messages.empty:
-        print("⚠️ 没有消息交互数据")
-        return {}, {}, {}, {}, df_messages
+    user_index = {user: i for i, user in enumerate(users)}
+    src = np.array([user_index[u] for u, _ in G.edges()], dtype=np.int64)
+    dst = np.array([user_index[v] for _, v in G.edges()], dtype=np.int64)
+    weight = np.array([data.get("weight", 1) for _, _, data in G.edges(data=True)], dtype=np.float64)
 
-    message_graph = nx.DiGraph()
-    user_map = {row["id"]: row["username"] for _, row in df_users.iterrows()}
+    hub_values, authority_values = sparse_hits(src, dst, weight, num_users, max_iter, tol)
 
-    if not user_map:
-        print("⚠️ 用户数据为空")
-        return {}, {}, {}, {}, df_messages
+    hub_scores = {user: round(float(hub_values[i]), 6) for i, user in enumerate(users)}
+    authority_scores = {user: round(float(authority_values[i]), 6) for i, user in enumerate(users)}
 
-    for _, row in df_messages.iterrows():
-        message_graph.add_edge(int(row["sender_id"]), int(row["receiver_id"]), weight=float(row["weight"]))
+    return hub_scores, authority_scores
 
-    if not message_graph.edges:
-        print("⚠️ 没有有效的消息交互")
-        return {}, {}, user_map, {}, df_messages
 
-    print(f"📊 消息网络包含 {message_graph.number_of_nodes()} 个用户, {message_graph.number_of_edges()} 条消息交互")
+def compute_messages_hits(snapshot):
+    """
+    在快照的消息交互图上，按弱连通分量分别计算 HITS（每个分量内单独归一化，所有分量一次求解）。
+    :return: (hub 数组, authority 数组, 社区编号数组)，均按快照用户下标对齐；
+             没有消息交互的用户分数为 0、社区编号为 -1
+    """
+    def compute():
+        n = snapshot.num_users
+        src, dst, weight = snapshot.message_src, snapshot.message_dst, snapshot.message_weight
+        hub = np.zeros(n)
+        authority = np.zeros(n)
+        community = np.full(n, -1, dtype=np.int64)
+        if len(src) == 0:
+            return hub, authority, community
+
+        # 只保留有消息交互的用户，在其上求弱连通分量
+        active = np.zeros(n, dtype=bool)
+        active[src] = True
+        active[dst] = True
+        _, labels = connected_components(snapshot.message_adj, directed=True, connection="weak")
+        # 社区编号按分量在边列表中首次出现的顺序（依次为各条边的发送者、接收者）分配，
+        # 与按消息交互图节点插入顺序枚举弱连通分量（networkx）的编号一致
+        appearance = labels[np.column_stack([src, dst]).ravel()]
+        component_labels, first_seen = np.unique(appearance, return_index=True)
+        num_communities = len(component_labels)
+        rank = np.full(labels.max() + 1, -1, dtype=np.int64)
+        rank[component_labels[np.argsort(first_seen)]] = np.arange(num_communities)
+        community[active] = rank[labels[active]]
+        print(f"🔍 发现 {num_communities} 个独立社交社区")
+
+        # 所有分量合并为一个分块对角矩阵一次求解，每个分量内单独归一化、单独判断收敛
+        nodes = np.flatnonzero(active)
+        local_index = np.zeros(n, dtype=np.int64)
+        local_index[nodes] = np.arange(len(nodes))
+        sub_hub, sub_authority = block_hits(local_index[src], local_index[dst], weight, community[nodes],
+                                            num_communities)
+        hub[nodes] = np.round(sub_hub, 6)
+        authority[nodes] = np.round(sub_authority, 6)
+
+        return hub, authority, community
+
+    return snapshot.cached("messages_hits", compute)
+
+
+@timed
+def analyze_messages_hits(days=30, snapshot=None):
+    """
+    分析用户消息交互数据，计算 HITS 算法的 hub 和 authority 值。
+    """
+    snapshot = snapshot or get_snapshot(days)
 
-    communities = list(nx.weakly_connected_components(message_graph))
-    print(f"🔍 发现 {len(communities)} 个独立社交社区")
+    df_messages = pd.DataFrame({
+        "sender_id": snapshot.user_ids[snapshot.message_src],
+        "receiver_id": snapshot.user_ids[snapshot.message_dst],
+        "weight": snapshot.message_weight
+    })
 
-    hub_scores, authority_scores, community_ids = {}, {}, {}
+    if df_messages.empty:
+        print("⚠️ 没有消息交互数据")
+        return {}, {}, {}, {}, df_messages
 
-    for i, community in enumerate(communities):
-        subgraph = message_graph.subgraph(community).copy()
-        print(f"📌 计算社区 {i+1}, 包含 {subgraph.number_of_nodes()} 个用户, {subgraph.number_of_edges()} 条消息交互")
+    user_map = snapshot.user_map
 
-        sub_hub_scores, sub_authority_scores = hits_algorithm(subgraph)
+    if not user_map:
+        print("⚠️ 用户数据为空")
+        return {}, {}, {}, {}, df_messages
 
-        hub_scores.update(sub_hub_scores)
-        authority_scores.update(sub_authority_scores)
+    hub, authority, community = compute_messages_hits(snapshot)
+    active = np.flatnonzero(community >= 0)
+    print(f"📊 消息网络包含 {len(active)} 个用户, {len(df_messages)} 条消息交互")
+    active_ids = snapshot.user_ids[active].tolist()
 
-        for user in community:
-            community_ids[user] = i
+    hub_scores = dict(zip(active_ids, hub[active].tolist()))
+    authority_scores = dict(zip(active_ids, authority[active].tolist()))
+    community_ids = dict(zip(active_ids, community[active].tolist()))
 
     return hub_scores, authority_scores, user_map, community_ids, df_messages
 
-def get_messages_hits_data(days=30):
+@timed
+def get_messages_hits_data(days=30, snapshot=None):
     """
     获取用户消息交互数据，包括 hub、authority 和 community_id，用于前端可视化。
     """
-    hub_scores, authority_scores, user_map, community_ids, df_messages = analyze_messages_hits(days)
-
-    nodes = [
-        {
-            "id": int(user_id),
-            "username": user_map[user_id],
-            "authority": authority_scores.get(user_id, 0),
-            "hub": hub_scores.get(user_id, 0),
-            "size": int((authority_scores.get(user_id, 0) + hub_scores.get(user_id, 0)) * 1000),
-            "community_id": community_ids.get(user_id, -1)
-        }
-        for user_id in user_map.keys()
-    ]
-
-    edges = [
-        {"source": int(row["sender_id"]), "target": int(row["receiver_id"]), "weight": float(row["weight"])}
-        for _, row in df_messages.iterrows()
-    ]
+    snapshot = snapshot or get_snapshot(days)
+
+    # 没有消息交互的用户 hub、authority 为 0，community_id 为 -1
+    hub, authority, community = compute_messages_hits(snapshot)
+    if len(snapshot.message_src):
+        print(f"📊 消息网络包含 {int((community >= 0).sum())} 个用户, {len(snapshot.message_src)} 条消息交互")
+
+    nodes = build_nodes(snapshot, authority=authority, hub=hub, size=((authority + hub) * 1000).astype(np.int64),
+                        community_id=community)
+    edges = message_edges(snapshot)
 
     return {"nodes": nodes, "edges": edges}
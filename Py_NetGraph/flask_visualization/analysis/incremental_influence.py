@@ -0,0 +1,328 @@
+"""
+增量影响力更新
+以 messages.id 自增水位线为界，只读取上次更新之后写入的新消息：
+PageRank 通过局部残差推送更新，HITS 只对受影响的弱连通分量热启动重算，
+PageRank 误差上界超过阈值时退回全量重算。
+预计算任务在数据版本变化时通过 refresh_messages_pagerank / refresh_messages_hits 走增量路径，
+导出的数据与 analyze_user_interactions_pagerank / get_messages_hits_data 格式相同。
+"""
+import threading
+import time
+from collections import deque
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from config import INCREMENTAL_CONFIG
+from database import fetch_data
+from metrics import timed
+from .graph_snapshot import get_snapshot, load_snapshot, fetch_message_watermark
+from .pagerank_analysis import compute_snapshot_pagerank
+from .hits_analysis import compute_messages_hits, block_hits
+from .payload import build_records, color_levels, scale_sizes, value_range
+from .user_directory import get_user_directory
+
+
+class IncrementalInfluence:
+    """
+    维护消息交互图上的 PageRank 与 HITS 分数，并随新消息增量更新。
+
+    PageRank 部分同时维护残差 r = (1-α)v - (I - αP^T)x（x 为当前分数，v 为均匀跳转向量），
+    真实分数与当前分数之差的 L1 范数不超过 ||r||₁ / (1-α)，即误差上界。
+    """
+
+    def __init__(self, alpha=0.85):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.watermark = None
+        self.last_full_at = 0.0
+        self.stats = {}
+
+    def _full_recompute(self, snapshot):
+        """基于快照全量计算 PageRank 与 HITS，并重置残差"""
+        self.user_ids = snapshot.user_ids.copy()
+        self.index = dict(zip(self.user_ids.tolist(), range(len(self.user_ids))))
+        self.adjacency = snapshot.message_adj.copy()
+        self.pagerank = compute_snapshot_pagerank(snapshot).astype(np.float64)
+        self.residual = self._exact_residual()
+        hub, authority, community = compute_messages_hits(snapshot)
+        self.hub, self.authority, self.community = hub.copy(), authority.copy(), community.copy()
+        self.watermark = snapshot.message_watermark
+        self.last_full_at = time.time()
+
+    def _out_degree(self):
+        return np.asarray(self.adjacency.sum(axis=1)).ravel()
+
+    def _exact_residual(self):
+        """按定义计算当前 PageRank 分数的残差向量（一次稀疏矩阵乘法）"""
+        n = len(self.pagerank)
+        if n == 0:
+            return np.empty(0)
+        out_degree = self._out_degree()
+        dangling = out_degree == 0
+        inv_out_degree = np.zeros(n)
+        np.divide(1, out_degree, out=inv_out_degree, where=~dangling)
+        flow = self.adjacency.T @ (self.pagerank * inv_out_degree)
+        teleport = ((1 - self.alpha) + self.alpha * self.pagerank[dangling].sum()) / n
+        return teleport + self.alpha * flow - self.pagerank
+
+    @property
+    def error_bound(self):
+        """当前 PageRank 分数与精确解之间 L1 误差的上界"""
+        return float(np.abs(self.residual).sum() / (1 - self.alpha))
+
+    def _add_users(self, new_ids):
+        """增加新用户（没有出边、分数为 0），并修正因节点数变化带来的残差"""
+        n_old = len(self.user_ids)
+        n_new = n_old + len(new_ids)
+        dangling = self._out_degree() == 0
+        teleport_mass = (1 - self.alpha) + self.alpha * self.pagerank[dangling].sum()
+
+        self.user_ids = np.concatenate([self.user_ids, new_ids])
+        self.index.update(zip(new_ids.tolist(), range(n_old, n_new)))
+        self.pagerank = np.concatenate([self.pagerank, np.zeros(len(new_ids))])
+        self.residual = np.concatenate([self.residual + teleport_mass * (1 / n_new - 1 / n_old),
+                                        np.full(len(new_ids), teleport_mass / n_new)])
+        self.hub = np.concatenate([self.hub, np.zeros(len(new_ids))])
+        self.authority = np.concatenate([self.authority, np.zeros(len(new_ids))])
+        self.community = np.concatenate([self.community, np.full(len(new_ids), -1, dtype=np.int64)])
+        self.adjacency.resize((n_new, n_new))
+
+    def _absorb_uniform(self, uniform, rounds=3):
+        """
+        消化均匀分布的残差 s·v：由于 (I - αP^T)⁻¹(1-α)v 就是精确解，
+        令 x ← (1+c)x、r ← (1+c)r（c = s/(1-α)）后均匀残差只剩 c·s，按二阶速度衰减。
+        :return: 剩余的均匀残差
+        """
+        for _ in range(rounds):
+            if uniform == 0.0:
+                break
+            c = uniform / (1 - self.alpha)
+            self.pagerank *= 1 + c
+            self.residual *= 1 + c
+            uniform *= c
+        return uniform
+
+    def _apply_delta(self, sender_ids, receiver_ids, weights):
+        """
+        将新增的消息交互合并进图中并更新分数。
+        :return: 推送次数，超过 max_pushes 时返回 None（需要全量重算）
+        """
+        alpha, cfg = self.alpha, INCREMENTAL_CONFIG
+        if len(self.user_ids) == 0:
+            return None
+
+        delta_ids = np.unique(np.concatenate([sender_ids, receiver_ids]))
+        new_ids = np.array([uid for uid in delta_ids.tolist() if uid not in self.index], dtype=np.int64)
+        if len(new_ids):
+            self._add_users(new_ids)
+
+        n = len(self.user_ids)
+        src = np.array([self.index[uid] for uid in sender_ids.tolist()], dtype=np.int64)
+        dst = np.array([self.index[uid] for uid in receiver_ids.tolist()], dtype=np.int64)
+
+        old_adjacency = self.adjacency
+        old_out_degree = self._out_degree()
+        self.adjacency = (old_adjacency + sp.csr_matrix((weights, (src, dst)), shape=(n, n))).tocsr()
+        out_degree = self._out_degree()
+
+        # 1. 出边发生变化的用户：残差加上 α·x_u·(P_new[u,:] - P_old[u,:])
+        uniform = 0.0  # 均匀分布到所有节点的残差（来自悬挂节点）
+        for u in np.unique(src).tolist():
+            x_u = self.pagerank[u]
+            if old_out_degree[u] > 0:
+                lo, hi = old_adjacency.indptr[u], old_adjacency.indptr[u + 1]
+                self.residual[old_adjacency.indices[lo:hi]] -= alpha * x_u * old_adjacency.data[lo:hi] / old_out_degree[u]
+            else:
+                uniform -= alpha * x_u
+            lo, hi = self.adjacency.indptr[u], self.adjacency.indptr[u + 1]
+            self.residual[self.adjacency.indices[lo:hi]] += alpha * x_u * self.adjacency.data[lo:hi] / out_degree[u]
+
+        # 2. 局部推送：把残差超过阈值的节点的残差转入分数，并按转移概率传给出边邻居
+        uniform = self._absorb_uniform(uniform)
+        push_tol = cfg["push_tol"] / n
+        indptr, indices, data = self.adjacency.indptr, self.adjacency.indices, self.adjacency.data
+        hot = np.flatnonzero(np.abs(self.residual) > push_tol)
+        in_queue = np.zeros(n, dtype=bool)
+        in_queue[hot] = True
+        queue = deque(hot.tolist())
+        pushes = 0
+        while queue:
+            u = queue.popleft()
+            in_queue[u] = False
+            r_u = self.residual[u]
+            if abs(r_u) <= push_tol:
+                continue
+            pushes += 1
+            if pushes > cfg["max_pushes"]:
+                return None
+            self.pagerank[u] += r_u
+            self.residual[u] = 0.0
+            if out_degree[u] > 0:
+                neighbors = indices[indptr[u]:indptr[u + 1]]
+                self.residual[neighbors] += alpha * r_u * data[indptr[u]:indptr[u + 1]] / out_degree[u]
+                hot = neighbors[(np.abs(self.residual[neighbors]) > push_tol) & ~in_queue[neighbors]]
+                in_queue[hot] = True
+                queue.extend(hot.tolist())
+            else:
+                uniform += alpha * r_u
+        self.residual += self._absorb_uniform(uniform) / n
+
+        # 3. HITS：只对包含新增边的弱连通分量热启动重算（每个分量内单独归一化）
+        self._update_hits(np.unique(np.concatenate([src, dst])))
+        return pushes
+
+    def _update_hits(self, touched):
+        """
+        重新划分弱连通分量，对包含 touched 节点的分量以旧分数为初值重算 HITS。
+        社区编号保持稳定：分量按其成员原来的最小社区编号排序（全新的分量排在最后），
+        没有分量合并时沿用全量计算时的编号。
+        """
+        n = len(self.user_ids)
+        active = (np.diff(self.adjacency.indptr) > 0) | (np.bincount(self.adjacency.indices, minlength=n) > 0)
+        num_labels, labels = connected_components(self.adjacency, directed=True, connection="weak")
+        unassigned = np.iinfo(np.int64).max
+        previous = np.full(num_labels, unassigned, dtype=np.int64)
+        old_community = self.community[active]
+        np.minimum.at(previous, labels[active], np.where(old_community >= 0, old_community, unassigned))
+        component_labels = np.unique(labels[active])
+        rank = np.full(num_labels, -1, dtype=np.int64)
+        rank[component_labels[np.lexsort((component_labels, previous[component_labels]))]] = np.arange(
+            len(component_labels))
+        self.community = np.full(n, -1, dtype=np.int64)
+        self.community[active] = rank[labels[active]]
+
+        # 受影响的分量合并为分块对角矩阵一次求解
+        touched_labels = np.unique(labels[touched])
+        nodes = np.flatnonzero(np.isin(labels, touched_labels))
+        block = np.searchsorted(touched_labels, labels[nodes])
+        sub = self.adjacency[nodes][:, nodes].tocoo()
+        init_fill = 1.0 / np.sqrt(np.bincount(block))[block]
+        hub_init = np.where(self.hub[nodes] > 0, self.hub[nodes], init_fill)
+        authority_init = np.where(self.authority[nodes] > 0, self.authority[nodes], init_fill)
+        hub, authority = block_hits(sub.row, sub.col, sub.data, block, len(touched_labels),
+                                    hub_init=hub_init, authority_init=authority_init)
+        self.hub[nodes] = np.round(hub, 6)
+        self.authority[nodes] = np.round(authority, 6)
+
+    def _catch_up(self):
+        """
+        读取水位线之后的新消息并增量更新。
+        :return: (新增边数, 推送次数)；推送次数为 None 表示需要全量重算
+        """
+        new_watermark = fetch_message_watermark()
+        if new_watermark <= self.watermark:
+            return 0, 0
+
+        query = f"""
+            SELECT sender_id, receiver_id, COUNT(*) AS weight
+            FROM messages
+            WHERE id > {self.watermark} AND id <= {new_watermark}
+            GROUP BY sender_id, receiver_id
+        """
+        df = fetch_data(query)
+        self.watermark = new_watermark
+        if df is None or df.empty:
+            return 0, 0
+
+        pushes = self._apply_delta(df["sender_id"].to_numpy(dtype=np.int64),
+                                   df["receiver_id"].to_numpy(dtype=np.int64),
+                                   df["weight"].to_numpy(dtype=np.float64))
+        return len(df), pushes
+
+    def refresh(self):
+        """
+        刷新影响力分数：首次调用或超过全量重算间隔时全量计算，其余情况增量更新；
+        增量更新后误差上界超过阈值（或推送次数过多）时，从数据库加载一个新快照全量重算；
+        新快照只供本次重算使用，不替换进程内共享的快照（其他接口缓存在共享快照上的派生数据不受影响）。
+        :return: 本次刷新的统计信息
+        """
+        with self.lock:
+            start = time.time()
+            mode = "incremental"
+            if self.watermark is None or start - self.last_full_at > INCREMENTAL_CONFIG["full_recompute_seconds"]:
+                self._full_recompute(get_snapshot())
+                mode = "full"
+
+            delta_edges, pushes = self._catch_up()
+            if pushes is None or self.error_bound > INCREMENTAL_CONFIG["error_threshold"]:
+                self._full_recompute(load_snapshot())
+                delta_edges, pushes = self._catch_up()
+                mode = "full"
+
+            self.stats = {
+                "mode": mode,
+                "watermark": self.watermark,
+                "delta_edges": delta_edges,
+                "pushes": pushes or 0,
+                "error_bound": self.error_bound,
+                "seconds": round(time.time() - start, 4)
+            }
+            return self.stats
+
+    def to_payload(self):
+        """导出当前分数，节点按用户 ID 给出 pagerank、hub、authority 和 community_id"""
+        with self.lock:
+            nodes = [
+                {"id": uid, "pagerank": pr, "hub": hub, "authority": authority, "community_id": community}
+                for uid, pr, hub, authority, community in zip(
+                    self.user_ids.tolist(), self.pagerank.tolist(), self.hub.tolist(),
+                    self.authority.tolist(), self.community.tolist())
+            ]
+            return {"stats": self.stats, "nodes": nodes}
+
+    def _nodes(self, **columns):
+        """节点数据：id、username 之后依次为 columns 中的各列（调用方持有 self.lock）"""
+        directory = get_user_directory()
+        index = directory.lookup(self.user_ids)
+        if (index < 0).any():
+            # 新消息的发送者 / 接收者可能是目录刷新之后才注册的用户
+            directory = get_user_directory(fresh=True)
+            index = directory.lookup(self.user_ids)
+        usernames = [directory.usernames[i] if i >= 0 else None for i in index.tolist()]
+        return build_records(id=self.user_ids.copy(), username=usernames, **columns)
+
+    def _edges(self):
+        """消息交互边数据（source / target 为用户 ID，weight 为消息数）"""
+        coo = self.adjacency.tocoo()
+        return build_records(source=self.user_ids[coo.row], target=self.user_ids[coo.col], weight=coo.data.copy())
+
+    def pagerank_payload(self):
+        """按 analyze_user_interactions_pagerank 的格式导出当前 PageRank 分数"""
+        with self.lock:
+            pagerank = self.pagerank.copy()
+            vmin, vmax = value_range(pagerank)
+            nodes = self._nodes(size=scale_sizes(pagerank, (1000, 6000), vmin, vmax),
+                                color=color_levels(pagerank, "viridis", vmin, vmax), pagerank=pagerank)
+            return {"nodes": nodes, "edges": self._edges()}
+
+    def hits_payload(self):
+        """按 get_messages_hits_data 的格式导出当前 HITS 分数"""
+        with self.lock:
+            hub, authority = self.hub.copy(), self.authority.copy()
+            nodes = self._nodes(authority=authority, hub=hub, size=((authority + hub) * 1000).astype(np.int64),
+                                community_id=self.community.copy())
+            return {"nodes": nodes, "edges": self._edges()}
+
+
+_tracker = IncrementalInfluence()
+
+
+@timed
+def refresh_influence_scores():
+    """增量刷新进程内共享的 PageRank / HITS 分数，返回最新分数和本次刷新统计"""
+    _tracker.refresh()
+    return _tracker.to_payload()
+
+
+@timed
+def refresh_messages_pagerank():
+    """增量刷新后导出 PageRank 可视化数据（数据版本变化时由预计算任务代替全量的 analyze_user_interactions_pagerank）"""
+    _tracker.refresh()
+    return _tracker.pagerank_payload()
+
+
+@timed
+def refresh_messages_hits():
+    """增量刷新后导出 HITS 可视化数据（数据版本变化时由预计算任务代替全量的 get_messages_hits_data）"""
+    _tracker.refresh()
+    return _tracker.hits_payload()
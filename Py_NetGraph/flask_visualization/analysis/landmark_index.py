@@ -0,0 +1,239 @@
+"""
+消息交互图的地标（ALT）最短路径索引
+边的代价为 1 / 消息数，互动越频繁距离越近，最短路径即"最近的影响路径"。
+每个快照构建一次地标距离表并保存到磁盘，点到点查询使用 A* 搜索，
+以三角不等式给出的下界作为启发函数，只需访问图中很小一部分节点。
+索引文件只保留最新的一个（时间窗口滑动、新消息都会改变图，旧文件不会再被使用）。
+"""
+import glob
+import hashlib
+import heapq
+import os
+import time
+import threading
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from config import LANDMARK_CONFIG
+from metrics import timed
+from .graph_snapshot import get_snapshot
+from .shortest_path import _username_index
+
+
+def interaction_cost_matrix(snapshot):
+    """消息交互图的代价矩阵（CSR），边代价为 1 / 消息数"""
+    def build():
+        cost = snapshot.message_adj.copy()
+        cost.data = 1.0 / cost.data
+        return cost
+    return snapshot.cached("interaction_cost", build)
+
+
+class LandmarkIndex:
+    """
+    地标距离索引。
+    - landmarks: 地标节点下标
+    - dist_from: N×K 数组，dist_from[v, k] 为地标 k 到节点 v 的最短距离
+    - dist_to: N×K 数组，dist_to[v, k] 为节点 v 到地标 k 的最短距离
+    不可达的距离为 inf。距离表以 float32 保存，下界按 float32 的舍入误差放宽，A* 结果仍然精确。
+    """
+
+    def __init__(self, landmarks, dist_from, dist_to, build_seconds=0.0):
+        self.landmarks = landmarks
+        self.dist_from = dist_from
+        self.dist_to = dist_to
+        self.build_seconds = build_seconds
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.settled_total = 0
+
+    @classmethod
+    def build(cls, cost, num_landmarks):
+        """按"最远点"策略逐个选择地标，并计算地标到各节点、各节点到地标的最短距离"""
+        start = time.time()
+        n = cost.shape[0]
+        cost_T = cost.T.tocsr()
+        degree = np.diff(cost.indptr) + np.diff(cost_T.indptr)
+        active = degree > 0
+        num_landmarks = min(num_landmarks, int(active.sum()))
+
+        landmarks = []
+        dist_from = np.empty((n, num_landmarks), dtype=np.float32)
+        dist_to = np.empty((n, num_landmarks), dtype=np.float32)
+        nearest = np.full(n, np.inf)  # 各节点到已选地标的最近距离（双向取小）
+        candidate = int(np.argmax(degree))
+        for k in range(num_landmarks):
+            landmarks.append(candidate)
+            dist_from[:, k] = dijkstra(cost, indices=candidate)
+            dist_to[:, k] = dijkstra(cost_T, indices=candidate)
+            nearest = np.minimum(nearest, np.minimum(dist_from[:, k], dist_to[:, k]))
+
+            # 下一个地标：优先选择尚未被任何地标覆盖的连通分量中度数最大的节点，否则选最远的节点
+            uncovered = active & np.isinf(nearest)
+            if uncovered.any():
+                candidate = int(np.argmax(np.where(uncovered, degree, -1)))
+            else:
+                candidate = int(np.argmax(np.where(active, nearest, -1)))
+
+        return cls(np.array(landmarks, dtype=np.int64), dist_from, dist_to, time.time() - start)
+
+    @property
+    def memory_bytes(self):
+        return int(self.dist_from.nbytes + self.dist_to.nbytes + self.landmarks.nbytes)
+
+    def save(self, path):
+        """原子地写入索引文件（先写临时文件再替换）"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, landmarks=self.landmarks, dist_from=self.dist_from, dist_to=self.dist_to,
+                 build_seconds=self.build_seconds)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["landmarks"], data["dist_from"], data["dist_to"], float(data["build_seconds"]))
+
+    def lower_bounds(self, target):
+        """
+        返回 h(v)：节点 v 到 target 距离的下界（三角不等式），inf 表示 v 无法到达 target。
+        表中每个距离与精确值的相对误差不超过 eps / 2（eps 为距离表 dtype 的机器精度），
+        两个距离之差因此减去 eps·(两者之和)，保证下界不会高估，启发函数保持可采纳。
+        """
+        eps = float(np.finfo(self.dist_from.dtype).eps)
+        from_t = self.dist_from[target].astype(np.float64)
+        to_t = self.dist_to[target].astype(np.float64)
+
+        def h(v):
+            from_v = self.dist_from[v].astype(np.float64)
+            to_v = self.dist_to[v].astype(np.float64)
+            # d(L,t) - d(L,v) 与 d(v,L) - d(t,L) 都是 d(v,t) 的下界；inf - 有限值 说明 v 无法到达 t
+            with np.errstate(invalid="ignore"):
+                bounds = np.concatenate([from_t - from_v, to_v - to_t])
+            slack = np.concatenate([from_t + from_v, to_v + to_t])
+            bounds -= eps * np.where(np.isinf(slack), 0.0, slack)
+            bounds = bounds[~np.isnan(bounds)]
+            return max(float(bounds.max()), 0.0) if len(bounds) else 0.0
+
+        return h
+
+    def shortest_path(self, cost, start, end):
+        """
+        A* 搜索 start 到 end 的最短路径。
+        :return: (路径节点下标列表, 路径代价, 确定（出堆）的节点数)；不可达时路径为 None
+        """
+        h = self.lower_bounds(end)
+        indptr, indices, data = cost.indptr, cost.indices, cost.data
+        distance = {start: 0.0}
+        parent = {start: -1}
+        settled = set()
+        heap = [(h(start), 0.0, start)]
+        path = None
+
+        while heap:
+            _, g, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == end:
+                path = []
+                while node != -1:
+                    path.append(node)
+                    node = parent[node]
+                path.reverse()
+                break
+            for neighbor, edge_cost in zip(indices[indptr[node]:indptr[node + 1]].tolist(),
+                                           data[indptr[node]:indptr[node + 1]].tolist()):
+                new_distance = g + edge_cost
+                if new_distance < distance.get(neighbor, np.inf):
+                    estimate = h(neighbor)
+                    if estimate == np.inf:
+                        continue
+                    distance[neighbor] = new_distance
+                    parent[neighbor] = node
+                    heapq.heappush(heap, (new_distance + estimate, new_distance, neighbor))
+
+        with self._lock:
+            self.queries += 1
+            self.settled_total += len(settled)
+        return path, (distance[end] if path else np.inf), len(settled)
+
+    def stats(self):
+        with self._lock:
+            avg_settled = self.settled_total / self.queries if self.queries else 0.0
+        return {
+            "landmarks": len(self.landmarks),
+            "build_seconds": round(self.build_seconds, 4),
+            "memory_bytes": self.memory_bytes,
+            "queries": self.queries,
+            "avg_settled": round(avg_settled, 2)
+        }
+
+
+def remove_stale_indexes(index_dir, keep, stale_seconds):
+    """删除 keep 以外的索引文件，以及超过 stale_seconds 秒的临时文件（删除失败时忽略）"""
+    for path in glob.glob(os.path.join(index_dir, "landmarks_*")):
+        if os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            if ".tmp." not in path or time.time() - os.path.getmtime(path) > stale_seconds:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def get_landmark_index(snapshot):
+    """
+    获取快照对应的地标索引：优先读取磁盘上同一张图的索引文件，否则构建并保存，保存后删除其他索引文件。
+    文件名由消息交互矩阵内容的哈希决定（时间窗口滑动也会改变图），多个进程可共用同一文件。
+    """
+    def build():
+        adjacency = snapshot.message_adj
+        digest = hashlib.sha1(str(LANDMARK_CONFIG["num_landmarks"]).encode("utf-8"))
+        for array in (adjacency.indptr, adjacency.indices, adjacency.data):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        path = os.path.join(LANDMARK_CONFIG["index_dir"], f"landmarks_{digest.hexdigest()[:16]}.npz")
+        if os.path.exists(path):
+            try:
+                return LandmarkIndex.load(path)
+            except OSError:
+                pass  # 其他进程保存新索引时已将其删除，重新构建
+        index = LandmarkIndex.build(interaction_cost_matrix(snapshot), LANDMARK_CONFIG["num_landmarks"])
+        print(f"🗺️ 地标索引构建完成：{len(index.landmarks)} 个地标，耗时 {index.build_seconds:.3f} 秒，"
+              f"占用 {index.memory_bytes / 1024 / 1024:.2f} MB")
+        index.save(path)
+        remove_stale_indexes(LANDMARK_CONFIG["index_dir"], path, LANDMARK_CONFIG["stale_seconds"])
+        return index
+    return snapshot.cached("landmark_index", build)
+
+
+@timed
+def analyze_influence_path(start_user, end_user, snapshot=None):
+    """
+    计算两个用户之间在消息交互图上的最近影响路径（边代价为 1 / 消息数）。
+    :param start_user: 起始用户的用户名。
+    :param end_user: 目标用户的用户名。
+    :param snapshot: 共享图快照，默认使用进程内的最新快照。
+    :return: 包含路径、代价、确定节点数以及索引统计信息的字典。
+    """
+    snapshot = snapshot or get_snapshot()
+
+    if snapshot.message_adj.nnz == 0:
+        return {"error": "没有消息交互数据"}
+
+    username_to_index = _username_index(snapshot)
+    if start_user not in username_to_index or end_user not in username_to_index:
+        return {"error": "起始用户或目标用户不存在"}
+
+    index = get_landmark_index(snapshot)
+    path, cost, settled = index.shortest_path(interaction_cost_matrix(snapshot),
+                                              username_to_index[start_user], username_to_index[end_user])
+    if not path:
+        return {"error": "未找到路径", "settled": settled, "index": index.stats()}
+
+    return {
+        "path": snapshot.user_ids[path].tolist(),  # 路径（用户 ID 列表）
+        "cost": cost,  # 路径总代价（各边 1 / 消息数 之和）
+        "steps": len(path) - 1,  # 总步数
+        "settled": settled,  # 本次查询确定的节点数
+        "index": index.stats()  # 索引构建时间、内存占用和平均确定节点数
+    }
@@ -0,0 +1,171 @@
+"""
+消息数量的小时汇总（rollup）
+以 messages.id 自增水位线为界，只聚合上次刷新之后写入的新消息（按主键范围查询，可以使用索引），
+维护每小时（北京时间）的消息数，可选同时维护每个发送者 / 接收者每小时的消息数。
+时间序列查询按小时 / 天 / 周汇总时直接读取汇总结果，不再对整张 messages 表做 GROUP BY。
+已写入消息的修改或删除不会被增量捕获，汇总结果按 rebuild_seconds 定期全量重建。
+"""
+import threading
+import time
+import numpy as np
+import pandas as pd
+from config import ROLLUP_CONFIG
+from database import fetch_columns
+from .graph_snapshot import fetch_message_watermark
+
+GRANULARITIES = ("hour", "day", "week")
+_EPOCH = pd.Timestamp("1970-01-01")
+
+
+def hour_of(value):
+    """时间（字符串或 datetime，北京时间）转换为自 1970-01-01 00:00 起的小时编号，空值返回 None"""
+    if value is None or value == "":
+        return None
+    return int((pd.Timestamp(value) - _EPOCH) // pd.Timedelta(hours=1))
+
+
+def _bucket(hours, granularity):
+    """小时编号转换为所在时间段起点的小时编号（周从周一开始，1970-01-01 为周四）"""
+    if granularity == "day":
+        return hours // 24 * 24
+    if granularity == "week":
+        return ((hours // 24 + 3) // 7 * 7 - 3) * 24
+    return hours
+
+
+def format_hours(hours, granularity="hour"):
+    """小时编号转换为时间字符串：按小时为 "YYYY-MM-DD HH:00:00"，按天 / 周为时间段起点的 "YYYY-MM-DD" """
+    stamps = _EPOCH + pd.to_timedelta(np.asarray(hours, dtype=np.int64), unit="h")
+    return stamps.strftime("%Y-%m-%d %H:00:00" if granularity == "hour" else "%Y-%m-%d").tolist()
+
+
+def _empty_series():
+    return pd.Series(np.empty(0, dtype=np.int64), index=pd.Index(np.empty(0, dtype=np.int64)))
+
+
+def _add(old, new):
+    """两个按索引对齐的计数序列相加（索引取并集并排序）"""
+    if old is None or old.empty:
+        return new.sort_index()
+    return old.add(new, fill_value=0).astype(np.int64).sort_index()
+
+
+class MessageRollup:
+    """
+    每小时消息数的增量汇总。
+    totals: 小时编号 -> 消息数；sent / received: (用户 ID, 小时编号) -> 发送 / 接收的消息数（per_user 时维护）
+    """
+
+    def __init__(self, per_user=True):
+        self.per_user = per_user
+        self.lock = threading.Lock()
+        self._reset()
+        self.checked_at = 0.0
+        self.stats = {}
+
+    def _reset(self):
+        self.watermark = 0
+        self.built_at = time.time()
+        self.totals = _empty_series()
+        empty_index = pd.MultiIndex.from_arrays([np.empty(0, dtype=np.int64)] * 2)
+        self.sent = pd.Series(dtype=np.int64, index=empty_index)
+        self.received = pd.Series(dtype=np.int64, index=empty_index)
+
+    def _fetch(self, low, high):
+        """聚合 (low, high] 范围内消息的每小时消息数（per_user 时同时按发送者和接收者分组）"""
+        user_columns = "sender_id, receiver_id," if self.per_user else ""
+        query = f"""
+            SELECT TIMESTAMPDIFF(HOUR, '1970-01-01 00:00:00', CONVERT_TZ(timestamp, '+00:00', '+08:00')) AS hour,
+                   {user_columns} COUNT(*) AS count
+            FROM messages
+            WHERE id > {low} AND id <= {high} AND timestamp IS NOT NULL
+            GROUP BY hour{", sender_id, receiver_id" if self.per_user else ""}
+        """
+        return fetch_columns(query, dtypes={"hour": np.int64, "sender_id": np.int64,
+                                            "receiver_id": np.int64, "count": np.int64})
+
+    def _merge(self, columns):
+        """把一批聚合结果累加到汇总序列中"""
+        hours, counts = columns["hour"], columns["count"]
+        if len(hours) == 0:
+            return
+        self.totals = _add(self.totals, pd.Series(counts, index=hours).groupby(level=0).sum())
+        if self.per_user:
+            for name, key in (("sent", "sender_id"), ("received", "receiver_id")):
+                index = pd.MultiIndex.from_arrays([columns[key], hours])
+                batch = pd.Series(counts, index=index).groupby(level=[0, 1]).sum()
+                setattr(self, name, _add(getattr(self, name), batch))
+
+    def refresh(self):
+        """
+        读取水位线之后的新消息并累加到汇总中（两次检查间隔不少于 refresh_interval 秒），
+        距上次全量构建超过 rebuild_seconds 时清空后全量重建。
+        :return: 汇总统计信息
+        """
+        with self.lock:
+            start = time.time()
+            if start - self.checked_at < ROLLUP_CONFIG["refresh_interval"]:
+                return self.stats
+            self.checked_at = start
+
+            mode = "incremental"
+            if self.watermark == 0 or start - self.built_at > ROLLUP_CONFIG["rebuild_seconds"]:
+                self._reset()
+                mode = "full"
+
+            new_watermark = fetch_message_watermark()
+            if new_watermark > self.watermark:
+                self._merge(self._fetch(self.watermark, new_watermark))
+                self.watermark = new_watermark
+
+            self.stats = {
+                "mode": mode,
+                "watermark": self.watermark,
+                "hours": len(self.totals),
+                "user_hours": len(self.sent) + len(self.received),
+                "seconds": round(time.time() - start, 4)
+            }
+            return self.stats
+
+    def query(self, start=None, end=None, granularity="hour", sender_id=None, receiver_id=None):
+        """
+        查询时间段内的消息数序列（只包含有消息的时间段）。
+        :param start / end: 起止时间（北京时间，包含两端所在的小时），None 表示不限
+        :param granularity: hour / day / week
+        :param sender_id / receiver_id: 只统计该用户发送 / 接收的消息（需要 per_user）
+        :return: (时间段起点的小时编号数组, 消息数数组)
+        """
+        self.refresh()
+        with self.lock:
+            if sender_id is not None:
+                series = self._user_series(self.sent, sender_id)
+            elif receiver_id is not None:
+                series = self._user_series(self.received, receiver_id)
+            else:
+                series = self.totals
+
+        series = series.loc[hour_of(start):hour_of(end)]
+        if granularity != "hour" and not series.empty:
+            series = series.groupby(_bucket(series.index.to_numpy(), granularity)).sum()
+        return series.index.to_numpy(dtype=np.int64), series.to_numpy(dtype=np.int64)
+
+    @staticmethod
+    def _user_series(table, user_id):
+        """取出某个用户的 小时编号 -> 消息数 序列"""
+        try:
+            return table.xs(int(user_id), level=0)
+        except KeyError:
+            return _empty_series()
+
+
+_rollup = MessageRollup(per_user=ROLLUP_CONFIG["per_user"])
+
+
+def query_message_counts(start=None, end=None, granularity="hour", sender_id=None, receiver_id=None):
+    """在进程内共享的小时汇总上查询消息数序列，参数和返回值见 MessageRollup.query"""
+    return _rollup.query(start, end, granularity, sender_id, receiver_id)
+
+
+def get_rollup_stats():
+    """小时汇总的统计信息（水位线、小时数、最近一次刷新的方式和耗时）"""
+    return dict(_rollup.stats, per_user=_rollup.per_user)
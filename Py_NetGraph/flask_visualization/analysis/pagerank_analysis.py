@@ -1,18 +1,69 @@
-from datetime import datetime, timedelta
-import networkx as nx
 import numpy as np
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-from database import fetch_data
+import scipy.sparse as sp
+from metrics import record, timed
+from .graph_snapshot import get_snapshot
+from .payload import value_range, color_levels, scale_sizes, build_nodes, message_edges
 
 
-def compute_pagerank(G, alpha=0.85, tol=1.0e-6, max_iter=100):
+def sparse_pagerank(adjacency, alpha=0.85, tol=1.0e-6, max_iter=100, personalization=None, dtype=np.float64):
+    """
+    基于稀疏矩阵的 PageRank 幂迭代，每轮迭代代价为 O(E)。
+    没有出边的节点（悬挂节点）的分数按个性化向量重新分配，保证分数总和为 1。
+    :param adjacency: N×N 稀疏邻接矩阵，行为起点、列为终点，值为边权重
+    :param alpha: 阻尼因子（默认 0.85）
+    :param tol: 迭代收敛阈值（相邻两轮分数差的 L1 范数）
+    :param max_iter: 最大迭代次数
+    :param personalization: 长度为 N 的个性化（随机跳转）向量，默认均匀分布
+    :param dtype: 计算精度，np.float32 或 np.float64
+    :return: (PageRank 数组, 迭代次数, 最终残差)
+    """
+    N = adjacency.shape[0]
+    if N == 0:
+        return np.empty(0, dtype=dtype), 0, 0.0
+
+    adjacency = sp.csr_matrix(adjacency, dtype=dtype)
+    adjacency_T = adjacency.T.tocsr()
+
+    # 预计算每个节点的加权出度及其倒数，悬挂节点的倒数置 0
+    out_degree = np.asarray(adjacency.sum(axis=1), dtype=dtype).ravel()
+    dangling = out_degree == 0
+    inv_out_degree = np.zeros(N, dtype=dtype)
+    np.divide(1, out_degree, out=inv_out_degree, where=~dangling)
+
+    if personalization is None:
+        p = np.full(N, 1.0 / N, dtype=dtype)
+    else:
+        p = np.asarray(personalization, dtype=dtype)
+        if p.shape != (N,) or p.sum() <= 0:
+            raise ValueError("personalization 必须是长度为 N、总和为正的向量")
+        p = p / p.sum()
+
+    pagerank = np.full(N, 1.0 / N, dtype=dtype)
+    residual = float("inf")
+    iterations = 0
+
+    for iterations in range(1, max_iter + 1):
+        new_pagerank = alpha * (adjacency_T @ (pagerank * inv_out_degree))
+        new_pagerank += (alpha * pagerank[dangling].sum() + (1 - alpha)) * p
+
+        # 判断收敛
+        residual = float(np.abs(new_pagerank - pagerank).sum())
+        pagerank = new_pagerank
+        if residual < tol:
+            break
+
+    record("iterations", iterations)
+    return pagerank, iterations, residual
+
+
+def compute_pagerank(G, alpha=0.85, tol=1.0e-6, max_iter=100, personalization=None):
     """
     计算 PageRank 值
     :param G: 以 networkx.DiGraph 表示的有向图
     :param alpha: 阻尼因子（默认 0.85）
     :param tol: 迭代收敛阈值
     :param max_iter: 最大迭代次数
+    :param personalization: {节点: 权重} 个性化字典，默认均匀分布
     :return: {节点: PageRank 值} 字典
     """
     users = list(G.nodes)
@@ -20,100 +71,47 @@ def compute_pagerank(G, alpha=0.85, tol=1.0e-6, max_iter=100):
     if N == 0:
         return {}
 
-    # 初始化 PageRank 值
-    pagerank = {user: 1.0 / N for user in users}
-    new_pagerank = pagerank.copy()
+    user_index = {user: i for i, user in enumerate(users)}
+    src = np.array([user_index[u] for u, _ in G.edges()], dtype=np.int64)
+    dst = np.array([user_index[v] for _, v in G.edges()], dtype=np.int64)
+    weight = np.array([data.get("weight", 1) for _, _, data in G.edges(data=True)], dtype=np.float64)
+    adjacency = sp.csr_matrix((weight, (src, dst)), shape=(N, N))
 
-    # 预计算每个用户的出度
-    out_degree = {user: sum(G[user][neighbor]["weight"] for neighbor in G[user]) if G[user] else 0 for user in users}
+    p = None
+    if personalization is not None:
+        p = np.array([personalization.get(user, 0) for user in users], dtype=np.float64)
 
-    for _ in range(max_iter):
-        for user in users:
-            new_pagerank[user] = (1 - alpha) / N + alpha * sum(
-                pagerank[neighbor] * G[neighbor][user]["weight"] / out_degree[neighbor]
-                for neighbor in G.predecessors(user) if out_degree[neighbor] > 0
-            )
+    pagerank, _, _ = sparse_pagerank(adjacency, alpha, tol, max_iter, p)
+    return dict(zip(users, pagerank.tolist()))
 
-        # 判断收敛
-        if sum(abs(new_pagerank[u] - pagerank[u]) for u in users) < tol:
-            break
-        pagerank = new_pagerank.copy()
 
-    return pagerank
+def compute_snapshot_pagerank(snapshot):
+    """在快照的消息交互图上计算 PageRank（包含所有用户），结果按用户下标对齐，每个快照只计算一次"""
+    def compute():
+        pagerank, iterations, residual = sparse_pagerank(snapshot.message_adj)
+        print(f"📈 PageRank 迭代 {iterations} 次收敛，残差 {residual:.3e}")
+        return pagerank
+    return snapshot.cached("pagerank", compute)
 
 
-def analyze_user_interactions_pagerank():
+@timed
+def analyze_user_interactions_pagerank(snapshot=None):
     """
     使用 PageRank 算法计算用户的传播性，基于最近一个月的消息互动数据。
     返回节点（用户）和边（互动关系）的数据，包含 PageRank 评分、颜色和大小等信息。
     """
-    # 计算最近一个月的时间范围
-    one_month_ago = datetime.now() - timedelta(days=30)
-    one_month_ago_str = one_month_ago.strftime('%Y-%m-%d %H:%M:%S')
-
-    # 查询所有用户信息
-    query_users = "SELECT id, username FROM users"
-    df_users = fetch_data(query_users)
-
-    # 查询最近一个月的消息互动数据
-    query_messages = f"""
-        SELECT m.sender_id, u1.username AS sender_name,
-               m.receiver_id, u2.username AS receiver_name,
-               COUNT(*) as weight
-        FROM messages m
-        JOIN users u1 ON m.sender_id = u1.id
-        JOIN users u2 ON m.receiver_id = u2.id
-        WHERE m.timestamp >= '{one_month_ago_str}'
-        GROUP BY m.sender_id, m.receiver_id
-    """
-    df_messages = fetch_data(query_messages)
-
-    # 构建有向图
-    G = nx.DiGraph()
-    user_map = {row["id"]: row["username"] for _, row in df_users.iterrows()}
-
-    # 添加带权重的边（消息传播）
-    for _, row in df_messages.iterrows():
-        G.add_edge(row["sender_id"], row["receiver_id"], weight=row["weight"])
-
-    # 确保所有用户都作为节点
-    G.add_nodes_from(df_users['id'])
-
-    # **使用自定义 PageRank 计算**
-    pagerank_scores = compute_pagerank(G)
-
-    # 归一化 PageRank 结果
-    scores_values = np.array(list(pagerank_scores.values()))
-    vmin, vmax = scores_values.min(), scores_values.max() if len(scores_values) > 0 else (0, 1)
-
-    # 颜色划分
-    bins = np.linspace(vmin, vmax, 6)
-    colors = [cm.viridis(i / 5) for i in range(6)]
-
-    # 为每个用户分配颜色和大小
-    user_colors = [
-        mcolors.to_hex(colors[np.digitize(pagerank_scores.get(user_id, 0), bins) - 1])
-        for user_id in user_map.keys()
-    ]
-    user_sizes = [
-        np.interp(pagerank_scores.get(user_id, 0), (vmin, vmax), (1000, 6000))
-        for user_id in user_map.keys()
-    ]
-
-    # 构造 JSON 格式的用户数据
-    nodes = [{
-        "id": int(user_id),
-        "username": user_map[user_id],
-        "size": user_sizes[i],
-        "color": user_colors[i],
-        "pagerank": pagerank_scores.get(user_id, 0)
-    } for i, user_id in enumerate(user_map.keys())]
-
-    # 构造边数据
-    edges = [{
-        "source": int(u),
-        "target": int(v),
-        "weight": G[u][v]["weight"]
-    } for u, v in G.edges()]
+    snapshot = snapshot or get_snapshot()
+
+    # **使用稀疏矩阵 PageRank 计算**
+    pagerank_scores = compute_snapshot_pagerank(snapshot)
+    vmin, vmax = value_range(pagerank_scores)
+
+    # 为每个用户分配颜色（6 级）和大小（映射到 1000 ~ 6000）
+    user_colors = color_levels(pagerank_scores, "viridis", vmin, vmax)
+    user_sizes = scale_sizes(pagerank_scores, (1000, 6000), vmin, vmax)
+
+    # 构造 JSON 格式的用户数据与边数据
+    nodes = build_nodes(snapshot, size=user_sizes, color=user_colors, pagerank=pagerank_scores)
+    edges = message_edges(snapshot)
 
     return {"nodes": nodes, "edges": edges}
@@ -0,0 +1,120 @@
+"""
+可视化数据构造
+各分析模块共用的节点 / 边数据构造工具：颜色分层、节点大小映射都对整个数组一次完成，
+颜色使用预先计算好的调色板查找表，不再逐个节点调用 np.digitize / np.interp / mcolors.to_hex。
+节点和边以列式的 ColumnTable 保存，可以序列化为 JSON，也可以编码为二进制列式格式（见 columnar.py）。
+"""
+from functools import lru_cache
+import numpy as np
+import matplotlib
+import matplotlib.colors as mcolors
+
+
+@lru_cache(maxsize=None)
+def palette(cmap_name, levels=6):
+    """调色板查找表：从色图中等间隔取 levels 个颜色，返回十六进制颜色字符串数组"""
+    cmap = matplotlib.colormaps[cmap_name]
+    return np.array([mcolors.to_hex(cmap(i / (levels - 1))) for i in range(levels)], dtype=object)
+
+
+def value_range(values):
+    """数值范围 (最小值, 最大值)，空数组返回 (0, 0)"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return 0, 0
+    return values.min(), values.max()
+
+
+def color_levels(values, cmap_name, vmin=None, vmax=None, levels=6):
+    """
+    按数值将 [vmin, vmax] 等分为 levels 层并分配颜色（数值越大层级越高）。
+    :return: 与 values 对齐的十六进制颜色字符串数组
+    """
+    values = np.asarray(values)
+    if vmin is None or vmax is None:
+        vmin, vmax = value_range(values)
+    bins = np.linspace(vmin, vmax, levels)
+    return palette(cmap_name, levels)[np.digitize(values, bins) - 1]
+
+
+def scale_sizes(values, size_range, vmin=None, vmax=None):
+    """将数值线性映射到节点大小范围 size_range = (最小大小, 最大大小)"""
+    values = np.asarray(values)
+    if vmin is None or vmax is None:
+        vmin, vmax = value_range(values)
+    return np.interp(values, (vmin, vmax), size_range)
+
+
+def _column(values):
+    """数组转换为 Python 列表（numpy 标量转为内置类型，便于 JSON 序列化）"""
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+class ColumnTable:
+    """
+    列式保存的记录表（节点、边等）。
+    序列化为 JSON 时展开为字典列表（只展开一次），请求二进制列式格式时直接输出各列的数组。
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.length = len(next(iter(columns.values()))) if columns else 0
+        self._records = None
+        self._derived = {}
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.to_records())
+
+    def column(self, name):
+        """以 numpy 数组形式返回某一列"""
+        values = self.columns[name]
+        return values if isinstance(values, np.ndarray) else np.asarray(values, dtype=object)
+
+    def take(self, indices):
+        """按行下标取出子表"""
+        return ColumnTable({name: self.column(name)[indices] for name in self.columns})
+
+    def cached(self, key, builder):
+        """基于本表派生的数据（如邻接矩阵），每个表只构建一次"""
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived[key] = builder()
+        return value
+
+    def to_records(self):
+        """展开为字典列表，键的顺序与列的顺序一致"""
+        if self._records is None:
+            keys = list(self.columns)
+            self._records = [dict(zip(keys, row))
+                             for row in zip(*(_column(values) for values in self.columns.values()))]
+        return self._records
+
+
+def build_records(**columns):
+    """
+    将若干等长的列组装为记录表，键的顺序与参数顺序一致。
+    例如 build_records(id=ids, size=sizes) 序列化后为 [{"id": ..., "size": ...}, ...]
+    """
+    return ColumnTable(columns)
+
+
+def build_nodes(snapshot, **columns):
+    """构造快照全部用户的节点数据：id、username 之后依次为 columns 中的各列"""
+    return build_records(id=snapshot.user_ids, username=snapshot.usernames, **columns)
+
+
+def build_edges(snapshot, src, dst, weight=None):
+    """由用户下标数组构造边数据（source / target 为用户 ID，可选 weight）"""
+    source, target = snapshot.user_ids[src], snapshot.user_ids[dst]
+    if weight is None:
+        return build_records(source=source, target=target)
+    return build_records(source=source, target=target, weight=weight)
+
+
+def message_edges(snapshot):
+    """消息交互边数据（每个快照只构建一次，多个接口共用）"""
+    return snapshot.cached("message_edges_payload", lambda: build_edges(
+        snapshot, snapshot.message_src, snapshot.message_dst, snapshot.message_weight))
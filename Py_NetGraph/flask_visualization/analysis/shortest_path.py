@@ -1,5 +1,6 @@
 import heapq
-from database import fetch_data  # 确保数据库连接和查询函数正确
+from metrics import timed
+from .graph_snapshot import get_snapshot
 
 def dijkstra_shortest_path(graph, start, end):
     """
@@ -30,64 +31,122 @@ def dijkstra_shortest_path(graph, start, end):
     return None, float("inf")  # 若未找到路径，返回 None 和无穷大代价
 
 
-def analyze_Djs(start_user, end_user):
+def bidirectional_bfs(indptr, indices, start, end):
     """
-    计算两个用户之间的最短路径。
-    :param start_user: 起始用户的用户名。
-    :param end_user: 目标用户的用户名。
-    :return: 包含最短路径信息的字典。
+    在无权无向图（CSR 邻接表）上使用双向 BFS 计算最短路径。
+    每一轮扩展较小的一侧前沿，两侧的父节点表只记录已访问的节点，
+    因此单次查询的代价只与探索到的前沿大小有关，与全图规模无关。
+    :param indptr: CSR 行指针数组。
+    :param indices: CSR 列下标数组。
+    :param start: 起始节点下标。
+    :param end: 目标节点下标。
+    :return: (最短路径节点下标列表, 访问的节点数)；不连通时路径为 None。
     """
-    # 1. 查询用户信息，获取用户 ID
-    query = "SELECT id, username FROM users"
-    df_users = fetch_data(query)  # 从数据库获取用户数据
+    if start == end:
+        return [start], 1
+
+    parents_forward = {start: -1}  # 正向搜索的父节点表
+    parents_backward = {end: -1}  # 反向搜索的父节点表
+    frontier_forward, frontier_backward = [start], [end]
+
+    while frontier_forward and frontier_backward:
+        # 扩展较小的前沿
+        if len(frontier_forward) > len(frontier_backward):
+            frontier_forward, frontier_backward = frontier_backward, frontier_forward
+            parents_forward, parents_backward = parents_backward, parents_forward
+
+        next_frontier = []
+        for node in frontier_forward:
+            for neighbor in indices[indptr[node]:indptr[node + 1]].tolist():
+                if neighbor in parents_forward:
+                    continue
+                parents_forward[neighbor] = node
+                if neighbor in parents_backward:
+                    # 两侧相遇：拼接两段路径
+                    path, current = [], neighbor
+                    while current != -1:
+                        path.append(current)
+                        current = parents_forward[current]
+                    path.reverse()
+                    current = parents_backward[neighbor]
+                    while current != -1:
+                        path.append(current)
+                        current = parents_backward[current]
+                    if path[0] != start:
+                        path.reverse()
+                    return path, len(parents_forward) + len(parents_backward)
+                next_frontier.append(neighbor)
+        frontier_forward = next_frontier
+
+    return None, len(parents_forward) + len(parents_backward)
+
+
+def _friend_path(snapshot, username_to_index, start_user, end_user):
+    """在快照的好友关系图上查询两个用户之间的最短路径，返回结果字典"""
+    # 确保起始用户和目标用户都存在于数据库
+    if start_user not in username_to_index or end_user not in username_to_index:
+        return {"error": "起始用户或目标用户不存在"}
 
-    if df_users.empty:
-        return {"error": "用户数据为空"}  # 若数据库无数据，则返回错误信息
+    adj = snapshot.friend_adj
+    path, _ = bidirectional_bfs(adj.indptr, adj.indices, username_to_index[start_user], username_to_index[end_user])
 
-    # 2. 创建用户名到用户 ID 的映射
-    username_to_id = {row["username"]: row["id"] for _, row in df_users.iterrows()}
+    if not path:
+        return {"error": "未找到路径"}  # 若未找到路径，返回错误信息
 
-    # 3. 确保起始用户和目标用户都存在于数据库
-    if start_user not in username_to_id or end_user not in username_to_id:
-        return {"error": "起始用户或目标用户不存在"}
+    # 计算路径的步骤数和跳过的用户数
+    steps = len(path) - 1  # 计算路径中的步数
+    skipped_users = len(path) - 2  # 跳过的用户数（不包括起始和目标用户）
 
-    start_user_id = username_to_id[start_user]
-    end_user_id = username_to_id[end_user]
+    return {
+        "path": snapshot.user_ids[path].tolist(),  # 最短路径（用户 ID 列表）
+        "cost": steps,  # 最短路径的总代价（好友关系权重均为 1）
+        "steps": steps,  # 总步数
+        "skipped_users": skipped_users  # 跳过的用户数
+    }
 
-    # 4. 查询好友关系数据
-    query = "SELECT user_id, friend_id FROM friends"
-    df_friends = fetch_data(query)
 
-    if df_friends.empty:
-        return {"error": "好友数据为空"}
+def _username_index(snapshot):
+    """用户名到用户下标的映射（与使用同一用户目录的快照共用）"""
+    return snapshot.directory.username_index
+
 
-    # 5. 构建用户社交网络图（无向图）
-    graph = {}
-    for _, row in df_friends.iterrows():
-        user_a, user_b = int(row["user_id"]), int(row["friend_id"])
-        if user_a not in graph:
-            graph[user_a] = {}
-        if user_b not in graph:
-            graph[user_b] = {}
+@timed
+def analyze_Djs(start_user, end_user, snapshot=None):
+    """
+    计算两个用户之间的最短路径（好友关系图，双向 BFS）。
+    :param start_user: 起始用户的用户名。
+    :param end_user: 目标用户的用户名。
+    :param snapshot: 共享图快照，默认使用进程内的最新快照。
+    :return: 包含最短路径信息的字典。
+    """
+    snapshot = snapshot or get_snapshot()
 
-        graph[user_a][user_b] = 1  # 设定权重为 1，表示好友关系
-        graph[user_b][user_a] = 1
+    if snapshot.num_users == 0:
+        return {"error": "用户数据为空"}  # 若数据库无数据，则返回错误信息
+    if snapshot.friend_adj.nnz == 0:
+        return {"error": "好友数据为空"}
 
-    print("Graph:", graph)  # 调试用，打印构建的图
+    return _friend_path(snapshot, _username_index(snapshot), start_user, end_user)
 
-    # 6. 使用 Dijkstra 算法计算最短路径
-    shortest_path, cost = dijkstra_shortest_path(graph, start_user_id, end_user_id)
 
-    if not shortest_path:
-        return {"error": "未找到路径"}  # 若未找到路径，返回错误信息
+@timed
+def analyze_shortest_paths(pairs, snapshot=None):
+    """
+    批量计算多对用户之间的最短路径，所有查询共享同一个快照和索引。
+    :param pairs: [(起始用户名, 目标用户名), ...]
+    :param snapshot: 共享图快照，默认使用进程内的最新快照。
+    :return: {"results": [...]}，每一项与 analyze_Djs 的返回格式相同，并附带 start_user 和 end_user。
+    """
+    snapshot = snapshot or get_snapshot()
 
-    # 7. 计算路径的步骤数和跳过的用户数
-    steps = len(shortest_path) - 1  # 计算路径中的步数
-    skipped_users = len(shortest_path) - 2  # 跳过的用户数（不包括起始和目标用户）
+    if snapshot.num_users == 0:
+        return {"error": "用户数据为空"}
+    if snapshot.friend_adj.nnz == 0:
+        return {"error": "好友数据为空"}
 
-    return {
-        "path": shortest_path,  # 最短路径（用户 ID 列表）
-        "cost": cost,  # 最短路径的总代价
-        "steps": steps,  # 总步数
-        "skipped_users": skipped_users  # 跳过的用户数
-    }
+    username_to_index = _username_index(snapshot)
+    results = []
+    for start_user, end_user in pairs:
+        result = _friend_path(snapshot, username_to_index, start_user, end_user)
+        results.append({"start_user": start_user, "end_user": end_user, **result})
+    return {"results": results}
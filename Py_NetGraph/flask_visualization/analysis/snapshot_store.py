@@ -0,0 +1,150 @@
+"""
+快照文件
+多个 worker 进程共用同一份图快照：由一个进程构建并写入快照文件，其余进程以只读 mmap 打开，
+NumPy 数组直接是映射内存上的视图（不复制），所有进程共用同一份物理内存（操作系统页缓存）。
+
+文件格式（小端序）：
+    b"NGSNAP1\\n" | 头部长度（uint64） | 头部（UTF-8 JSON） | 按 64 字节对齐的各数组数据
+头部记录元数据（时间窗口、消息水位线、数据版本、构建时间）以及每个数组的 dtype、形状和相对数据区起点的偏移。
+
+文件名为 snapshot_<时间窗口>d_<数据版本摘要>_<构建时间毫秒>.ngs，同一数据版本可以有多个文件（时间窗口随时间滑动），
+取最新且未过期的一个。文件先写临时文件再原子改名，从不原地覆盖：正在使用旧文件的请求不受影响，
+旧文件在新文件写好后删除（POSIX 下已映射的内存在最后一个引用释放前仍然有效；Windows 下删除失败时留待下次清理）。
+"""
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+from contextlib import contextmanager
+import numpy as np
+
+MAGIC = b"NGSNAP1\n"
+FORMAT_VERSION = 1
+_ALIGN = 64
+_NAME = re.compile(r"snapshot_(\d+)d_([0-9a-f]+)_(\d+)\.ngs$")
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def version_digest(data_version):
+    """数据版本（元组）的摘要，用于文件名"""
+    return hashlib.sha1(repr(tuple(data_version)).encode("utf-8")).hexdigest()[:16]
+
+
+def write_snapshot_file(store_dir, days, data_version, arrays, meta):
+    """
+    原子地写入快照文件（先写临时文件，fsync 后改名），返回文件路径。
+    :param arrays: {名称: NumPy 数组}
+    :param meta: 可 JSON 序列化的元数据字典，其中 built_at 为构建时间（Unix 时间戳）
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(dict(meta, format=FORMAT_VERSION, data_version=list(data_version), arrays=layout),
+                        ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    name = f"snapshot_{days}d_{version_digest(data_version)}_{int(meta['built_at'] * 1000)}.ngs"
+    path = os.path.join(store_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_snapshot_file(path):
+    """
+    以只读 mmap 打开快照文件。
+    :return: ({名称: 只读 NumPy 视图}, 元数据字典)；映射随最后一个视图的释放而关闭
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        mapped.close()
+        raise ValueError(f"不是快照文件：{path}")
+    header_length, = struct.unpack_from("<Q", mapped, len(MAGIC))
+    meta = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + header_length].decode("utf-8"))
+    if meta.get("format") != FORMAT_VERSION:
+        mapped.close()
+        raise ValueError(f"不支持的快照文件格式：{meta.get('format')}")
+    data_start = _align(len(MAGIC) + 8 + header_length)
+
+    arrays = {}
+    for name, spec in meta.pop("arrays").items():
+        shape = tuple(spec["shape"])
+        arrays[name] = np.frombuffer(mapped, dtype=np.dtype(spec["dtype"]), count=int(np.prod(shape)),
+                                     offset=data_start + spec["offset"]).reshape(shape)
+    meta["data_version"] = tuple(meta["data_version"])
+    return arrays, meta
+
+
+def find_snapshot_file(store_dir, days, data_version, max_age):
+    """数据版本为 data_version、构建时间在 max_age 秒以内的最新快照文件，没有时返回 None"""
+    pattern = os.path.join(store_dir, f"snapshot_{days}d_{version_digest(data_version)}_*.ngs")
+    newest, newest_built_at = None, time.time() - max_age
+    for path in glob.glob(pattern):
+        match = _NAME.search(path)
+        if match and int(match.group(3)) / 1000 >= newest_built_at:
+            newest, newest_built_at = path, int(match.group(3)) / 1000
+    return newest
+
+
+def remove_stale_files(store_dir, days, keep, stale_seconds):
+    """删除同一时间窗口的其他快照文件，以及超过 stale_seconds 秒的临时文件（删除失败时忽略）"""
+    for path in glob.glob(os.path.join(store_dir, f"snapshot_{days}d_*")):
+        if os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            if not path.endswith(".tmp") or time.time() - os.path.getmtime(path) > stale_seconds:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def build_lock(store_dir, days, stale_seconds):
+    """
+    跨进程的快照构建锁（以 O_EXCL 创建锁文件），同一时间窗口同一时刻只有一个进程查询数据库并构建快照。
+    锁文件超过 stale_seconds 秒仍未删除时视为持有者已退出，强制接管。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, f"snapshot_{days}d.lock")
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_seconds:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
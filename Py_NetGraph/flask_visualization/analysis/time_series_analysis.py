@@ -1,108 +1,160 @@
+import numpy as np
 import pandas as pd
-from database import fetch_data
+from database import fetch_chunks
+from metrics import timed
+from .user_directory import get_user_directory
+from .message_rollup import GRANULARITIES, query_message_counts, format_hours
 
 
-def analyze_by_timestamp():
+@timed
+def analyze_by_timestamp(start=None, end=None, granularity="hour", sender_id=None, receiver_id=None):
     """
-    按时间戳分析消息数量，并将时间转换为北京时间（UTC+8）。
+    按时间段统计消息数量（北京时间，UTC+8）。
 
-    1. 从数据库 `messages` 表中获取消息时间戳。
-    2. 将 UTC 时间转换为北京时间（+8 时区）。
-    3. 统计每个小时的消息数量，并按时间排序。
-    4. 生成 JSON 格式的结果，返回时间序列数据。
+    1. 从增量维护的每小时消息数汇总中读取（只聚合上次刷新之后的新消息，见 message_rollup.py）。
+    2. 截取 [start, end] 时间范围，按小时 / 天 / 周汇总。
+    3. 生成 JSON 格式的结果，返回时间序列数据（只包含有消息的时间段）。
 
-    :return: 以 JSON 形式返回 {"time_series": [{"timestamp": str, "count": float}, ...]}
+    :param start / end: 起止时间（北京时间字符串，包含两端所在的小时），默认不限
+    :param granularity: 汇总粒度 hour / day / week
+    :param sender_id / receiver_id: 只统计该用户发送 / 接收的消息
+    :return: 以 JSON 形式返回 {"time_series": [{"timestamp": str, "count": float}, ...], "granularity": str}
     """
-    query = """
-    SELECT
-        DATE_FORMAT(CONVERT_TZ(timestamp, '+00:00', '+08:00'), '%Y-%m-%d %H:00:00') AS timestamp,
-        COUNT(*) AS count
-    FROM
-        messages
-    GROUP BY
-        DATE_FORMAT(CONVERT_TZ(timestamp, '+00:00', '+08:00'), '%Y-%m-%d %H:00:00')
-    ORDER BY
-        timestamp;
-    """
-
-    # 从数据库获取数据
-    df = fetch_data(query)
-
-    # 检查数据是否为空
-    if df is None or df.empty:
-        return {"time_series": []}
+    if granularity not in GRANULARITIES:
+        return {"error": f"不支持的汇总粒度 {granularity}，可选 {', '.join(GRANULARITIES)}"}
+    try:
+        hours, counts = query_message_counts(start, end, granularity, sender_id, receiver_id)
+    except ValueError:
+        return {"error": f"无法解析的时间范围 {start} ~ {end}"}
 
     # 生成时间序列数据列表
-    time_series = []
-    for _, row in df.iterrows():
-        time_series.append({
-            "timestamp": row["timestamp"],  # 转换后的北京时间
-            "count": float(row["count"])  # 确保 `count` 是浮点数格式
-        })
+    time_series = [
+        {"timestamp": timestamp, "count": float(count)}  # 确保 `count` 是浮点数格式
+        for timestamp, count in zip(format_hours(hours, granularity), counts.tolist())
+    ]
 
-    return {"time_series": time_series}
+    return {"time_series": time_series, "granularity": granularity}
 
 
+class _UserHourTracker:
+    """
+    按用户流式统计消息时间分布，内存与用户数成正比：
+    - hist: 每个用户 24 个桶的小时分布（一天中的第几个小时，北京时间）
+    - 峰值小时：每个用户只记录当前小时的计数和目前为止的最大值，要求同一用户的消息按时间顺序到达
+      （同一数据块内可以乱序）；检测到跨数据块的时间倒序时 ordered 置为 False，由调用方按时间排序后重新统计
+    """
+
+    def __init__(self):
+        self.hist = np.zeros((0, 24), dtype=np.int64)
+        self.current_hour = np.empty(0, dtype=np.int64)
+        self.current_count = np.empty(0, dtype=np.int64)
+        self.best_hour = np.empty(0, dtype=np.int64)
+        self.best_count = np.empty(0, dtype=np.int64)
+        self.ordered = True
+
+    def _grow(self, size):
+        """状态数组按用户 ID 下标存储，遇到更大的用户 ID 时扩容"""
+        for name, fill in (("hist", 0), ("current_hour", -1), ("current_count", 0), ("best_hour", -1),
+                           ("best_count", 0)):
+            old = getattr(self, name)
+            new = np.full((size,) + old.shape[1:], fill, dtype=np.int64)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, user_ids, hours):
+        """累加一个数据块：user_ids 为发送者 ID，hours 为自 1970-01-01 起的小时编号（北京时间）"""
+        if len(user_ids) == 0:
+            return
+        if user_ids.max() >= len(self.hist):
+            self._grow(max(int(user_ids.max()) + 1, 2 * len(self.hist)))
+
+        # 一天中各小时的分布
+        cells, cell_counts = np.unique(user_ids * 24 + hours % 24, return_counts=True)
+        self.hist.reshape(-1)[cells] += cell_counts
+
+        # 数据块内按 (用户, 小时) 计数，结果按用户、小时升序排列
+        keys, counts = np.unique(user_ids * (1 << 32) + hours, return_counts=True)
+        users, group_hours = keys >> 32, keys & ((1 << 32) - 1)
+        first = np.r_[True, users[1:] != users[:-1]]
+        last = np.r_[users[1:] != users[:-1], True]
+        if np.any(group_hours[first] < self.current_hour[users[first]]):
+            self.ordered = False
+
+        # 与上一个数据块末尾的同一小时合并
+        carry = first & (group_hours == self.current_hour[users])
+        counts[carry] += self.current_count[users[carry]]
+
+        # 每个用户在本块内计数最多的小时（相同计数取最早的小时），与已有的最大值比较
+        order = np.lexsort((group_hours, -counts, users))
+        top = order[np.r_[True, users[order][1:] != users[order][:-1]]]
+        top_users, top_hours, top_counts = users[top], group_hours[top], counts[top]
+        better = (top_counts > self.best_count[top_users]) | (
+            (top_counts == self.best_count[top_users]) & (top_hours < self.best_hour[top_users]))
+        self.best_count[top_users[better]] = top_counts[better]
+        self.best_hour[top_users[better]] = top_hours[better]
+
+        # 每个用户最后一个小时作为下一块的当前小时
+        self.current_hour[users[last]] = group_hours[last]
+        self.current_count[users[last]] = counts[last]
+
+
+def _track_user_hours(order_by):
+    """流式读取 (sender_id, timestamp)，返回统计结果；时间转换为北京时间后按小时编号"""
+    query = f"SELECT sender_id, timestamp FROM messages ORDER BY {order_by}"
+    tracker = _UserHourTracker()
+    for chunk in fetch_chunks(query, dtypes={"sender_id": np.int64}):
+        # 过滤掉转换失败的时间数据
+        timestamps = pd.to_datetime(chunk["timestamp"], errors="coerce").to_numpy(dtype="datetime64[h]")
+        valid = ~np.isnat(timestamps)
+        hours = timestamps[valid].astype(np.int64) + 8  # UTC 转换为北京时间（UTC+8）
+        tracker.add(chunk["sender_id"][valid], hours)
+    return tracker
+
+
+@timed
 def analyze_user_behavior():
     """
     获取用户行为数据并生成分析报告。
 
-    1. 查询 `messages` 表和 `users` 表，获取用户 ID、用户名、消息时间和消息内容。
-    2. 处理时间格式，将 UTC 时间转换为北京时间。
-    3. 统计每小时的用户活跃度，找出每个用户最活跃的时间段。
-    4. 计算每个用户发送的总消息数量。
-    5. 生成用户行为分析报告，并返回 JSON 结构。
+    1. 分块流式读取 `messages` 表的发送者 ID 和消息时间（不读取消息内容，不关联 `users` 表）。
+    2. 将 UTC 时间转换为北京时间，按用户累计一天 24 小时的消息分布，并跟踪每个用户消息最多的小时。
+    3. 计算每个用户发送的总消息数量，用户名来自共享的用户目录。
+    4. 生成用户行为分析报告，并返回 JSON 结构。内存占用与用户数成正比，与消息历史长度无关。
 
-    :return: 以 JSON 形式返回 {"user_behavior": [{"user_id": int, "username": str, "message_count": int, "active_period": str}, ...]}
-    """
-    query = """
-        SELECT m.sender_id AS user_id, u.username, m.timestamp, m.content AS message 
-        FROM messages m
-        JOIN users u ON m.sender_id = u.id 
+    :return: 以 JSON 形式返回 {"user_behavior": [{"user_id": int, "username": str, "message_count": int,
+             "active_period": str, "active_hour_of_day": int}, ...]}
     """
+    # 消息按自增 ID 读取，一般即为时间顺序；出现跨数据块的时间倒序时按时间排序后重新统计
+    tracker = _track_user_hours("id")
+    if not tracker.ordered:
+        print("⚠️ 消息 ID 与时间顺序不一致，按时间排序后重新统计")
+        tracker = _track_user_hours("timestamp, id")
 
-    # 获取数据
-    df = fetch_data(query)
+    # 计算每个用户的消息总数（只保留 users 表中存在的用户）
+    user_map = get_user_directory().user_map
+    message_count = tracker.hist.sum(axis=1)
+    user_ids = [user_id for user_id in np.flatnonzero(message_count).tolist() if user_id in user_map]
 
     # 检查数据是否为空
-    if df is None or df.empty:
+    if not user_ids:
         print("No data retrieved from the database.")
         return {"user_behavior": []}
 
-    # 打印前几行数据，检查数据格式（调试用）
-    print(df.head())
-
-    # 将时间戳转换为 pandas 日期时间格式
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors='coerce')
-
-    # 过滤掉转换失败的时间数据
-    df = df.dropna(subset=["timestamp"])
-
-    # 先 localize 为 UTC，然后转换为北京时间（Asia/Shanghai）
-    df["beijing_time"] = df["timestamp"].dt.tz_localize('UTC').dt.tz_convert('Asia/Shanghai')
-
-    # 统计每小时的用户活跃度
-    df.set_index("beijing_time", inplace=True)
-    user_activity = df.groupby([pd.Grouper(freq='h'), 'user_id']).size().unstack(fill_value=0)
-
-    # 找出每个用户最活跃的时间段（发送消息最多的小时）
-    user_active_period = user_activity.idxmax(axis=0)
-
-    # 计算每个用户的消息总数
-    user_message_count = df.groupby('user_id').size()
-
-    # 获取用户 ID 到用户名的映射
-    user_id_to_name = df.set_index("user_id")["username"].to_dict()
+    # 每个用户最活跃的时间段（发送消息最多的小时，北京时间）和一天中最活跃的小时
+    active_periods = [f"{period}+08:00" for period in format_hours(tracker.best_hour[user_ids])]
+    active_hours = tracker.hist[user_ids].argmax(axis=1).tolist()
 
     # 生成用户行为分析报告
-    user_behavior_report = []
-    for user_id in user_message_count.index:
-        user_behavior_report.append({
+    user_behavior_report = [
+        {
             "user_id": user_id,  # 用户 ID
-            "username": user_id_to_name.get(user_id, "未知用户"),  # 获取用户名，若找不到则填充"未知用户"
-            "message_count": int(user_message_count[user_id]),  # 确保消息计数是整数
-            "active_period": str(user_active_period[user_id]) if not pd.isna(user_active_period[user_id]) else "无数据"
-            # 若没有活跃时间则返回"无数据"
-        })
+            "username": user_map[user_id],
+            "message_count": count,
+            "active_period": period,
+            "active_hour_of_day": hour
+        }
+        for user_id, count, period, hour in zip(user_ids, message_count[user_ids].tolist(), active_periods,
+                                                active_hours)
+    ]
 
     return {"user_behavior": user_behavior_report}
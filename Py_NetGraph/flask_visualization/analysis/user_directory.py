@@ -0,0 +1,153 @@
+"""
+用户目录
+进程内所有快照和接口共用的用户 ID ↔ 用户名对照表：
+    - ids: 按 ID 升序排列的用户 ID（int64），数组下标即用户在图中的下标
+    - usernames: 与 ids 对齐的用户名列表
+    - index: 稠密的 ID → 下标数组（int32，长度为 MAX(id) + 1，不存在的 ID 为 -1），
+      边查询只需读取整数 ID 列，整体查表即可转换为下标，不必再 JOIN users 表
+用户表按自增 ID 追加：每次刷新先查询 MAX(id) 和 COUNT(*)，只读取上次之后的新用户；
+用户数对不上（有用户被删除）或距上次全量加载超过 rebuild_seconds（用户名可能被修改）时全量重新加载。
+目录对象只读，刷新时生成新的对象，已经加载的快照继续引用刷新前的目录。
+"""
+import threading
+import time
+import numpy as np
+from config import USER_DIRECTORY_CONFIG
+from database import fetch_columns
+
+
+class UserDirectory:
+    """某一时刻的用户目录（只读）"""
+
+    def __init__(self, ids, usernames, index=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.usernames = list(usernames)
+        self.size = len(self.ids)
+        self.max_id = int(self.ids[-1]) if self.size else 0
+        if index is None:
+            index = np.full(self.max_id + 1, -1, dtype=np.int32)
+            index[self.ids] = np.arange(self.size, dtype=np.int32)
+        self.index = index
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def extend(self, ids, usernames):
+        """追加 ID 大于 max_id 的新用户（按 ID 升序），返回新的目录，已有用户的下标不变"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return self
+        index = np.full(int(ids[-1]) + 1, -1, dtype=np.int32)
+        index[:len(self.index)] = self.index
+        index[ids] = np.arange(self.size, self.size + len(ids), dtype=np.int32)
+        return UserDirectory(np.concatenate([self.ids, ids]), self.usernames + list(usernames), index)
+
+    def lookup(self, user_ids):
+        """用户 ID 数组转换为下标数组（int32），不存在的 ID 为 -1"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        found = (user_ids >= 0) & (user_ids < len(self.index))
+        result = np.full(len(user_ids), -1, dtype=np.int32)
+        result[found] = self.index[user_ids[found]]
+        return result
+
+    def index_of(self, user_id):
+        """用户 ID 转换为下标，不存在时返回 None"""
+        if 0 <= user_id < len(self.index) and self.index[user_id] >= 0:
+            return int(self.index[user_id])
+        return None
+
+    def to_arrays(self):
+        """转换为可写入快照文件的数组（用户名编码为 UTF-8 字节串和偏移数组）"""
+        encoded = [name.encode("utf-8") for name in self.usernames]
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+        return {
+            "user_ids": self.ids,
+            "user_index": self.index,
+            "username_offsets": offsets,
+            "username_bytes": np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """由 to_arrays 的结果（如快照文件的内存映射视图）创建目录，ID 和下标数组不复制"""
+        blob = arrays["username_bytes"].tobytes()
+        offsets = arrays["username_offsets"].tolist()
+        usernames = [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return cls(arrays["user_ids"], usernames, arrays["user_index"])
+
+    def _cached(self, key, builder):
+        with self._derived_lock:
+            value = self._derived.get(key)
+            if value is None:
+                value = self._derived[key] = builder()
+            return value
+
+    @property
+    def user_map(self):
+        """{用户 ID: 用户名} 字典（每个目录只构建一次）"""
+        return self._cached("user_map", lambda: dict(zip(self.ids.tolist(), self.usernames)))
+
+    @property
+    def username_index(self):
+        """{用户名: 下标} 字典（每个目录只构建一次）"""
+        return self._cached("username_index", lambda: {name: i for i, name in enumerate(self.usernames)})
+
+
+def _fetch_users(after_id=0):
+    users = fetch_columns(f"SELECT id, username FROM users WHERE id > {int(after_id)} ORDER BY id", {"id": np.int64})
+    return users["id"], users["username"].tolist()
+
+
+_directory = UserDirectory([], [])
+_loaded_at = 0.0   # 上次全量加载的时间
+_checked_at = 0.0  # 上次检查新用户的时间
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_user_directory(fresh=False):
+    """
+    获取当前的用户目录，距上次检查超过 refresh_interval 秒（或 fresh 为真）时先增量刷新。
+    :param fresh: 为真时不论距上次检查多久都先刷新（加载快照时使用，保证包含数据版本中的所有用户）
+    """
+    global _directory, _loaded_at, _checked_at, _stats
+    with _lock:
+        start = time.time()
+        if not fresh and start - _checked_at < USER_DIRECTORY_CONFIG["refresh_interval"]:
+            return _directory
+        _checked_at = start
+
+        counts = fetch_columns("SELECT COALESCE(MAX(id), 0) AS max_id, COUNT(*) AS count FROM users",
+                               {"max_id": np.int64, "count": np.int64})
+        max_id, count = int(counts["max_id"][0]), int(counts["count"][0])
+
+        mode = "unchanged"
+        directory = _directory
+        if start - _loaded_at <= USER_DIRECTORY_CONFIG["rebuild_seconds"] and max_id >= directory.max_id:
+            if max_id > directory.max_id:
+                directory = directory.extend(*_fetch_users(directory.max_id))
+                mode = "incremental"
+        else:
+            directory = None
+        if directory is None or directory.size != count:
+            directory = UserDirectory(*_fetch_users())
+            _loaded_at = start
+            mode = "full"
+
+        _directory = directory
+        _stats = {"mode": mode, "users": directory.size, "max_id": directory.max_id,
+                  "seconds": round(time.time() - start, 4)}
+        return _directory
+
+
+def invalidate_user_directory():
+    """丢弃已加载的用户目录，下一次访问时全量加载"""
+    global _directory, _loaded_at, _checked_at
+    with _lock:
+        _directory = UserDirectory([], [])
+        _loaded_at = _checked_at = 0.0
+
+
+def get_user_directory_stats():
+    """最近一次刷新的统计信息：刷新方式（full / incremental / unchanged）、用户数、最大 ID、耗时"""
+    return dict(_stats)
@@ -1,6 +1,14 @@
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, abort
 from analysis import *
+from database import get_pool_stats
+from response_cache import cached_api, response_cache
+from scheduler import scheduler
+from async_server import heavy, get_async_stats
+from json_provider import FastJSONProvider
+from columnar import graph_response
+from config import SCHEDULER_CONFIG, CENTRALITY_CONFIG
+import metrics
 
 # 日志配置
 logger = logging.getLogger()
@@ -20,6 +28,61 @@ logger.addHandler(console_handler)
 
 # 初始化 Flask 应用
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+# 分阶段耗时统计（Server-Timing 响应头、请求日志、/metrics 直方图）及按请求开启的采样分析
+metrics.init_app(app, logger)
+
+# 注册后台预计算任务（第一次请求时启动调度线程，只在后台刷新被请求过的任务）
+def register_job(name, func, incremental=None, with_snapshot=False):
+    scheduler.register(name, func, SCHEDULER_CONFIG['job_intervals'][name],
+                       SCHEDULER_CONFIG['job_min_intervals'][name], incremental, with_snapshot)
+
+# HITS / PageRank 在数据版本变化（新消息）时按消息水位线增量更新，重算间隔到期时全量重算
+register_job('messages_hits', get_messages_hits_data, incremental=refresh_messages_hits)
+register_job('messages_pagerank', analyze_user_interactions_pagerank, incremental=refresh_messages_pagerank)
+register_job('user_communities', analyze_community, with_snapshot=True)
+register_job('user_behavior', analyze_user_behavior)
+register_job('layout_friends', lambda: precompute_layout('friends'))
+register_job('layout_messages', lambda: precompute_layout('messages'))
+
+# 图数据接口的服务端裁剪参数（见 analysis/graph_view.py）
+def graph_view_args(score):
+    """读取图数据接口的裁剪参数：top_k、min_weight、ego、hops、aggregate=community 以及排序用的 score 列"""
+    return {
+        "score": request.args.get('score', score),
+        "top_k": request.args.get('top_k', type=int),
+        "min_weight": request.args.get('min_weight', type=float),
+        "ego": request.args.get('ego'),
+        "hops": request.args.get('hops', 1, type=int),
+        "aggregate": request.args.get('aggregate')
+    }
+
+# 按裁剪参数裁剪图数据并返回；参数无效（score 不是数值列、ego 用户不存在）时返回 400
+def graph_view_response(data, score):
+    data = apply_graph_view(data, **graph_view_args(score))
+    if 'error' in data:
+        logger.warning(f'图数据裁剪参数无效: {data["error"]}')
+        return jsonify(data), 400
+    return graph_response(data)
+
+# 请求参数 layout=1 时为节点加上服务端预先计算的布局坐标 x / y（graph 为 friends 或 messages）
+# （同时标记对应的布局任务被请求过，之后由后台线程在快照更新后预先计算）
+def with_requested_layout(data, graph):
+    if not request.args.get('layout', type=int):
+        return data
+    scheduler.touch(f'layout_{graph}')
+    return with_layout(data, graph)
+
+# 中心性接口的参数：metrics（逗号分隔的指标名）以及各指标的预算覆盖值 <指标>_<预算项>（如 betweenness_epsilon）
+def centrality_args():
+    metric_names = request.args.get('metrics')
+    budgets = {}
+    for metric, defaults in CENTRALITY_CONFIG['budgets'].items():
+        for key, default in defaults.items():
+            value = request.args.get(f'{metric}_{key}', type=type(default))
+            if value is not None:
+                budgets.setdefault(metric, {})[key] = value
+    return {"metrics": metric_names.split(',') if metric_names else None, "budgets": budgets}
 
 # 首页路由
 @app.route('/')
@@ -29,11 +92,14 @@ def index():
 
 # 获取消息 HITS 数据的 API
 @app.route('/api/messages_hits', methods=['GET'])
+@heavy
+@cached_api(version_func=lambda: scheduler.version('messages_hits'))
 def get_messages_hits():
     logger.info('正在获取消息 HITS 数据')
-    data = get_messages_hits_data()
+    data = scheduler.get('messages_hits')
     logger.info('消息 HITS 数据获取成功')
-    return jsonify(data)
+    data = with_requested_layout(data, 'messages')
+    return graph_view_response(data, 'authority')
 
 # 展示消息 HITS 页面
 @app.route('/show_messages_hits')
@@ -43,9 +109,18 @@ def show_messages_hits():
 
 # 获取时间序列数据的 API
 @app.route('/api/by_timestamp', methods=['GET'])
+@heavy
+@cached_api
 def get_analyze_by_timestamp():
     logger.info('正在获取时间序列数据')
-    data = analyze_by_timestamp()
+    # 可选参数：from / to 时间范围（北京时间），granularity 为 hour / day / week，sender_id / receiver_id 按用户统计
+    data = analyze_by_timestamp(
+        start=request.args.get('from'),
+        end=request.args.get('to'),
+        granularity=request.args.get('granularity', 'hour'),
+        sender_id=request.args.get('sender_id', type=int),
+        receiver_id=request.args.get('receiver_id', type=int)
+    )
     logger.info('时间序列数据获取成功')
     return jsonify(data)
 
@@ -57,10 +132,23 @@ def show_by_timestamp():
 
 # 获取消息 PageRank 数据的 API
 @app.route('/api/messages_pagerank', methods=['GET'])
+@heavy
+@cached_api(version_func=lambda: scheduler.version('messages_pagerank'))
 def get_messages_pagerank():
     logger.info('正在获取消息 PageRank 数据')
-    data = analyze_user_interactions_pagerank()
+    data = scheduler.get('messages_pagerank')
     logger.info('消息 PageRank 数据获取成功')
+    data = with_requested_layout(data, 'messages')
+    return graph_view_response(data, 'pagerank')
+
+# 增量刷新并获取 PageRank / HITS 影响力分数的 API
+@app.route('/api/influence_scores', methods=['GET'])
+@heavy
+@cached_api
+def get_influence_scores():
+    logger.info('正在增量刷新影响力分数')
+    data = refresh_influence_scores()
+    logger.info(f'影响力分数刷新成功: {data["stats"]}')
     return jsonify(data)
 
 # 展示消息 PageRank 页面
@@ -71,11 +159,18 @@ def show_messages_pagerank():
 
 # 获取用户社区划分数据的 API
 @app.route('/api/user_communities', methods=['GET'])
+@heavy
+@cached_api(version_func=lambda: scheduler.version('user_communities'))
 def get_user_communities():
     logger.info('正在获取用户社区数据')
-    data = analyze_community()
+    # level 参数选择层次划分中的某一层（0 为最细），默认使用后台预计算的最粗一层；
+    # 其他层取自预计算结果所基于的快照（层次划分已在快照内缓存），与缓存键中的计算时间一致
+    level = request.args.get('level', type=int)
+    data, snapshot = scheduler.get('user_communities', with_snapshot=True)
+    if level is not None:
+        data = dict(analyze_community(snapshot=snapshot, level=level), computed_at=data['computed_at'])
     logger.info('用户社区数据获取成功')
-    return jsonify(data)
+    return graph_response(data)
 
 # 展示用户社区页面
 @app.route('/show_user_communities')
@@ -103,9 +198,11 @@ def show_shortest_way():
 
 # 获取用户行为数据的 API
 @app.route('/api/user_behavior', methods=['GET'])
+@heavy
+@cached_api(version_func=lambda: scheduler.version('user_behavior'))
 def get_user_behavior():
     logger.info('正在获取用户行为数据')
-    data = analyze_user_behavior()
+    data = scheduler.get('user_behavior')
     logger.info('用户行为数据获取成功')
     return jsonify(data)
 
@@ -117,6 +214,8 @@ def show_user_behavior():
 
 # 获取最短路径的 API
 @app.route('/api/shortest_path', methods=['GET'])
+@heavy
+@cached_api
 def shortest_path():
     start_user = request.args.get('start_user')
     end_user = request.args.get('end_user')
@@ -125,13 +224,37 @@ def shortest_path():
     logger.info(f'最短路径结果: {result}')
     return jsonify(result)
 
+# 批量获取最短路径的 API，请求体为 {"pairs": [[起始用户名, 目标用户名], ...]}
+@app.route('/api/shortest_paths', methods=['POST'])
+@heavy
+def shortest_paths():
+    pairs = (request.get_json(silent=True) or {}).get('pairs', [])
+    logger.info(f'请求批量计算 {len(pairs)} 对用户的最短路径')
+    result = analyze_shortest_paths(pairs)
+    return jsonify(result)
+
+# 获取消息交互图上最近影响路径的 API（边代价为 1 / 消息数）
+@app.route('/api/influence_path', methods=['GET'])
+@heavy
+@cached_api
+def get_influence_path():
+    start_user = request.args.get('start_user')
+    end_user = request.args.get('end_user')
+    logger.info(f'请求计算从 {start_user} 到 {end_user} 的影响路径')
+    result = analyze_influence_path(start_user, end_user)
+    logger.info(f'影响路径结果: {result}')
+    return jsonify(result)
+
 # 获取社交网络数据的 API
 @app.route('/api/social_network', methods=['GET'])
+@heavy
+@cached_api
 def get_social_network():
     logger.info('正在获取社交网络数据')
     data = analyze_friends()
     logger.info('社交网络数据获取成功')
-    return jsonify(data)
+    data = with_requested_layout(data, 'friends')
+    return graph_view_response(data, 'degree')
 
 # 展示中心性页面
 @app.route('/show_centrality')
@@ -141,11 +264,17 @@ def show_centrality():
 
 # 获取中心性数据的 API
 @app.route('/api/centrality', methods=['GET'])
+@heavy
+@cached_api
 def get_centrality():
     logger.info('正在获取中心性数据')
-    data = analyze_centrality()
+    data = analyze_centrality(**centrality_args())
+    if 'error' in data:
+        logger.warning(f'中心性参数无效: {data["error"]}')
+        return jsonify(data), 400
     logger.info('中心性数据获取成功')
-    return jsonify(data)
+    data = with_requested_layout(data, 'messages')
+    return graph_view_response(data, 'centrality')
 
 # 展示消息传播页面
 @app.route('/show_messages')
@@ -155,21 +284,65 @@ def show_messages():
 
 # 获取消息数据的 API
 @app.route('/api/messages', methods=['GET'])
+@heavy
+@cached_api
 def get_messages():
     logger.info('正在获取消息数据')
     data = analyze_messages()
     logger.info('消息数据获取成功')
-    return jsonify(data)
+    data = with_requested_layout(data, 'messages')
+    return graph_view_response(data, 'activity')
 
 # 获取好友分布数据的 API
 @app.route('/api/friend_distribution', methods=['GET'])
+@heavy
+@cached_api
 def get_friend_distribution():
     logger.info('正在获取好友分布数据')
     data = analyze_friend_distribution()
     logger.info('好友分布数据获取成功')
-    return jsonify(data)
+    return graph_response(data)
+
+# 获取数据库连接池统计信息的 API（监控用）
+@app.route('/api/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
+# 获取 API 响应缓存统计信息的 API（监控用）
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+# 获取后台预计算任务运行统计的 API（监控用）
+@app.route('/api/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+# Prometheus 文本格式的运行指标（请求与各阶段延迟直方图、工作量计数、连接池和响应缓存统计）
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body = metrics.render_metrics([
+        ('netgraph_db_pool', '数据库连接池统计', get_pool_stats()),
+        ('netgraph_response_cache', 'API 响应缓存统计', response_cache.stats()),
+        ('netgraph_async', 'ASGI 方式下的请求分流统计', get_async_stats()),
+        ('netgraph_user_directory', '用户目录最近一次刷新统计', get_user_directory_stats())
+    ])
+    return app.response_class(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# 最近的采样分析结果列表（需开启 METRICS_CONFIG['profiling']，请求时带参数 profile=1）
+@app.route('/api/profiles', methods=['GET'])
+def profiles():
+    return jsonify(metrics.profiler.summaries())
+
+# 单个请求的采样分析结果（折叠栈格式，可用 flamegraph.pl / speedscope 绘制火焰图）
+@app.route('/api/profiles/<int:profile_id>', methods=['GET'])
+def profile_stacks(profile_id):
+    stacks = metrics.profiler.collapsed(profile_id)
+    if stacks is None:
+        abort(404)
+    return app.response_class(stacks, mimetype='text/plain; charset=utf-8')
 
-# 启动 Flask 应用
+# 启动 Flask 应用（WSGI 方式；异步服务方式见 asgi.py）
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
     logger.info('Flask 应用启动')
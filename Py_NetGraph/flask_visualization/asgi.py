@@ -0,0 +1,15 @@
+"""
+ASGI 入口（异步服务方式，见 async_server.py），URL 和响应格式与 python app.py 相同：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    hypercorn asgi:application --bind 0.0.0.0:5000
+"""
+from app import app
+from async_server import AsgiAdapter
+from config import ASYNC_CONFIG
+
+application = AsgiAdapter(
+    app,
+    request_workers=ASYNC_CONFIG["request_workers"],
+    analysis_workers=ASYNC_CONFIG["analysis_workers"],
+    analysis_queue=ASYNC_CONFIG["analysis_queue"]
+)
@@ -0,0 +1,184 @@
+"""
+ASGI 异步服务
+把 Flask 应用包装为 ASGI 应用（入口见 asgi.py），由 uvicorn / hypercorn 等 ASGI 服务器运行：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+事件循环只负责收发请求，Flask 视图在线程池中执行，分为两类：
+    - 普通请求（页面、静态文件、监控接口）以及分析接口的缓存命中，在 request_workers 个线程中处理
+    - 标记为 @heavy 的分析接口先在普通线程中只查缓存，未命中时转到有界的分析线程池（analysis_workers 个线程）计算，
+      排队的请求超过 analysis_queue 个时直接返回 503；重量级计算再多也不会占满普通请求的线程
+接口的 URL 和响应格式与 WSGI 方式（python app.py）完全相同。
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from database import pool
+from response_cache import CACHE_ONLY_KEY, CACHE_MISS_KEY
+
+_adapter = None  # 当前进程中的 ASGI 适配器（WSGI 方式运行时为 None）
+
+
+def heavy(view):
+    """标记重量级分析接口：ASGI 方式下缓存未命中时在有界的分析线程池中处理"""
+    view.heavy = True
+    return view
+
+
+def _environ(scope, body):
+    """由 ASGI HTTP scope 构造 WSGI environ"""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ["CONTENT_LENGTH"] = str(len(body))  # 请求体已完整读取（包括分块传输的请求）
+    return environ
+
+
+class AsgiAdapter:
+    """在线程池中运行 WSGI（Flask）应用的 ASGI 应用，重量级分析接口使用单独的有界线程池"""
+
+    def __init__(self, app, request_workers=32, analysis_workers=4, analysis_queue=32):
+        global _adapter
+        self.app = app
+        self.analysis_workers = analysis_workers
+        self.analysis_queue = analysis_queue
+        self._requests = ThreadPoolExecutor(max_workers=request_workers, thread_name_prefix="request")
+        self._analyses = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix="analysis")
+        self._pending = 0  # 已转到分析线程池（运行中或排队）的请求数，只在事件循环线程中修改
+        self._counters = {"requests": 0, "cache_probe_hits": 0, "analysis_requests": 0, "rejected": 0}
+        _adapter = self
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":  # 不支持 WebSocket
+            await receive()
+            await send({"type": "websocket.close", "code": 1000})
+            return
+        body = await self._read_body(receive)
+        if body is None:  # 客户端已断开
+            return
+        status, headers, body = await self._handle(scope, body)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _view(self, environ):
+        """请求对应的视图函数，无法匹配（404 / 405 / 重定向）时返回 None，交给 Flask 在普通线程中处理"""
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        return self.app.view_functions.get(endpoint)
+
+    async def _handle(self, scope, body):
+        loop = asyncio.get_running_loop()
+        self._counters["requests"] += 1
+        environ = _environ(scope, body)
+        view = self._view(environ)
+        if not getattr(view, "heavy", False):
+            return await loop.run_in_executor(self._requests, self._call, environ)
+
+        # 带响应缓存的重量级接口：先在普通线程中只查缓存，命中时不必进入分析线程池排队
+        if getattr(view, "cached", False):
+            environ = _environ(scope, body)
+            environ[CACHE_ONLY_KEY] = True
+            result = await loop.run_in_executor(self._requests, self._call, environ)
+            if not environ.get(CACHE_MISS_KEY):
+                self._counters["cache_probe_hits"] += 1
+                return result
+
+        if self._pending >= self.analysis_workers + self.analysis_queue:
+            self._counters["rejected"] += 1
+            return 503, [(b"content-type", b"application/json"), (b"retry-after", b"5")], \
+                '{"error": "分析请求过多，请稍后重试"}'.encode("utf-8")
+        self._counters["analysis_requests"] += 1
+        self._pending += 1
+        try:
+            return await loop.run_in_executor(self._analyses, self._call, _environ(scope, body))
+        finally:
+            self._pending -= 1
+
+    def _call(self, environ):
+        """在线程池中调用 WSGI 应用，返回 (状态码, ASGI 响应头, 响应体)"""
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return chunks.append
+
+        iterable = self.app(environ, start_response)
+        try:
+            chunks.extend(iterable)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        return response["status"], response["headers"], b"".join(chunks)
+
+    def shutdown(self):
+        """停止线程池（不再接受新任务）并关闭数据库连接"""
+        self._requests.shutdown(wait=False, cancel_futures=True)
+        self._analyses.shutdown(wait=False, cancel_futures=True)
+        pool.close_all()
+
+    def stats(self):
+        return dict(self._counters,
+                    analysis_running=min(self._pending, self.analysis_workers),
+                    analysis_queued=max(self._pending - self.analysis_workers, 0))
+
+
+def get_async_stats():
+    """ASGI 方式下的请求分流统计（WSGI 方式运行时为空字典），用于监控"""
+    return _adapter.stats() if _adapter is not None else {}
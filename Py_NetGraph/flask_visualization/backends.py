@@ -0,0 +1,178 @@
+"""
+存储后端
+database.py 的连接池通过这里的连接工厂连接存储后端。分析代码中的 SQL 按 MySQL 方言书写，
+其他后端执行前改写其中用到的 MySQL 专有函数（TIMESTAMPDIFF、CONVERT_TZ）：
+    - mysql: DB_CONFIG 指向的线上 MySQL（pymysql）
+    - sqlite: 本地 SQLite 文件，用于离线运行和基准测试
+    - duckdb: 嵌入式列式引擎，直接扫描 users / friends / messages 的 Parquet 导出文件（见 parquet_export.py），
+      重量级的分析扫描不再占用线上 OLTP 数据库；duckdb 为可选依赖
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+import pymysql
+from config import DB_CONFIG, POOL_CONFIG, STORAGE_CONFIG
+
+try:
+    import duckdb
+except ImportError:  # duckdb 为可选依赖，只有 duckdb 后端需要
+    duckdb = None
+
+BACKENDS = ("mysql", "sqlite", "duckdb")
+
+_UNIT_SECONDS = {"SECOND": 1, "MINUTE": 60, "HOUR": 3600, "DAY": 86400, "WEEK": 604800}
+_TIMESTAMPDIFF = re.compile(r"TIMESTAMPDIFF\(\s*(\w+)\s*,", re.IGNORECASE)
+
+
+def get_db_connection():
+    """建立 MySQL 数据库连接"""
+    return pymysql.connect(
+        host=DB_CONFIG["host"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        database=DB_CONFIG["database"],
+        port=DB_CONFIG["port"],
+        connect_timeout=POOL_CONFIG["connect_timeout"],
+        read_timeout=POOL_CONFIG["read_timeout"],
+        autocommit=True,  # 连接会被复用，自动提交避免长事务读取到旧的一致性快照
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def _parse_time(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _offset(text):
+    """时区偏移字符串（如 "+08:00"）转换为 timedelta"""
+    sign = -1 if text.startswith("-") else 1
+    hours, minutes = text.lstrip("+-").split(":")
+    return sign * timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def _convert_tz(value, from_tz, to_tz):
+    """MySQL CONVERT_TZ（SQLite 自定义函数，只支持 "+08:00" 形式的时区偏移）"""
+    if value is None:
+        return None
+    return (_parse_time(value) - _offset(from_tz) + _offset(to_tz)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _timestamp_diff(unit, start, end):
+    """MySQL TIMESTAMPDIFF（SQLite 自定义函数，单位为 SECOND / MINUTE / HOUR / DAY / WEEK，结果向零取整）"""
+    if start is None or end is None:
+        return None
+    return int((_parse_time(end) - _parse_time(start)).total_seconds() / _UNIT_SECONDS[unit.upper()])
+
+
+# DuckDB 中与 MySQL CONVERT_TZ 对应的宏（时区偏移形如 "+08:00"）
+_DUCKDB_MACROS = [
+    """CREATE MACRO tz_minutes(tz) AS
+           (CASE WHEN left(tz, 1) = '-' THEN -1 ELSE 1 END)
+           * (CAST(substr(tz, 2, 2) AS INTEGER) * 60 + CAST(substr(tz, 5, 2) AS INTEGER))""",
+    """CREATE MACRO convert_tz(ts, from_tz, to_tz) AS
+           CAST(ts AS TIMESTAMP) + to_minutes(tz_minutes(to_tz) - tz_minutes(from_tz))"""
+]
+
+
+class _Cursor:
+    """包装 SQLite / DuckDB 游标，提供 database.py 用到的 pymysql 游标接口，执行前改写 SQL 方言"""
+
+    def __init__(self, cursor, translate):
+        self._cursor = cursor
+        self._translate = translate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def execute(self, query):
+        self._cursor.execute(self._translate(query))
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class SQLiteConnection:
+    """本地 SQLite 文件，接口与 pymysql 连接一致（行以元组返回，与 SSCursor 相同）"""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"SQLite 数据库文件不存在: {path}")
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.create_function("CONVERT_TZ", 3, _convert_tz, deterministic=True)
+        self._connection.create_function("TIMESTAMPDIFF", 3, _timestamp_diff, deterministic=True)
+
+    @staticmethod
+    def _translate(query):
+        # TIMESTAMPDIFF 的单位参数在 SQLite 中会被解析为列名，改写为字符串参数
+        return _TIMESTAMPDIFF.sub(r"TIMESTAMPDIFF('\1',", query)
+
+    def cursor(self, cursorclass=None):
+        return _Cursor(self._connection.cursor(), self._translate)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self._connection.close()
+
+
+class DuckDBConnection:
+    """
+    DuckDB 内存数据库，users / friends / messages 为 Parquet 导出文件上的视图：
+    parquet_dir/users.parquet、parquet_dir/friends.parquet 以及 parquet_dir/messages/ 下按 ID 区间追加的分片
+    """
+
+    def __init__(self, parquet_dir, threads=None):
+        if duckdb is None:
+            raise ImportError("duckdb 后端需要安装 duckdb（pip install duckdb）")
+        self._connection = duckdb.connect(":memory:")
+        if threads:
+            self._connection.execute(f"SET threads = {int(threads)}")
+        for macro in _DUCKDB_MACROS:
+            self._connection.execute(macro)
+        for table, pattern in (("users", "users.parquet"), ("friends", "friends.parquet"),
+                               ("messages", os.path.join("messages", "*.parquet"))):
+            path = os.path.join(parquet_dir, pattern).replace("'", "''")
+            self._connection.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+
+    @staticmethod
+    def _translate(query):
+        # MySQL 的 TIMESTAMPDIFF(unit, start, end) 对应 DuckDB 的 date_diff('unit', start, end)
+        return _TIMESTAMPDIFF.sub(r"date_diff('\1',", query)
+
+    def cursor(self, cursorclass=None):
+        return _Cursor(self._connection.cursor(), self._translate)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self._connection.close()
+
+
+def connection_factory(backend=None, **options):
+    """
+    返回创建后端连接的无参函数（供连接池使用）。
+    :param backend: mysql / sqlite / duckdb，默认使用 STORAGE_CONFIG["backend"]
+    :param options: 覆盖 STORAGE_CONFIG 中的 sqlite_path、parquet_dir、duckdb_threads
+    """
+    backend = backend or STORAGE_CONFIG["backend"]
+    settings = dict(STORAGE_CONFIG, **options)
+    if backend == "mysql":
+        return get_db_connection
+    if backend == "sqlite":
+        return lambda: SQLiteConnection(settings["sqlite_path"])
+    if backend == "duckdb":
+        return lambda: DuckDBConnection(settings["parquet_dir"], settings["duckdb_threads"])
+    raise ValueError(f"未知的存储后端 {backend}，可选 {', '.join(BACKENDS)}")
@@ -0,0 +1,4 @@
+"""
+基准测试：在本地合成数据上测量 analysis 包中各函数的耗时和内存（不依赖远程 MySQL）。
+用法见 benchmark/run.py。
+"""
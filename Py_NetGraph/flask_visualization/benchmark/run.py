@@ -0,0 +1,293 @@
+"""
+分析函数基准测试
+在合成数据上逐个运行 analysis 包导出的函数，记录冷启动（清空快照和各类缓存）与热启动耗时、
+分阶段耗时（数据库读取 / 快照构建 / 算法 / 序列化）、读取行数、内存峰值和响应体大小，结果写入 JSON 文件。
+
+在 flask_visualization 目录下运行：
+    python -m benchmark.run --sizes 1000 10000 100000
+    python -m benchmark.run --sizes 1000000 --skip "analyze_friends*" --no-memory
+    python -m benchmark.run --sizes 100000 --backend duckdb
+    python -m benchmark.run --compare cache/benchmark/results/<旧提交>.json cache/benchmark/results/<新提交>.json
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+import scipy
+import networkx as nx
+from flask import Flask
+import database
+import analysis
+import metrics
+from analysis import community_analysis, graph_layout, incremental_influence, message_rollup, user_directory
+from analysis.centrality_analysis import CENTRALITY_METRICS
+from analysis.payload import ColumnTable
+from columnar import encode_columnar
+from config import LANDMARK_CONFIG, ROLLUP_CONFIG
+from json_provider import FastJSONProvider
+from parquet_export import export_tables
+from . import synthetic
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "benchmark")
+
+# 基准用例：run(ctx, prepared) 为被测调用，prepare(ctx) 的耗时不计入结果（为空时不需要准备）
+Case = namedtuple("Case", ["name", "run", "prepare"])
+
+CASES = [
+    Case("get_snapshot", lambda ctx, _: analysis.get_snapshot(), None),
+    Case("invalidate_snapshot", lambda ctx, _: analysis.invalidate_snapshot(), lambda ctx: analysis.get_snapshot()),
+    Case("get_user_directory", lambda ctx, _: analysis.get_user_directory(fresh=True), None),
+    Case("get_user_directory_stats", lambda ctx, _: analysis.get_user_directory_stats(),
+         lambda ctx: analysis.get_user_directory()),
+    Case("analyze_centrality", lambda ctx, _: analysis.analyze_centrality(), None),
+    Case("analyze_centrality[all]", lambda ctx, _: analysis.analyze_centrality(list(CENTRALITY_METRICS)), None),
+    Case("analyze_friends", lambda ctx, _: analysis.analyze_friends(), None),
+    Case("analyze_friend_distribution", lambda ctx, _: analysis.analyze_friend_distribution(), None),
+    Case("analyze_messages", lambda ctx, _: analysis.analyze_messages(), None),
+    Case("analyze_user_interactions_pagerank", lambda ctx, _: analysis.analyze_user_interactions_pagerank(), None),
+    Case("analyze_messages_hits", lambda ctx, _: analysis.analyze_messages_hits(), None),
+    Case("get_messages_hits_data", lambda ctx, _: analysis.get_messages_hits_data(), None),
+    Case("analyze_community", lambda ctx, _: analysis.analyze_community(), None),
+    Case("analyze_Djs", lambda ctx, _: analysis.analyze_Djs(ctx["start_user"], ctx["end_user"]), None),
+    Case("analyze_shortest_paths", lambda ctx, _: analysis.analyze_shortest_paths(ctx["pairs"]), None),
+    Case("analyze_influence_path",
+         lambda ctx, _: analysis.analyze_influence_path(ctx["start_user"], ctx["end_user"]), None),
+    Case("analyze_by_timestamp", lambda ctx, _: analysis.analyze_by_timestamp(), None),
+    Case("analyze_user_behavior", lambda ctx, _: analysis.analyze_user_behavior(), None),
+    Case("refresh_influence_scores", lambda ctx, _: analysis.refresh_influence_scores(), None),
+    Case("refresh_messages_pagerank", lambda ctx, _: analysis.refresh_messages_pagerank(), None),
+    Case("refresh_messages_hits", lambda ctx, _: analysis.refresh_messages_hits(), None),
+    Case("apply_graph_view", lambda ctx, data: analysis.apply_graph_view(data, score="activity", top_k=500),
+         lambda ctx: analysis.analyze_messages()),
+    Case("with_layout", lambda ctx, data: analysis.with_layout(data, "friends"),
+         lambda ctx: analysis.analyze_friends()),
+    Case("precompute_layout", lambda ctx, _: analysis.precompute_layout("messages"), None),
+]
+
+
+def reset_state():
+    """清空快照和各模块的进程内缓存（热启动布局、Louvain 初始划分、增量状态、地标索引文件）"""
+    analysis.invalidate_snapshot()
+    user_directory.invalidate_user_directory()
+    message_rollup._rollup = message_rollup.MessageRollup(per_user=ROLLUP_CONFIG["per_user"])
+    incremental_influence._tracker = incremental_influence.IncrementalInfluence()
+    graph_layout._previous_layouts.clear()
+    community_analysis._previous_partition = None
+    shutil.rmtree(LANDMARK_CONFIG["index_dir"], ignore_errors=True)
+
+
+_app = Flask(__name__)
+_app.json = FastJSONProvider(_app)
+
+
+def serialise(result):
+    """按接口的方式序列化结果：(耗时, JSON 字节数, 二进制列式字节数)，不是字典的结果返回 None"""
+    if not isinstance(result, dict):
+        return None, None, None
+    with _app.app_context():
+        start = time.perf_counter()
+        json_bytes = len(_app.json.dumps(result).encode("utf-8"))
+        columnar_bytes = None
+        if any(isinstance(value, ColumnTable) for value in result.values()):
+            columnar_bytes = len(encode_columnar(result))
+        return time.perf_counter() - start, json_bytes, columnar_bytes
+
+
+def run_case(case, ctx, measure_memory):
+    """运行一个用例：冷启动一次（分阶段计时）、热启动一次，可选再冷启动一次测内存峰值"""
+    reset_state()
+    prepared = case.prepare(ctx) if case.prepare else None
+    # 数据库读取和快照构建的耗时、读取行数由 metrics 的分阶段计时记录
+    with metrics.trace(f"benchmark:{case.name}") as current:
+        start = time.perf_counter()
+        result = case.run(ctx, prepared)
+        seconds = time.perf_counter() - start
+    fetch, graph_build, rows = current.phases["fetch"], current.phases["graph_build"], current.counts["rows"]
+    serialise_seconds, json_bytes, columnar_bytes = serialise(result)
+
+    start = time.perf_counter()
+    case.run(ctx, prepared)
+    warm_seconds = time.perf_counter() - start
+
+    peak_memory = None
+    if measure_memory:
+        reset_state()
+        prepared = case.prepare(ctx) if case.prepare else None
+        tracemalloc.start()
+        try:
+            case.run(ctx, prepared)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "seconds": round(seconds, 6),
+        "warm_seconds": round(warm_seconds, 6),
+        "phases": {
+            "fetch": round(fetch, 6),
+            "graph_build": round(graph_build, 6),
+            "algorithm": round(seconds - fetch - graph_build, 6),
+            "serialisation": None if serialise_seconds is None else round(serialise_seconds, 6)
+        },
+        "rows_fetched": rows,
+        "peak_memory_bytes": peak_memory,
+        "json_bytes": json_bytes,
+        "columnar_bytes": columnar_bytes
+    }
+
+
+def prepare_dataset(num_users, args):
+    """生成（或复用已生成的）合成数据库，返回数据集描述"""
+    name = f"users{num_users}_f{args.avg_friends}_m{args.messages_per_user}_d{args.days}_s{args.seed}.sqlite"
+    path = os.path.join(BENCHMARK_DIR, "data", name)
+    info = {"users": num_users, "path": path}
+    if args.regenerate or not os.path.exists(path):
+        start = time.perf_counter()
+        data = synthetic.generate(num_users, avg_friends=args.avg_friends, messages_per_user=args.messages_per_user,
+                                  days=args.days, seed=args.seed)
+        synthetic.write_sqlite(path, data)
+        info["generate_seconds"] = round(time.perf_counter() - start, 3)
+        print(f"🧪 已生成 {num_users} 个用户的合成数据：{len(data['friends'][0])} 条好友关系，"
+              f"{len(data['messages'][0])} 条消息，耗时 {info['generate_seconds']} 秒")
+    database.configure_backend("sqlite", sqlite_path=path)
+    if args.backend == "duckdb":
+        # duckdb 后端读取合成数据库的 Parquet 导出（重新生成数据时一并重新导出）
+        parquet_dir = path[:-len(".sqlite")] + "_parquet"
+        info["parquet_dir"] = parquet_dir
+        if "generate_seconds" in info or not os.path.exists(parquet_dir):
+            shutil.rmtree(parquet_dir, ignore_errors=True)
+            export_tables(parquet_dir)
+        database.configure_backend("duckdb", parquet_dir=parquet_dir)
+    info["friends"] = int(database.fetch_data("SELECT COUNT(*) AS n FROM friends")["n"].iloc[0])
+    info["messages"] = int(database.fetch_data("SELECT COUNT(*) AS n FROM messages")["n"].iloc[0])
+    return info
+
+
+def _git_commit():
+    """当前提交和工作区是否有未提交的修改（不在 git 仓库中时为 None）"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "."], capture_output=True, text=True,
+                                    check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_benchmark(args):
+    selected = [case for case in CASES
+                if (not args.only or any(fnmatch.fnmatch(case.name, pattern) for pattern in args.only))
+                and not any(fnmatch.fnmatch(case.name, pattern) for pattern in args.skip)]
+    exported = {name for name in getattr(analysis, "__all__", dir(analysis))
+                if not name.startswith("_") and callable(getattr(analysis, name))}
+    missing = sorted(exported - {case.name for case in CASES})
+    if missing:
+        print(f"⚠️ 以下导出函数没有基准用例：{', '.join(missing)}")
+
+    LANDMARK_CONFIG["index_dir"] = os.path.join(BENCHMARK_DIR, "landmarks")
+
+    commit, dirty = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "networkx": nx.__version__,
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "generator": {"avg_friends": args.avg_friends, "messages_per_user": args.messages_per_user,
+                          "days": args.days, "seed": args.seed}
+        },
+        "datasets": [],
+        "results": []
+    }
+
+    for num_users in args.sizes:
+        dataset = prepare_dataset(num_users, args)
+        report["datasets"].append(dataset)
+        rng = np.random.default_rng(args.seed)
+        users = rng.integers(1, num_users + 1, 42)
+        ctx = {
+            "start_user": f"user{users[0]}",
+            "end_user": f"user{users[1]}",
+            "pairs": [(f"user{a}", f"user{b}") for a, b in users[2:].reshape(-1, 2).tolist()]
+        }
+        for case in selected:
+            entry = {"function": case.name, "users": num_users}
+            try:
+                entry.update(run_case(case, ctx, args.memory), status="ok")
+                print(f"⏱️ {case.name} @ {num_users}: {entry['seconds']:.3f} 秒（热 {entry['warm_seconds']:.3f} 秒）"
+                      f" {entry['phases']}")
+            except Exception as exc:  # 单个用例失败不影响其余用例
+                entry.update(status="error", error=f"{type(exc).__name__}: {exc}")
+                print(f"❌ {case.name} @ {num_users}: {entry['error']}")
+            report["results"].append(entry)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"{(commit or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📄 基准结果已写入 {output}")
+    return report
+
+
+def compare(base_path, new_path, threshold):
+    """
+    比较两次基准结果（按函数和用户数对齐），打印耗时比值；比值超过 threshold 的记为退化。
+    :return: 退化的用例数
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = {(r["function"], r["users"]): r for r in json.load(f)["results"] if r["status"] == "ok"}
+    with open(new_path, encoding="utf-8") as f:
+        new = {(r["function"], r["users"]): r for r in json.load(f)["results"] if r["status"] == "ok"}
+
+    regressions = 0
+    print(f"{'function':<36}{'users':>9}{'base (s)':>12}{'new (s)':>12}{'ratio':>8}")
+    for key in sorted(base.keys() & new.keys(), key=lambda k: (k[1], k[0])):
+        ratio = new[key]["seconds"] / max(base[key]["seconds"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  ⚠️ 退化"
+        print(f"{key[0]:<36}{key[1]:>9}{base[key]['seconds']:>12.4f}{new[key]['seconds']:>12.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在合成数据上对 analysis 包的导出函数做基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="用户数（可指定多个）")
+    parser.add_argument("--avg-friends", type=int, default=10, help="平均好友数")
+    parser.add_argument("--messages-per-user", type=int, default=20, help="平均每个用户发送的消息数")
+    parser.add_argument("--days", type=int, default=60, help="消息时间跨度（天）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--only", nargs="*", default=[], help="只运行名称匹配这些模式的用例")
+    parser.add_argument("--skip", nargs="*", default=[], help="跳过名称匹配这些模式的用例")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="不测量内存峰值（省去一次冷启动运行）")
+    parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="sqlite",
+                        help="存储后端：sqlite 直接查询合成数据库，duckdb 查询它的 Parquet 导出")
+    parser.add_argument("--regenerate", action="store_true", help="重新生成合成数据")
+    parser.add_argument("--output", help="结果文件路径，默认 cache/benchmark/results/<提交>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="比较两个结果文件")
+    parser.add_argument("--threshold", type=float, default=1.2, help="比较时判定退化的耗时比值")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+    run_benchmark(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
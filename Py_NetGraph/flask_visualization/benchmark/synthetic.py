@@ -0,0 +1,126 @@
+"""
+合成数据生成
+按固定随机种子生成用户、好友关系（幂律度分布）和消息（突发式时间戳），写入本地 SQLite 数据库，
+表结构与 DDL 中的 users / friends / messages 以及好友关系变更计数器 data_version 一致。
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# 一天中各小时的相对活跃度（北京时间，晚间最活跃），用于生成消息的时间分布
+_DIURNAL = np.array([3, 2, 1, 1, 1, 1, 2, 4, 6, 7, 7, 8, 9, 8, 7, 7, 8, 9, 10, 12, 14, 14, 11, 6], dtype=np.float64)
+
+
+def _power_law_weights(rng, n, exponent):
+    """幂律分布的节点权重（Pareto 分布），用于按 Chung-Lu 模型生成度数服从幂律的边"""
+    return rng.pareto(exponent - 1, n) + 1
+
+
+def generate(num_users, avg_friends=10, messages_per_user=20, days=60, burst_size=8, seed=0):
+    """
+    生成合成数据。
+    :param num_users: 用户数
+    :param avg_friends: 平均好友数（好友度数服从指数约为 2.5 的幂律分布）
+    :param messages_per_user: 平均每个用户发送的消息数（发送活跃度同样服从幂律分布）
+    :param days: 消息时间跨度（天），截止到当前时间
+    :param burst_size: 每段对话（同一发送者连续发给同一接收者）的平均消息数
+    :param seed: 随机种子，相同参数生成完全相同的数据
+    :return: {"users": 用户 ID 数组, "friends": (user_id, friend_id), "messages": (sender_id, receiver_id, timestamp)}，
+             好友关系双向存储，消息按时间排序
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = np.arange(1, num_users + 1, dtype=np.int64)
+
+    # 好友关系：按幂律权重抽取端点（Chung-Lu），去掉自环和重复边后双向存储
+    weights = _power_law_weights(rng, num_users, 2.5)
+    p = weights / weights.sum()
+    num_pairs = num_users * avg_friends // 2
+    a = rng.choice(num_users, num_pairs, p=p)
+    b = rng.choice(num_users, num_pairs, p=p)
+    keep = a != b
+    low, high = np.minimum(a[keep], b[keep]), np.maximum(a[keep], b[keep])
+    pairs = np.unique(low * num_users + high)
+    low, high = pairs // num_users, pairs % num_users
+    friend_src, friend_dst = np.concatenate([low, high]), np.concatenate([high, low])
+
+    # 好友邻接表（CSR），用于为消息挑选接收者
+    order = np.argsort(friend_src, kind="stable")
+    neighbors = friend_dst[order]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(friend_src, minlength=num_users))])
+
+    # 对话段：发送者按幂律活跃度抽取，80% 发给随机一个好友，其余发给任意用户
+    num_bursts = max(num_users * messages_per_user // burst_size, 1)
+    activity = _power_law_weights(rng, num_users, 2.2)
+    senders = rng.choice(num_users, num_bursts, p=activity / activity.sum())
+    degree = indptr[senders + 1] - indptr[senders]
+    to_friend = (rng.random(num_bursts) < 0.8) & (degree > 0)
+    receivers = rng.choice(num_users, num_bursts, p=p)
+    picks = indptr[senders[to_friend]] + (rng.random(int(to_friend.sum())) * degree[to_friend]).astype(np.int64)
+    receivers[to_friend] = neighbors[picks]
+    receivers = np.where(receivers == senders, (receivers + 1) % num_users, receivers)
+
+    # 对话段的起始时间：随机日期 + 按昼夜活跃度抽取的小时（北京时间转 UTC）
+    day_offsets = rng.integers(0, days, num_bursts)
+    hours = rng.choice(24, num_bursts, p=_DIURNAL / _DIURNAL.sum()) - 8
+    start_seconds = day_offsets * 86400 + hours * 3600 + rng.integers(0, 3600, num_bursts)
+
+    # 每段对话的消息数服从几何分布，段内消息间隔服从指数分布（平均 30 秒）
+    lengths = rng.geometric(1 / burst_size, num_bursts)
+    burst_of = np.repeat(np.arange(num_bursts), lengths)
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    gaps = rng.exponential(30, len(burst_of))
+    gaps[first] = 0
+    cumulative = np.cumsum(gaps)
+    within = cumulative - np.repeat(cumulative[first], lengths)
+    seconds = np.minimum(start_seconds[burst_of] + within, days * 86400 - 1)  # 不晚于当前时间
+
+    origin = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None) - timedelta(days=days)  # UTC 时间
+    order = np.argsort(seconds, kind="stable")
+    timestamps = np.datetime64(origin, "s") + seconds[order].astype("timedelta64[s]")
+    return {
+        "users": user_ids,
+        "friends": (user_ids[friend_src], user_ids[friend_dst]),
+        "messages": (user_ids[senders[burst_of][order]], user_ids[receivers[burst_of][order]], timestamps)
+    }
+
+
+def write_sqlite(path, data):
+    """将合成数据写入 SQLite 数据库（覆盖已有文件），并建立与 DDL 相同的索引和触发器"""
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+                           "password VARCHAR(255) NOT NULL)")
+        connection.execute("CREATE TABLE friends (user_id BIGINT NOT NULL, friend_id BIGINT NOT NULL, "
+                           "PRIMARY KEY (user_id, friend_id))")
+        connection.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender_id BIGINT NOT NULL, "
+                           "receiver_id BIGINT NOT NULL, content TEXT NOT NULL, timestamp TIMESTAMP)")
+
+        connection.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                               ((user_id, f"user{user_id}", "x") for user_id in data["users"].tolist()))
+        connection.executemany("INSERT INTO friends VALUES (?, ?)", zip(*(column.tolist() for column in data["friends"])))
+        senders, receivers, timestamps = data["messages"]
+        timestamps = np.char.replace(np.datetime_as_string(timestamps), "T", " ").tolist()  # MySQL 的时间格式
+        connection.executemany(
+            "INSERT INTO messages (sender_id, receiver_id, content, timestamp) VALUES (?, ?, 'hello', ?)",
+            zip(senders.tolist(), receivers.tolist(), timestamps))
+
+        connection.execute("CREATE INDEX friend_id ON friends (friend_id)")
+        connection.execute("CREATE INDEX sender_id ON messages (sender_id)")
+        connection.execute("CREATE INDEX receiver_id ON messages (receiver_id)")
+
+        # 好友关系变更计数器（数据写入之后再建触发器，批量写入时不逐行触发）
+        connection.execute("CREATE TABLE data_version (table_name VARCHAR(32) PRIMARY KEY, "
+                           "version BIGINT NOT NULL DEFAULT 0)")
+        connection.execute("INSERT INTO data_version (table_name, version) VALUES ('friends', 0)")
+        for table, event in (("friends", "INSERT"), ("friends", "UPDATE"), ("friends", "DELETE"), ("users", "DELETE")):
+            connection.execute(f"CREATE TRIGGER {table}_after_{event.lower()} AFTER {event} ON {table} BEGIN "
+                               "UPDATE data_version SET version = version + 1 WHERE table_name = 'friends'; END")
+        connection.commit()
+    finally:
+        connection.close()
@@ -0,0 +1,78 @@
+"""
+二进制列式图数据格式
+请求头 Accept 中包含 application/vnd.netgraph.columnar 时，图数据接口以二进制列式格式返回，
+前端用 static/columnar.js 解码，省去大体积 JSON 文本的传输和解析。
+
+格式（所有整数均为小端序）：
+    4 字节魔数 "NGC1" | uint32 头部长度 | UTF-8 JSON 头部 | 补齐到 8 字节 | 各列数据（每列起点 8 字节对齐）
+头部为 {"meta": {...}, "tables": {表名: {"length": 行数, "columns": [列描述, ...]}}}：
+    - meta: 响应中除记录表以外的其他字段（统计信息、社区映射等），原样以 JSON 保存
+    - 列描述: {"name", "type", "offset", "byteLength"}，offset 相对于数据区起点；
+      type 为 int32 / float64 / uint8 / float32，字符串列使用字典编码，
+      type 为编码数组的类型并附带 "dictionary"（取值列表，编码 -1 表示空值）
+"""
+import struct
+import numpy as np
+import pandas as pd
+from flask import request, current_app, jsonify
+from analysis.payload import ColumnTable
+from metrics import phase
+
+COLUMNAR_MIMETYPE = "application/vnd.netgraph.columnar"
+MAGIC = b"NGC1"
+ALIGNMENT = 8
+
+
+def wants_columnar():
+    """请求头 Accept 中是否显式接受二进制列式格式"""
+    return any(mimetype == COLUMNAR_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+
+def _encode_column(values):
+    """将一列数据编码为 (类型, 小端字节数组, 附加描述)"""
+    array = np.asarray(values)
+    kind = array.dtype.kind
+    if kind == "b":
+        return "uint8", array.astype("<u1"), {}
+    if kind in "iu":
+        if len(array) == 0 or (array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max):
+            return "int32", array.astype("<i4"), {}
+        return "float64", array.astype("<f8"), {}  # 超出 int32 范围的整数（JS 中 Number 可精确表示到 2^53）
+    if kind == "f":
+        return ("float32", array.astype("<f4"), {}) if array.dtype == np.float32 else ("float64", array.astype("<f8"), {})
+    # 字符串等其他类型：字典编码（按首次出现顺序）
+    codes, uniques = pd.factorize(array)
+    return "int32", codes.astype("<i4"), {"dictionary": [str(value) for value in uniques]}
+
+
+def encode_columnar(data):
+    """将分析结果（字典）编码为二进制列式格式，ColumnTable 类型的字段按列保存"""
+    meta, tables, buffers = {}, {}, []
+    offset = 0
+    for key, value in data.items():
+        if not isinstance(value, ColumnTable):
+            meta[key] = value
+            continue
+        columns = []
+        for name, values in value.columns.items():
+            column_type, array, extra = _encode_column(values)
+            raw = array.tobytes()
+            columns.append({"name": name, "type": column_type, "offset": offset, "byteLength": len(raw), **extra})
+            padding = -len(raw) % ALIGNMENT
+            buffers.append(raw + b"\0" * padding)
+            offset += len(raw) + padding
+        tables[key] = {"length": len(value), "columns": columns}
+
+    header_bytes = current_app.json.dumps({"meta": meta, "tables": tables}).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+    prefix += b"\0" * (-len(prefix) % ALIGNMENT)
+    return prefix + b"".join(buffers)
+
+
+def graph_response(data):
+    """按请求头 Accept 返回二进制列式格式或 JSON 格式的图数据"""
+    if wants_columnar():
+        with phase("serialise"):
+            body = encode_columnar(data)
+        return current_app.response_class(body, mimetype=COLUMNAR_MIMETYPE)
+    return jsonify(data)
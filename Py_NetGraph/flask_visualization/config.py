@@ -1,3 +1,5 @@
+import os
+
 DB_CONFIG = {
     "user": "orlando",
     "password": "Anchor_Mar25",
@@ -5,3 +7,156 @@ DB_CONFIG = {
     "port": 3306,
     "database": "chat_app"
 }
+
+# 存储后端配置（见 backends.py）：mysql 为 DB_CONFIG 指向的线上库，sqlite 为本地 SQLite 文件，
+# duckdb 直接扫描 Parquet 导出文件（parquet_export.py 定期导出），可用环境变量覆盖
+STORAGE_CONFIG = {
+    "backend": os.environ.get("NETGRAPH_BACKEND", "mysql"),
+    "sqlite_path": os.environ.get("NETGRAPH_SQLITE_PATH",
+                                  os.path.join(os.path.dirname(__file__), "cache", "netgraph.sqlite")),
+    "parquet_dir": os.environ.get("NETGRAPH_PARQUET_DIR", os.path.join(os.path.dirname(__file__), "cache", "parquet")),
+    "duckdb_threads": None       # DuckDB 扫描使用的线程数，None 表示使用全部 CPU 核
+}
+
+# 共享图快照配置
+SNAPSHOT_CONFIG = {
+    "ttl_seconds": 300,          # 快照有效期（秒），过期后下一次访问时重新加载
+    "message_window_days": 30,   # 消息交互图的默认时间窗口（天）
+    "shared_dir": os.environ.get("NETGRAPH_SNAPSHOT_DIR"),  # 多进程共用的快照文件目录，为空时各进程各自加载
+    "build_timeout": 600         # 快照构建锁的超时时间（秒），超时后视为构建进程已退出
+}
+
+# 用户目录配置（见 analysis/user_directory.py）
+USER_DIRECTORY_CONFIG = {
+    "refresh_interval": 1.0,         # 两次检查新用户（MAX(id)、COUNT(*)）的最小间隔（秒）
+    "rebuild_seconds": 3600          # 全量重新加载的间隔（秒），用于同步用户名的修改
+}
+
+# 增量影响力（PageRank / HITS）更新配置
+INCREMENTAL_CONFIG = {
+    "error_threshold": 1e-4,         # PageRank 误差上界（L1 范数）超过该值时全量重算
+    "push_tol": 1e-5,                # 局部推送时单个节点的残差阈值（相对于 1/N）
+    "max_pushes": 200000,            # 单次增量更新的最大推送次数，超过则全量重算
+    "full_recompute_seconds": 3600   # 两次全量重算的最长间隔，用于淘汰时间窗口之外的旧消息
+}
+
+# 数据库连接池配置
+POOL_CONFIG = {
+    "max_size": 10,            # 连接池最大连接数
+    "acquire_timeout": 10,     # 获取连接的最长等待时间（秒），超时抛出 TimeoutError
+    "ping_interval": 30,       # 连接空闲超过该时间（秒）后，取出时先 ping 检查可用性
+    "max_lifetime": 3600,      # 连接最长存活时间（秒），超过后关闭并重建
+    "connect_timeout": 5,      # 建立连接的超时时间（秒）
+    "read_timeout": 120        # 读取查询结果的超时时间（秒）
+}
+
+# 流式查询配置
+FETCH_CONFIG = {
+    "chunk_size": 10000,       # 服务端游标每次读取的行数
+    "concurrent_queries": 4    # 同一分析中互不依赖的查询并发执行时，所有分析共用的查询线程数（各占一个连接）
+}
+
+# API 响应缓存配置
+RESPONSE_CACHE_CONFIG = {
+    "max_entries": 256,                  # 最多缓存的响应个数（LRU 淘汰）
+    "max_bytes": 256 * 1024 * 1024,      # 缓存响应体的总字节数上限
+    "ttl_seconds": 300,                  # 单个响应的最长缓存时间（时间窗口会随时间滑动）
+    "version_check_interval": 1.0        # 数据版本查询结果的复用时间（秒），合并同一时刻的多个请求
+}
+
+# 消息交互图地标（ALT）最短路径索引配置
+LANDMARK_CONFIG = {
+    "num_landmarks": 16,                                                         # 地标数量
+    "index_dir": os.path.join(os.path.dirname(__file__), "cache", "landmarks"),  # 索引文件保存目录
+    "stale_seconds": 600                                                         # 超过该时间的临时文件视为写入失败的残留并删除
+}
+
+# 每小时消息数汇总配置（时间序列分析）
+ROLLUP_CONFIG = {
+    "per_user": True,            # 是否同时维护每个发送者 / 接收者每小时的消息数
+    "refresh_interval": 1.0,     # 两次检查新消息的最短间隔（秒）
+    "rebuild_seconds": 86400     # 全量重建的最长间隔（秒），用于纳入已有消息的修改和删除
+}
+
+# 后台预计算调度配置
+SCHEDULER_CONFIG = {
+    "poll_interval": 5,            # 调度线程检查数据版本和任务是否到期的间隔（秒）
+    "job_intervals": {             # 各预计算任务的最长重算间隔（秒），数据版本变化时会提前重算
+        "messages_hits": 300,
+        "messages_pagerank": 300,
+        "user_communities": 600,
+        "user_behavior": 900,
+        "layout_friends": 300,
+        "layout_messages": 300
+    },
+    "job_min_intervals": {         # 数据版本变化后距上次计算至少间隔多少秒才重算（防抖，持续写入新消息时不会每次轮询都重算）
+        "messages_hits": 30,       # HITS / PageRank 在数据版本变化时走增量更新，代价较小
+        "messages_pagerank": 30,
+        "user_communities": 300,   # 社区划分和布局基于图快照，快照按 SNAPSHOT_CONFIG["ttl_seconds"] 重新加载，更早重算没有意义
+        "user_behavior": 300,      # 扫描全部消息，代价较大
+        "layout_friends": 300,
+        "layout_messages": 300
+    },
+    "idle_seconds": 3600           # 超过该时间没有被请求的任务不再在后台刷新，下一次请求时再唤醒
+}
+
+# API 响应压缩配置（按请求头 Accept-Encoding 选择 brotli 或 gzip，brotli 为可选依赖）
+COMPRESSION_CONFIG = {
+    "min_bytes": 1024,     # 小于该大小的响应不压缩
+    "gzip_level": 6,       # gzip 压缩级别（1~9）
+    "brotli_quality": 5    # brotli 压缩质量（0~11）
+}
+
+# 图可视化服务端裁剪配置（无论图有多大，返回给浏览器的节点数和边数都不超过上限）
+GRAPH_VIEW_CONFIG = {
+    "max_nodes": 20000,     # 单次响应最多的节点数（按分数保留前 max_nodes 个）
+    "max_edges": 100000     # 单次响应最多的边数（按权重保留最大的边）
+}
+
+# 服务端力导向布局配置
+LAYOUT_CONFIG = {
+    "iterations": 100,               # 冷启动迭代次数
+    "warm_iterations": 20,           # 热启动（沿用上一个快照的坐标）迭代次数
+    "warm_start_min_reuse": 0.5,     # 沿用旧坐标的节点比例不低于该值时才按热启动处理
+    "grid_size": 16                  # 斥力近似使用的网格边长（网格数为其平方）
+}
+
+# Louvain 社区划分配置
+LOUVAIN_CONFIG = {
+    "seed": 42,                      # 固定随机种子，相同的好友关系图得到相同的划分
+    "resolution": 1.0,               # 模块度的分辨率参数
+    "warm_start_min_reuse": 0.5      # 沿用上一次划分的用户比例不低于该值时以其为初值热启动
+}
+
+# 中心性指标配置（见 analysis/centrality_analysis.py），预算可由请求参数 <指标>_<预算项> 覆盖
+CENTRALITY_CONFIG = {
+    "default_metrics": ["in_degree"],  # 未指定 metrics 参数时计算的指标
+    "seed": 42,                        # 抽样起点的随机种子，相同的图和预算得到相同的近似值
+    "batch_elements": 100000,         # 批量 BFS 每批的矩阵元素数（活跃用户数 × 每批起点数），限制内存占用
+    "budgets": {
+        "eigenvector": {"tol": 1.0e-6, "max_iter": 500},
+        # epsilon: 归一化估计值的误差上限，confidence: 误差不超过 epsilon 的概率，抽样数还受 max_samples 和 max_seconds 限制
+        "betweenness": {"epsilon": 0.05, "confidence": 0.9, "max_samples": 512, "max_seconds": 5.0},
+        "closeness": {"epsilon": 0.05, "confidence": 0.9, "max_samples": 512, "max_seconds": 5.0}
+    },
+    "limits": {"max_iter": 1000, "max_samples": 4096, "max_seconds": 30.0, "confidence": 0.999}  # 请求参数的上限
+}
+
+# 运行指标与采样分析配置（见 metrics.py，指标在 /metrics 以 Prometheus 文本格式输出）
+METRICS_CONFIG = {
+    "latency_buckets": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],  # 延迟直方图的桶上界（秒）
+    "log_requests": True,            # 是否为每个请求记录一行分阶段耗时日志
+    "profiling": os.environ.get("NETGRAPH_PROFILING", "0") == "1",  # 是否允许按请求开启采样分析（生产环境默认关闭）
+    "profile_sample_rate": 0.0,      # 开启采样分析后，未显式请求（profile=1）的请求被随机采样的比例
+    "profile_interval": 0.005,       # 调用栈采样间隔（秒）
+    "profile_max_depth": 64,         # 每个调用栈最多记录的层数
+    "profile_max_concurrent": 2,     # 同时进行采样分析的请求数上限
+    "profile_history": 20            # 保留最近多少个请求的采样结果
+}
+
+# ASGI 异步服务配置（见 async_server.py，入口为 asgi.py）
+ASYNC_CONFIG = {
+    "request_workers": 32,           # 处理页面、静态文件、监控接口和缓存命中的线程数
+    "analysis_workers": 4,           # 同时进行重量级分析计算的请求数
+    "analysis_queue": 32             # 排队等待分析线程的请求数上限，超过时返回 503
+}
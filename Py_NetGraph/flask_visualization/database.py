@@ -1,25 +1,264 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 import pymysql
 import pandas as pd
-from config import DB_CONFIG
-
-def get_db_connection():
-    """建立数据库连接"""
-    return pymysql.connect(
-        host=DB_CONFIG["host"],
-        user=DB_CONFIG["user"],
-        password=DB_CONFIG["password"],
-        database=DB_CONFIG["database"],
-        port=DB_CONFIG["port"],
-        cursorclass=pymysql.cursors.DictCursor
-    )
+from config import POOL_CONFIG, FETCH_CONFIG, STORAGE_CONFIG
+from backends import get_db_connection, connection_factory
+from metrics import charge, detached, record
 
-def fetch_data(query):
-    """执行 SQL 查询"""
-    connection = get_db_connection()
-    try:
-        with connection.cursor() as cursor:
+
+class ConnectionPool:
+    """
+    有界、线程安全的数据库连接池。
+    - 连接数不超过 max_size，连接耗尽时等待，超过 acquire_timeout 抛出 TimeoutError
+    - 空闲超过 ping_interval 的连接取出时先 ping，存活超过 max_lifetime 的连接关闭重建
+    - 使用过程中出错的连接直接关闭，不再放回连接池
+    """
+
+    def __init__(self, connect=get_db_connection, max_size=10, acquire_timeout=10,
+                 ping_interval=30, max_lifetime=3600):
+        self.connect = connect
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._idle = []  # 空闲连接：(connection, created_at, last_used_at)
+        self._size = 0  # 已创建且未关闭的连接数（含使用中）
+        self._in_use = 0
+        self._counters = {"acquired": 0, "created": 0, "recycled": 0, "waits": 0,
+                          "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+    def _open(self):
+        connection = self.connect()
+        now = time.monotonic()
+        with self._cond:
+            self._counters["created"] += 1
+        return connection, now, now
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _check(self, entry):
+        """健康检查：过期或 ping 失败的连接关闭并重建"""
+        connection, created_at, last_used_at = entry
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            healthy = False
+        elif now - last_used_at > self.ping_interval:
+            try:
+                connection.ping(reconnect=False)
+                healthy = True
+            except Exception:
+                healthy = False
+        else:
+            healthy = True
+        if healthy:
+            return entry
+        self._close(connection)
+        with self._cond:
+            self._counters["recycled"] += 1
+        return self._open()
+
+    def acquire(self):
+        """从连接池取出一个连接，返回 (connection, created_at, last_used_at)"""
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    entry = None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise TimeoutError(f"数据库连接池已耗尽（{self.max_size} 个连接），等待 {self.acquire_timeout} 秒超时")
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._counters["acquired"] += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._counters["waits"] += 1
+                self._counters["wait_time_total"] += wait_time
+                self._counters["wait_time_max"] = max(self._counters["wait_time_max"], wait_time)
+
+        # 建立连接和健康检查可能较慢，在锁外进行
+        try:
+            return self._open() if entry is None else self._check(entry)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, entry, discard=False):
+        """归还连接；discard 为 True 时关闭连接而不放回连接池"""
+        connection, created_at, _ = entry
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._counters["recycled"] += 1
+            else:
+                self._idle.append((connection, created_at, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close(connection)
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器的方式借用连接，出错的连接会被回收"""
+        entry = self.acquire()
+        discard = False
+        try:
+            yield entry[0]
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.release(entry, discard)
+
+    def close_all(self):
+        """关闭所有空闲连接（使用中的连接归还后照常放回）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        """连接池统计信息：连接数、使用中、空闲、等待次数与等待时间等"""
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(max_size=self.max_size, size=self._size, in_use=self._in_use, idle=len(self._idle))
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+
+# 连接池连接的存储后端由 STORAGE_CONFIG 决定（见 backends.py）
+pool = ConnectionPool(
+    connect=connection_factory(),
+    max_size=POOL_CONFIG["max_size"],
+    acquire_timeout=POOL_CONFIG["acquire_timeout"],
+    ping_interval=POOL_CONFIG["ping_interval"],
+    max_lifetime=POOL_CONFIG["max_lifetime"]
+)
+
+
+# 连接池当前连接的存储后端
+_backend = STORAGE_CONFIG["backend"]
+
+
+def configure_backend(backend, **options):
+    """
+    切换连接池使用的存储后端（已有的空闲连接全部关闭，使用中的连接归还后关闭）。
+    :param backend: mysql / sqlite / duckdb
+    :param options: 覆盖 STORAGE_CONFIG 中的 sqlite_path、parquet_dir、duckdb_threads
+    """
+    global _backend
+    pool.connect = connection_factory(backend, **options)
+    _backend = backend
+    pool.close_all()
+
+
+def get_pool_stats():
+    """获取数据库连接池统计信息，用于监控"""
+    return pool.stats()
+
+
+def _to_column(values, dtype=None):
+    """将一列值转换为 NumPy 数组；未指定类型时数值列自动推断，其余列使用 object"""
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    column = np.array(values)
+    if column.dtype.kind in "USO" or column.ndim != 1:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+    return column
+
+
+def fetch_chunks(query, dtypes=None, chunk_size=None):
+    """
+    使用服务端游标流式执行 SQL 查询，每次读取 chunk_size 行并转换为列式数组。
+    行以元组读取，不为每行构造字典，峰值内存与 chunk_size 成正比。
+    :param query: SQL 查询语句
+    :param dtypes: {列名: NumPy 类型}，未指定的列自动推断
+    :param chunk_size: 每块行数，默认使用 FETCH_CONFIG["chunk_size"]
+    :return: 生成器，每次产出 {列名: NumPy 数组} 字典；结果为空时产出一个各列为空数组的数据块
+    """
+    dtypes = dtypes or {}
+    chunk_size = chunk_size or FETCH_CONFIG["chunk_size"]
+    # 只统计生成器内部（等待连接、执行查询、读取和转换数据块）的时间，不包括调用方处理数据块的时间
+    start = time.perf_counter()
+    with pool.connection() as connection:
+        with connection.cursor(pymysql.cursors.SSCursor) as cursor:
             cursor.execute(query)
-            result = cursor.fetchall()
-            return pd.DataFrame(result)
-    finally:
-        connection.close()
+            names = [column[0] for column in cursor.description]
+            empty = True
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                empty = False
+                chunk = {name: _to_column(values, dtypes.get(name)) for name, values in zip(names, zip(*rows))}
+                charge("fetch", time.perf_counter() - start)
+                record("rows", len(rows))
+                yield chunk
+                start = time.perf_counter()
+            if empty:
+                charge("fetch", time.perf_counter() - start)
+                yield {name: np.empty(0, dtype=dtypes.get(name, object)) for name in names}
+                start = time.perf_counter()
+    charge("fetch", time.perf_counter() - start)
+
+
+def fetch_columns(query, dtypes=None, chunk_size=None):
+    """
+    流式执行 SQL 查询，并把所有数据块拼接为完整的列式结果。
+    :return: {列名: NumPy 数组} 字典；结果为空时各列为空数组
+    """
+    chunks = list(fetch_chunks(query, dtypes, chunk_size))
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+# 并发执行互不依赖的查询用的线程池（所有分析共用，同时占用的连接数不超过线程数）
+_query_executor = ThreadPoolExecutor(max_workers=FETCH_CONFIG["concurrent_queries"], thread_name_prefix="query")
+
+
+def fetch_columns_concurrently(queries, chunk_size=None):
+    """
+    并发执行多个互不依赖的查询（每个查询使用连接池中的一个连接），等待数据库的时间互相重叠，总耗时约为最慢的一个查询。
+    本地后端（sqlite / duckdb）在进程内执行查询，执行和结果转换都要争抢 GIL，并发反而更慢，按顺序执行。
+    :param queries: {名称: (SQL 查询语句, dtypes)}
+    :return: {名称: {列名: NumPy 数组}}
+    """
+    if _backend != "mysql" or len(queries) < 2:
+        return {name: fetch_columns(query, dtypes, chunk_size) for name, (query, dtypes) in queries.items()}
+    start = time.perf_counter()
+    futures = {name: _query_executor.submit(detached(fetch_columns), query, dtypes, chunk_size)
+               for name, (query, dtypes) in queries.items()}
+    results = {name: future.result() for name, future in futures.items()}
+    rows = sum(len(next(iter(columns.values()), ())) for columns in results.values())
+    charge("fetch", time.perf_counter() - start, rows=rows)
+    return results
+
+
+def fetch_data(query):
+    """执行 SQL 查询，结果以列式方式流式读取后构造 DataFrame"""
+    return pd.DataFrame(fetch_columns(query))
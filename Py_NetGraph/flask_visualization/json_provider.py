@@ -0,0 +1,48 @@
+"""
+JSON 序列化
+安装了 orjson 时使用 orjson 生成响应体（直接支持 numpy 数组和标量，速度远快于标准库 json），
+未安装时退回 Flask 默认的 JSON 实现。
+"""
+from flask.json.provider import DefaultJSONProvider
+from analysis.payload import ColumnTable
+from metrics import phase
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+def _default(obj):
+    """标准类型以外的对象：记录表展开为字典列表，其余交给 Flask 默认实现"""
+    if isinstance(obj, ColumnTable):
+        return obj.to_records()
+    return DefaultJSONProvider.default(obj)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """基于 orjson 的 Flask JSON Provider（不排序键、输出紧凑格式，NaN / inf 输出为 null）"""
+
+    default = staticmethod(_default)
+
+    if orjson is not None:
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+        def dumps(self, obj, **kwargs):
+            if kwargs:  # 指定了标准库 json 的参数（如 indent）时使用默认实现
+                return super().dumps(obj, **kwargs)
+            return orjson.dumps(obj, default=self.default, option=self.options).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # 响应体编码时间计入当前请求的 serialise 阶段（见 metrics.py）
+        with phase("serialise"):
+            if orjson is None:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(obj, default=self.default, option=self.options)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,369 @@
+"""
+运行指标
+按请求（或后台任务）记录分阶段耗时和工作量，聚合为延迟直方图，以 Prometheus 文本格式在 /metrics 输出：
+    - 阶段：fetch（数据库读取）、graph_build（快照构建，不含其中的数据库读取）、algorithm（分析函数自身的计算）、
+      serialise（响应体编码）、other（框架、缓存、压缩等其余时间）。阶段可以嵌套，每段时间只计入最内层的阶段
+    - 工作量：rows（读取行数）、nodes / edges（快照节点数和边数）、iterations（迭代求解器的迭代次数），
+      计入当前所在的分析函数
+每个请求的阶段耗时同时写入响应头 Server-Timing（浏览器开发者工具中可以直接查看）。
+METRICS_CONFIG["profiling"] 开启后，可以对单个请求（参数 profile=1 或请求头 X-Profile: 1）做采样分析：
+后台线程定期采集处理请求的线程的调用栈，结果为折叠栈格式（可直接用 flamegraph.pl / speedscope 绘制火焰图）。
+"""
+import contextvars
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from config import METRICS_CONFIG
+
+PHASES = ("fetch", "graph_build", "algorithm", "serialise", "other")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """按标签分组的累积直方图（线程安全）"""
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # 标签值 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = dict(zip(self.label_names, label_values))
+            for bound, cumulative in zip(self.buckets + (float("inf"),), itertools.accumulate(counts)):
+                le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class CounterMetric:
+    """按标签分组的单调递增计数器（线程安全）"""
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, label_values)))} {_format_value(value)}")
+        return lines
+
+
+_buckets = METRICS_CONFIG["latency_buckets"]
+REQUEST_SECONDS = Histogram("netgraph_request_duration_seconds", "请求处理耗时（秒）",
+                            ("endpoint", "method", "status"), _buckets)
+PHASE_SECONDS = Histogram("netgraph_request_phase_seconds", "每个请求（或后台任务）各阶段的耗时（秒）",
+                          ("endpoint", "phase"), _buckets)
+ANALYSIS_SECONDS = Histogram("netgraph_analysis_duration_seconds", "分析函数的调用耗时（秒，含嵌套阶段）",
+                             ("function",), _buckets)
+WORK_TOTAL = CounterMetric("netgraph_work_total", "分析函数处理的工作量（读取行数、节点数、边数、迭代次数）",
+                           ("function", "kind"))
+_METRICS = (REQUEST_SECONDS, PHASE_SECONDS, ANALYSIS_SECONDS, WORK_TOTAL)
+
+
+class Trace:
+    """一个请求（或一次后台任务）的分阶段耗时和工作量"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.phases = Counter()
+        self.counts = Counter()
+        self._children = [0.0]  # 各层阶段中已经计入内层阶段的时间，栈底为整个请求
+
+    def finish(self):
+        """结束记录：剩余时间计入 other，各阶段耗时写入直方图，返回总耗时"""
+        total = time.perf_counter() - self.started_at
+        self.phases["other"] += max(total - sum(self.phases.values()), 0.0)
+        for name, seconds in self.phases.items():
+            PHASE_SECONDS.observe(seconds, self.name, name)
+        return total
+
+    def server_timing(self, total):
+        """Server-Timing 响应头（毫秒）"""
+        entries = [f"{name};dur={self.phases[name] * 1000:.2f}" for name in PHASES if name in self.phases]
+        return ", ".join(entries + [f"total;dur={total * 1000:.2f}"])
+
+
+_trace = contextvars.ContextVar("netgraph_trace", default=None)
+_function = contextvars.ContextVar("netgraph_function", default="-")
+
+
+def charge(name, seconds, **counts):
+    """
+    把一段已经测得的时间（以及这段时间内的工作量）计入当前请求的 name 阶段，
+    用于无法用上下文管理器包住的代码，如生成器、在其他线程中并发执行的子任务
+    """
+    current = _trace.get()
+    if current is not None:
+        current.phases[name] += seconds
+        current._children[-1] += seconds
+        current.counts.update(counts)
+
+
+def detached(func):
+    """
+    包装要交给其他线程执行的子任务：沿用当前分析函数的标签（工作量照常计入 netgraph_work_total），
+    但不计入当前请求——并发子任务的耗时和工作量由调用方按墙钟时间统一 charge，避免重复计时
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(_run_detached, func, args, kwargs)
+    return run
+
+
+def _run_detached(func, args, kwargs):
+    _trace.set(None)
+    return func(*args, **kwargs)
+
+
+@contextmanager
+def phase(name):
+    """计时上下文：代码块的耗时（扣除其中嵌套阶段的时间）计入当前请求的 name 阶段"""
+    current = _trace.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    current._children.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current.phases[name] += elapsed - current._children.pop()
+        current._children[-1] += elapsed
+
+
+def record(kind, value):
+    """记录当前分析函数的工作量（rows / nodes / edges / iterations）"""
+    WORK_TOTAL.inc(value, _function.get(), kind)
+    current = _trace.get()
+    if current is not None:
+        current.counts[kind] += value
+
+
+def timed(func):
+    """分析函数装饰器：记录调用耗时，函数自身（不含嵌套阶段）的时间计入 algorithm 阶段"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _function.set(func.__name__)
+        start = time.perf_counter()
+        try:
+            with phase("algorithm"):
+                return func(*args, **kwargs)
+        finally:
+            ANALYSIS_SECONDS.observe(time.perf_counter() - start, func.__name__)
+            _function.reset(token)
+    return wrapper
+
+
+@contextmanager
+def trace(name):
+    """
+    记录一次后台任务（不经过 Flask 请求）的阶段耗时，如调度器中的预计算任务；
+    已经处于某个请求之中（如请求线程同步运行预计算任务）时计入该请求
+    """
+    current = _trace.get()
+    if current is not None:
+        yield current
+        return
+    current = Trace(name)
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        current.finish()
+        _trace.reset(token)
+
+
+class SamplingProfiler:
+    """
+    采样分析器：后台线程每隔 interval 秒采集一次目标线程的调用栈，按折叠栈（"外层;...;内层"）计数。
+    只在开启时有开销，同时运行的采样数受 max_concurrent 限制。
+    """
+
+    def __init__(self, interval=0.005, max_depth=64, max_concurrent=2, history=20):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_concurrent = max_concurrent
+        self.profiles = deque(maxlen=history)
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, name):
+        """开始采样当前线程，返回 (停止事件, 采样结果)；同时运行的采样过多时返回 None"""
+        with self._lock:
+            if self._running >= self.max_concurrent:
+                return None
+            self._running += 1
+        stop = threading.Event()
+        profile = {"id": next(self._ids), "endpoint": name, "started_at": datetime.now().isoformat(timespec="seconds"),
+                   "samples": 0, "stacks": Counter()}
+        target = threading.get_ident()
+        threading.Thread(target=self._sample, args=(target, stop, profile), daemon=True,
+                         name=f"profiler-{profile['id']}").start()
+        return stop, profile
+
+    def _sample(self, target, stop, profile):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            profile["stacks"][";".join(reversed(stack))] += 1
+            profile["samples"] += 1
+
+    def stop(self, handle, seconds):
+        stop, profile = handle
+        stop.set()
+        profile["seconds"] = round(seconds, 4)
+        with self._lock:
+            self._running -= 1
+            self.profiles.append(profile)
+        return profile["id"]
+
+    def summaries(self):
+        with self._lock:
+            return [{key: value for key, value in profile.items() if key != "stacks"} for profile in self.profiles]
+
+    def collapsed(self, profile_id):
+        """折叠栈文本（每行 "栈 次数"），不存在时返回 None"""
+        with self._lock:
+            profile = next((p for p in self.profiles if p["id"] == profile_id), None)
+        if profile is None:
+            return None
+        return "\n".join(f"{stack} {count}" for stack, count in profile["stacks"].most_common()) + "\n"
+
+
+profiler = SamplingProfiler(
+    interval=METRICS_CONFIG["profile_interval"],
+    max_depth=METRICS_CONFIG["profile_max_depth"],
+    max_concurrent=METRICS_CONFIG["profile_max_concurrent"],
+    history=METRICS_CONFIG["profile_history"]
+)
+
+
+def _wants_profile(request):
+    if not METRICS_CONFIG["profiling"]:
+        return False
+    if request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1":
+        return True
+    return random.random() < METRICS_CONFIG["profile_sample_rate"]
+
+
+def init_app(app, logger=None):
+    """为 Flask 应用注册请求钩子：每个请求开始时创建 Trace，结束时写入直方图、Server-Timing 响应头和日志"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        g.metrics_trace = Trace(request.endpoint or "unknown")
+        g.metrics_token = _trace.set(g.metrics_trace)
+        # 只查缓存的预检请求（见 async_server.py）不做采样分析，未命中时由重新处理的请求采样
+        probe = request.environ.get("netgraph.cache_only")
+        g.metrics_profile = profiler.start(g.metrics_trace.name) if not probe and _wants_profile(request) else None
+
+    @app.after_request
+    def _finish_trace(response):
+        current = g.pop("metrics_trace", None)
+        if current is None or request.environ.get("netgraph.cache_miss"):
+            return response  # 缓存未命中的预检请求会被重新处理，不单独记录
+        total = current.finish()
+        REQUEST_SECONDS.observe(total, current.name, request.method, str(response.status_code))
+        response.headers["Server-Timing"] = current.server_timing(total)
+        profile = g.pop("metrics_profile", None)
+        if profile is not None:
+            response.headers["X-Profile-Id"] = str(profiler.stop(profile, total))
+        if logger is not None and METRICS_CONFIG["log_requests"] and current.name != "static":
+            phases = "，".join(f"{name} {current.phases[name] * 1000:.1f}ms" for name in PHASES if name in current.phases)
+            counts = "，".join(f"{name} {value}" for name, value in current.counts.items())
+            logger.info(f'{current.name} 耗时 {total * 1000:.1f}ms（{phases}）' + (f' 工作量：{counts}' if counts else ''))
+        return response
+
+    @app.teardown_request
+    def _reset_trace(exc):
+        # 处理请求出错时 after_request 不会执行，在这里记录并清理
+        current = g.pop("metrics_trace", None)
+        profile = g.pop("metrics_profile", None)
+        if current is not None:
+            total = current.finish()
+            REQUEST_SECONDS.observe(total, current.name, request.method, "500")
+            if profile is not None:
+                profiler.stop(profile, total)
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            _trace.reset(token)
+
+
+def _gauges(prefix, documentation, stats):
+    """统计字典中的数值项输出为 gauge"""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            name = f"{prefix}_{key}"
+            lines += [f"# HELP {name} {documentation}（{key}）", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+    return lines
+
+
+def render_metrics(extra=None):
+    """
+    Prometheus 文本格式的指标。
+    :param extra: [(指标名前缀, 说明, 统计字典)]，其中的数值项输出为 gauge（如连接池、响应缓存统计）
+    """
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+    for prefix, documentation, stats in extra or []:
+        lines += _gauges(prefix, documentation, stats)
+    return "\n".join(lines) + "\n"
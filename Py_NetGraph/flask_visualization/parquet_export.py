@@ -0,0 +1,115 @@
+"""
+Parquet 导出
+从当前存储后端（一般为线上 MySQL）流式导出分析用到的列，供 duckdb 后端读取（见 backends.py）：
+    - users.parquet（id, username）、friends.parquet（user_id, friend_id）：每次全量导出，写临时文件后原子替换
+    - messages/part-<起始ID>-<结束ID>.parquet（id, sender_id, receiver_id, timestamp）：
+      只追加上次导出之后的新消息（以已有分片的最大 ID 为水位线），每个分片写完后原子改名
+不导出密码和消息内容。可以由定时任务周期性运行：
+    python parquet_export.py [--dir 导出目录]
+"""
+import argparse
+import glob
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+from config import STORAGE_CONFIG
+from database import fetch_chunks
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 为可选依赖，只有导出 Parquet 时需要
+    pa = pq = None
+
+_PART = re.compile(r"part-(\d+)-(\d+)\.parquet$")
+
+_SCHEMAS = {
+    "users": [("id", "int64"), ("username", "string")],
+    "friends": [("user_id", "int64"), ("friend_id", "int64")],
+    "messages": [("id", "int64"), ("sender_id", "int64"), ("receiver_id", "int64"), ("timestamp", "timestamp")]
+}
+
+
+def _schema(table):
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("s")}
+    return pa.schema([(name, types[kind]) for name, kind in _SCHEMAS[table]])
+
+
+def _to_batch(table, chunk):
+    """一个数据块（{列名: NumPy 数组}）转换为 Arrow 记录批"""
+    columns = []
+    for name, kind in _SCHEMAS[table]:
+        values = chunk[name]
+        if kind == "timestamp":
+            values = pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[s]")
+        elif kind == "string":
+            values = values.astype(str)
+        columns.append(pa.array(values, type=_schema(table).field(name).type))
+    return pa.RecordBatch.from_arrays(columns, schema=_schema(table))
+
+
+def _write(table, query, path):
+    """流式执行查询并写入 path（先写临时文件，完成后原子替换），返回行数"""
+    rows = 0
+    temp_path = path + ".tmp"
+    with pq.ParquetWriter(temp_path, _schema(table)) as writer:
+        for chunk in fetch_chunks(query, dtypes={name: np.int64 for name, kind in _SCHEMAS[table] if kind == "int64"}):
+            batch = _to_batch(table, chunk)
+            if batch.num_rows:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    os.replace(temp_path, path)
+    return rows
+
+
+def message_watermark(target_dir):
+    """已导出消息的最大 ID（没有分片时为 0）"""
+    ends = [int(match.group(2)) for match in map(_PART.search, glob.glob(os.path.join(target_dir, "messages", "*")))
+            if match]
+    return max(ends, default=0)
+
+
+def export_tables(target_dir=None):
+    """
+    导出 users / friends（全量）和 messages（增量）到 target_dir。
+    :return: {表名: 本次导出的行数}
+    """
+    if pq is None:
+        raise ImportError("导出 Parquet 需要安装 pyarrow（pip install pyarrow）")
+    target_dir = target_dir or STORAGE_CONFIG["parquet_dir"]
+    os.makedirs(os.path.join(target_dir, "messages"), exist_ok=True)
+    start = time.time()
+
+    # 先确定消息水位线，再导出用户和好友，保证消息引用的用户都已导出
+    low = message_watermark(target_dir)
+    high = int(next(fetch_chunks("SELECT COALESCE(MAX(id), 0) AS max_id FROM messages"))["max_id"][0])
+
+    counts = {
+        "users": _write("users", "SELECT id, username FROM users ORDER BY id",
+                        os.path.join(target_dir, "users.parquet")),
+        "friends": _write("friends", "SELECT user_id, friend_id FROM friends",
+                          os.path.join(target_dir, "friends.parquet")),
+        "messages": 0
+    }
+    # 第一次导出时即使没有消息也写入一个空分片，保证 messages 视图可以读取
+    if high > low or low == 0:
+        query = f"""
+            SELECT id, sender_id, receiver_id, timestamp
+            FROM messages
+            WHERE id > {low} AND id <= {high}
+            ORDER BY id
+        """
+        path = os.path.join(target_dir, "messages", f"part-{low + 1:012d}-{high:012d}.parquet")
+        counts["messages"] = _write("messages", query, path)
+
+    print(f"📦 Parquet 导出完成：{counts['users']} 个用户，{counts['friends']} 条好友关系，"
+          f"{counts['messages']} 条新消息（ID {low + 1} ~ {high}），耗时 {time.time() - start:.3f} 秒")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 users / friends / messages 为 Parquet 文件（供 duckdb 后端读取）")
+    parser.add_argument("--dir", help="导出目录，默认使用 STORAGE_CONFIG['parquet_dir']")
+    export_tables(parser.parse_args().dir)
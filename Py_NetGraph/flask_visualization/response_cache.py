@@ -0,0 +1,194 @@
+"""
+API 响应缓存
+以 (接口路径, 查询参数, 响应格式, 数据版本) 为键缓存响应体，按 LRU 淘汰，
+并通过 ETag / If-None-Match 让浏览器在响应体没有变化时直接得到 304（ETag 为响应体的摘要，随条目一起缓存）。
+响应体按请求头 Accept-Encoding 使用 brotli 或 gzip 压缩，压缩结果同样缓存。
+"""
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+from config import RESPONSE_CACHE_CONFIG, COMPRESSION_CONFIG
+from analysis.graph_snapshot import fetch_data_version
+from columnar import COLUMNAR_MIMETYPE, wants_columnar
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只使用 gzip
+    brotli = None
+
+# WSGI environ 中的标记：CACHE_ONLY_KEY 为真时 cached_api 只返回缓存命中的响应，未命中时设置 CACHE_MISS_KEY
+CACHE_ONLY_KEY = "netgraph.cache_only"
+CACHE_MISS_KEY = "netgraph.cache_miss"
+
+
+class ResponseCache:
+    """按条目数和总字节数限制大小的 LRU 响应缓存（线程安全）"""
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (body, mimetype, stored_at, etag)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        """返回 (响应体, mimetype, ETag)，不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[2] > self.ttl_seconds:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1], entry[3]
+
+    def put(self, key, body, mimetype="application/json", etag=None):
+        """
+        缓存响应体。
+        :param etag: 响应体的 ETag，默认为 body 的摘要；压缩后的版本传入未压缩响应体的 ETag
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, mimetype, time.time(), etag or make_etag(body))
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        body = self._entries.pop(key)[0]
+        self._bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits,
+                    "misses": self.misses, "not_modified": self.not_modified}
+
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_CONFIG["max_entries"],
+    max_bytes=RESPONSE_CACHE_CONFIG["max_bytes"],
+    ttl_seconds=RESPONSE_CACHE_CONFIG["ttl_seconds"]
+)
+
+_version_lock = threading.Lock()
+_version_state = {"version": None, "checked_at": 0.0}
+
+
+def current_data_version():
+    """
+    获取当前数据版本（只用于响应缓存的键），version_check_interval 秒内复用上一次的查询结果。
+    版本变化不影响图快照：快照按 SNAPSHOT_CONFIG["ttl_seconds"] 过期重新加载。
+    """
+    with _version_lock:
+        now = time.time()
+        if now - _version_state["checked_at"] > RESPONSE_CACHE_CONFIG["version_check_interval"]:
+            _version_state.update(version=fetch_data_version(), checked_at=now)
+        return _version_state["version"]
+
+
+def make_etag(body):
+    """由响应体生成 ETag（缓存条目过期重新生成后，内容变化的响应体得到新的 ETag）"""
+    return hashlib.sha1(body).hexdigest()
+
+
+def negotiate_encoding():
+    """按请求头 Accept-Encoding 选择压缩算法：优先 brotli（已安装时），其次 gzip，都不接受时返回 None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_CONFIG["brotli_quality"])
+    return gzip.compress(body, compresslevel=COMPRESSION_CONFIG["gzip_level"])
+
+
+def cached_api(view=None, version_func=None):
+    """
+    API 视图装饰器：相同接口、参数、响应格式和数据版本的请求直接返回缓存的响应体，
+    请求头 If-None-Match 与响应体的 ETag 一致时返回 304。
+    :param version_func: 返回数据版本的函数，默认为 current_data_version；
+                         由后台预计算提供数据的接口可以改用结果的计算时间作为版本。
+    """
+    if view is None:
+        return lambda view: cached_api(view, version_func)
+    version_func = version_func or current_data_version
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = version_func()
+        response_format = COLUMNAR_MIMETYPE if wants_columnar() else "application/json"
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), response_format, version)
+        response = _cached_response(key, lambda: current_app.make_response(view(*args, **kwargs)))
+        response.headers["Cache-Control"] = "no-cache"  # 浏览器每次都带 If-None-Match 重新验证
+        response.vary.update(("Accept", "Accept-Encoding"))
+        return response
+
+    wrapper.cached = True  # 供 async_server.py 判断能否先只查缓存
+    return wrapper
+
+
+def _cached_response(key, make_response):
+    """从缓存中取出（或生成并缓存）响应体，需要时返回压缩后的版本；客户端已有相同响应体时返回 304"""
+    encoding = negotiate_encoding()
+    entry = response_cache.get(key + (encoding,)) if encoding else None
+    if entry is not None:
+        return _respond(entry, encoding)
+
+    entry = response_cache.get(key)
+    if entry is None and request.environ.get(CACHE_ONLY_KEY):
+        # 只查缓存的请求（见 async_server.py）：未命中时不计算，由调用方改到分析线程池中重新处理
+        request.environ[CACHE_MISS_KEY] = True
+        return current_app.response_class(status=204)
+    if entry is None:
+        response = make_response()
+        if response.status_code != 200:
+            return response
+        body = response.get_data()
+        entry = (body, response.mimetype, make_etag(body))
+        response_cache.put(key, *entry)
+
+    body, mimetype, etag = entry
+    if (encoding is None or len(body) < COMPRESSION_CONFIG["min_bytes"]
+            or request.if_none_match.contains_weak(etag)):
+        return _respond(entry, None)
+
+    entry = (compress(body, encoding), mimetype, etag)
+    response_cache.put(key + (encoding,), *entry)
+    return _respond(entry, encoding)
+
+
+def _respond(entry, encoding):
+    """由缓存条目生成响应：请求头 If-None-Match 包含条目的 ETag 时返回 304"""
+    body, mimetype, etag = entry
+    if request.if_none_match.contains_weak(etag):
+        response_cache.not_modified += 1
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype=mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag, weak=True)
+    return response
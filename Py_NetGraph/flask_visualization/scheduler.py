@@ -0,0 +1,204 @@
+"""
+后台预计算调度
+耗时的分析任务（社区划分、HITS、PageRank、用户行为等）由后台线程按固定间隔或在数据版本变化时重算，
+请求直接返回最近一次的计算结果（附带 computed_at 时间戳），过期的结果在后台刷新（stale-while-revalidate）。
+后台线程只刷新最近 idle_seconds 秒内被请求过的任务；数据版本变化时距上次计算至少 min_interval_seconds 秒才重算，
+避免持续写入新消息时每次轮询都触发重算。提供增量函数的任务在只因数据版本变化而到期时调用增量函数。
+"""
+import threading
+import time
+import traceback
+from datetime import datetime
+from config import SCHEDULER_CONFIG
+from metrics import trace
+from analysis.graph_snapshot import fetch_data_version, get_snapshot
+
+
+class PrecomputeJob:
+    """单个预计算任务：保存最近一次的结果以及运行统计"""
+
+    def __init__(self, name, func, interval_seconds, min_interval_seconds=0, incremental=None, with_snapshot=False):
+        self.name = name
+        self.func = func
+        self.with_snapshot = with_snapshot  # 为真时 func 以 snapshot 参数接收进程内最新的图快照
+        self.interval_seconds = interval_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.incremental = incremental  # 数据版本变化时使用的增量函数（可选）
+        self.lock = threading.Lock()  # 同一任务同一时刻只运行一次
+        self.result_lock = threading.Lock()  # result / computed_at / snapshot 一起更新、一起读取
+        self.result = None
+        self.computed_at = None  # 结果的计算完成时间（Unix 时间戳）
+        self.data_version = None  # 计算开始时的数据版本
+        self.snapshot = None  # 结果所基于的图快照（with_snapshot 为真时）
+        self.last_requested_at = None  # 最近一次被请求的时间，从未被请求的任务不在后台刷新
+        self.runs = 0
+        self.incremental_runs = 0
+        self.failures = 0
+        self.last_seconds = None
+        self.total_seconds = 0.0
+        self.last_error = None
+
+    def is_due(self, data_version, now):
+        """结果不存在、已超过重算间隔，或数据版本已变化且距上次计算已超过最小间隔时需要重算"""
+        if self.computed_at is None:
+            return True
+        age = now - self.computed_at
+        return age > self.interval_seconds or (data_version != self.data_version and age >= self.min_interval_seconds)
+
+    def is_idle(self, now, idle_seconds):
+        """从未被请求或已超过 idle_seconds 秒没有被请求"""
+        return self.last_requested_at is None or now - self.last_requested_at > idle_seconds
+
+    def run(self, data_version):
+        """
+        运行任务并保存结果，出错时保留上一次的结果；等锁期间已由其他线程算好时直接返回。
+        结果未超过重算间隔、只因数据版本变化而到期时，有增量函数的任务调用增量函数。
+        """
+        with self.lock:
+            start = time.time()
+            if not self.is_due(data_version, start):
+                return
+            incremental = (self.incremental is not None and self.result is not None
+                           and start - self.computed_at <= self.interval_seconds)
+            snapshot = None
+            try:
+                with trace(f"job:{self.name}"):
+                    if incremental:
+                        result = self.incremental()
+                    elif self.with_snapshot:
+                        snapshot = get_snapshot()
+                        result = self.func(snapshot=snapshot)
+                    else:
+                        result = self.func()
+            except Exception:
+                self.failures += 1
+                self.last_error = traceback.format_exc(limit=3)
+                print(f"❌ 预计算任务 {self.name} 失败：\n{self.last_error}")
+                return
+            finally:
+                elapsed = time.time() - start
+                self.runs += 1
+                self.incremental_runs += incremental
+                self.last_seconds = elapsed
+                self.total_seconds += elapsed
+            with self.result_lock:
+                self.result = result
+                self.snapshot = snapshot
+                self.computed_at = time.time()
+            self.data_version = data_version
+            self.last_error = None
+            print(f"⏱️ 预计算任务 {self.name} 完成（{'增量' if incremental else '全量'}），耗时 {elapsed:.3f} 秒")
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval_seconds,
+            "min_interval_seconds": self.min_interval_seconds,
+            "computed_at": self._format_time(self.computed_at),
+            "last_requested_at": self._format_time(self.last_requested_at),
+            "runs": self.runs,
+            "incremental_runs": self.incremental_runs,
+            "failures": self.failures,
+            "running": self.lock.locked(),
+            "last_seconds": None if self.last_seconds is None else round(self.last_seconds, 4),
+            "avg_seconds": round(self.total_seconds / self.runs, 4) if self.runs else None,
+            "last_error": self.last_error
+        }
+
+    @staticmethod
+    def _format_time(timestamp):
+        return None if timestamp is None else datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PrecomputeScheduler:
+    """
+    预计算调度器。后台线程每 poll_interval 秒查询一次数据版本，
+    依次重算最近 idle_seconds 秒内被请求过的到期任务；第一次请求某个任务时才启动后台线程。
+    """
+
+    def __init__(self, poll_interval=5, idle_seconds=3600):
+        self.poll_interval = poll_interval
+        self.idle_seconds = idle_seconds
+        self.jobs = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._data_version = None
+
+    def register(self, name, func, interval_seconds, min_interval_seconds=0, incremental=None, with_snapshot=False):
+        """
+        注册预计算任务，func 不接受参数并返回字典。
+        :param min_interval_seconds: 数据版本变化后距上次计算至少间隔多少秒才重算
+        :param incremental: 可选的增量函数（不接受参数，返回与 func 格式相同的字典），数据版本变化时代替 func
+        :param with_snapshot: 为真时 func 以 snapshot 参数接收图快照，快照与结果一起保存（见 get）
+        """
+        self.jobs[name] = PrecomputeJob(name, func, interval_seconds, min_interval_seconds, incremental,
+                                        with_snapshot)
+
+    def start(self):
+        """启动后台调度线程（重复调用无影响）"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="precompute-scheduler", daemon=True)
+                self._thread.start()
+
+    def _refresh_data_version(self):
+        """查询数据版本（只用于判断任务是否需要重算，图快照按自身的 TTL 过期）"""
+        self._data_version = fetch_data_version()
+        return self._data_version
+
+    def _loop(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                version = self._refresh_data_version()
+                for job in list(self.jobs.values()):
+                    now = time.time()
+                    if not job.is_idle(now, self.idle_seconds) and job.is_due(version, now) and not job.lock.locked():
+                        job.run(version)
+            except Exception:
+                print(f"❌ 预计算调度出错：\n{traceback.format_exc(limit=3)}")
+            self._wakeup.wait(self.poll_interval)
+
+    def get(self, name, with_snapshot=False):
+        """
+        获取任务的最近一次结果（浅拷贝并附带 computed_at）。
+        还没有结果时在当前线程计算（后台线程正在计算时等待其完成），
+        结果过期时唤醒后台线程刷新，当前请求仍返回旧结果。
+        :param with_snapshot: 为真时返回 (结果, 结果所基于的图快照)，两者与 computed_at 在同一次加锁中读取，
+                              同一快照上的派生计算与结果版本一致（任务注册时 with_snapshot 为真）
+        """
+        job = self.touch(name)
+        with job.result_lock:
+            result, computed_at, snapshot = job.result, job.computed_at, job.snapshot
+        if result is None:
+            job.run(self._data_version if self._data_version is not None else self._refresh_data_version())
+            with job.result_lock:
+                result, computed_at, snapshot = job.result, job.computed_at, job.snapshot
+            if result is None:
+                raise RuntimeError(f"预计算任务 {name} 失败")
+        elif time.time() - computed_at > job.interval_seconds:
+            self._wakeup.set()
+        result = dict(result, computed_at=job._format_time(computed_at))
+        return (result, snapshot) if with_snapshot else result
+
+    def touch(self, name):
+        """记录任务被请求（之后由后台线程保持刷新）并启动后台线程，返回任务对象"""
+        self.start()
+        job = self.jobs[name]
+        job.last_requested_at = time.time()
+        return job
+
+    def version(self, name):
+        """任务结果的版本标识（计算完成时间），用于响应缓存的键"""
+        return self.jobs[name].computed_at
+
+    def stats(self):
+        """各任务的运行统计：间隔、最近一次计算时间、运行次数、失败次数、耗时等"""
+        return {
+            "data_version": self._data_version,
+            "jobs": {name: job.stats() for name, job in self.jobs.items()}
+        }
+
+
+scheduler = PrecomputeScheduler(poll_interval=SCHEDULER_CONFIG["poll_interval"],
+                                idle_seconds=SCHEDULER_CONFIG["idle_seconds"])
@@ -0,0 +1,81 @@
+// 二进制列式图数据的解码（格式说明见 columnar.py）
+// fetchGraphData(url) 向服务器请求列式格式，返回与 JSON 接口相同结构的数据；
+// 服务器返回 JSON（例如经过不支持该格式的代理）时直接按 JSON 解析。
+
+const COLUMNAR_MIMETYPE = "application/vnd.netgraph.columnar";
+
+const COLUMN_TYPES = {
+    int32: Int32Array,
+    float64: Float64Array,
+    float32: Float32Array,
+    uint8: Uint8Array
+};
+
+// 解码二进制列式数据，返回 {meta, tables: {表名: {length, columns: {列名: 类型化数组或字符串数组}}}}
+function decodeColumnar(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== "NGC1") {
+        throw new Error("未知的数据格式: " + magic);
+    }
+    const headerLength = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder("utf-8").decode(new Uint8Array(buffer, 8, headerLength)));
+    const bodyStart = Math.ceil((8 + headerLength) / 8) * 8;
+
+    const tables = {};
+    for (const [tableName, table] of Object.entries(header.tables)) {
+        const columns = {};
+        for (const column of table.columns) {
+            const ArrayType = COLUMN_TYPES[column.type];
+            const values = new ArrayType(buffer, bodyStart + column.offset, column.byteLength / ArrayType.BYTES_PER_ELEMENT);
+            if (column.dictionary) {
+                // 字典编码的字符串列，编码 -1 表示空值
+                const dictionary = column.dictionary;
+                columns[column.name] = Array.from(values, code => code < 0 ? null : dictionary[code]);
+            } else {
+                columns[column.name] = values;
+            }
+        }
+        tables[tableName] = { length: table.length, columns: columns };
+    }
+    return { meta: header.meta, tables: tables };
+}
+
+// 将列式表转换为对象数组（与 JSON 接口中的节点 / 边列表结构一致）
+function columnarToRecords(table) {
+    const names = Object.keys(table.columns);
+    const columns = names.map(name => table.columns[name]);
+    const records = new Array(table.length);
+    for (let i = 0; i < table.length; i++) {
+        const record = {};
+        for (let j = 0; j < names.length; j++) {
+            record[names[j]] = columns[j][i];
+        }
+        records[i] = record;
+    }
+    return records;
+}
+
+// 请求图数据接口：优先使用二进制列式格式，返回与 response.json() 相同结构的对象
+function fetchGraphData(url) {
+    return fetch(url, { headers: { "Accept": COLUMNAR_MIMETYPE + ", application/json;q=0.9" } })
+        .then(response => {
+            const contentType = response.headers.get("Content-Type") || "";
+            if (!contentType.startsWith(COLUMNAR_MIMETYPE)) {
+                return response.json();
+            }
+            return response.arrayBuffer().then(buffer => {
+                const decoded = decodeColumnar(buffer);
+                const data = Object.assign({}, decoded.meta);
+                for (const [tableName, table] of Object.entries(decoded.tables)) {
+                    data[tableName] = columnarToRecords(table);
+                }
+                return data;
+            });
+        });
+}
+
+// 节点是否都带有服务端预先计算的布局坐标（请求参数 layout=1），是则可以使用静态布局直接渲染
+function hasStaticLayout(nodes) {
+    return nodes.length > 0 && nodes.every(n => Number.isFinite(n.x) && Number.isFinite(n.y));
+}
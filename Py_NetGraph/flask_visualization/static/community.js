@@ -3,8 +3,7 @@ document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
     // 向服务器请求数据，获取用户社区划分数据
-    fetch("/api/user_communities")
-        .then(response => response.json())  // 将返回的响应转换为 JSON 格式
+    fetchGraphData("/api/user_communities")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             // 获取前端展示的社区数据
             let communityMap = data.community_map;
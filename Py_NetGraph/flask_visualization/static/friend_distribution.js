@@ -1,8 +1,7 @@
 document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
-    fetch("/api/friend_distribution")
-        .then(response => response.json())
+    fetchGraphData("/api/friend_distribution")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             let mean_friends = data.stats.mean_friends;
             let median_friends = data.stats.median_friends;
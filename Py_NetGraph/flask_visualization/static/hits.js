@@ -67,7 +67,7 @@ document.addEventListener("DOMContentLoaded", function () {
             },
             series: [{
                 type: "graph",  // 图表类型为图形
-                layout: "force",  // 使用力引导布局
+                layout: hasStaticLayout(filteredNodes) ? "none" : "force",  // 有服务端坐标时静态渲染，否则使用力引导布局
                 roam: true,  // 开启图表的缩放和拖动
                 draggable: true,  // 开启节点拖动
                 force: {
@@ -94,6 +94,8 @@ document.addEventListener("DOMContentLoaded", function () {
                     const category = categorizeNode(n);  // 获取节点的分类
                     return {
                         name: n.username,  // 节点名称
+                        x: n.x,  // 服务端布局坐标（没有时为 undefined，使用力导向布局）
+                        y: n.y,
                         id: n.id,  // 节点ID
                         symbolSize: Math.max(n[selectedSizeMethod] * scaleFactor, 10),  // 节点大小，根据选定的大小方法进行计算
                         itemStyle: { color: category.color },  // 节点颜色
@@ -126,8 +128,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
     // 如果缓存数据为空，则请求数据并缓存
     if (!cachedData) {
-        fetch("/api/messages_hits")
-            .then(response => response.json())
+        fetchGraphData("/api/messages_hits?layout=1")  // 二进制列式格式（见 columnar.js）
             .then(data => {
                 cachedData = data;  // 存储获取的数据
 
@@ -1,8 +1,7 @@
 document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
-    fetch("/api/messages")
-        .then(response => response.json())
+    fetchGraphData("/api/messages?layout=1")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             // 定义活跃度类别
             const categories = [
@@ -70,7 +69,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 },
                 series: [{
                     type: "graph",
-                    layout: "force",
+                    layout: hasStaticLayout(data.nodes) ? "none" : "force",
                     roam: true,
                     draggable: true,
                     force: {
@@ -95,6 +94,8 @@ document.addEventListener("DOMContentLoaded", function () {
                         }
                         return {
                             name: n.username,
+                            x: n.x,  // 服务端布局坐标（没有时为 undefined，使用力导向布局）
+                            y: n.y,
                             id: n.id,
                             symbolSize: n.size / 100,
                             itemStyle: { color: category.color },
@@ -3,8 +3,7 @@ document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
     // 向服务器请求数据，获取 PageRank 相关数据
-    fetch("/api/messages_pagerank")
-        .then(response => response.json())  // 将返回的响应转换为 JSON 格式
+    fetchGraphData("/api/messages_pagerank?layout=1")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             // 计算 PageRank 排行前 10 名用户
             let top10Users = [...data.nodes]
@@ -42,7 +41,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 },
                 series: [{
                     type: "graph",  // 图表类型为图形（即网络图）
-                    layout: "force",  // 使用力导向布局
+                    layout: hasStaticLayout(data.nodes) ? "none" : "force",  // 使用力导向布局
                     roam: true,  // 允许图表自由拖动
                     draggable: true,  // 允许节点拖动
                     force: {
@@ -78,6 +77,8 @@ document.addEventListener("DOMContentLoaded", function () {
                         }
                         return {
                             name: n.username,  // 用户名
+                            x: n.x,  // 服务端布局坐标（没有时为 undefined，使用力导向布局）
+                            y: n.y,
                             id: n.id,  // 用户ID
                             symbolSize: n.size / 100,  // 节点大小（根据用户大小进行调整）
                             itemStyle: { color: category.color },  // 根据影响力类别设置颜色
@@ -1,8 +1,7 @@
 document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
-    fetch("/api/social_network")
-        .then(response => response.json())
+    fetchGraphData("/api/social_network")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             let option = {
                 title: {
@@ -1,8 +1,7 @@
 document.addEventListener("DOMContentLoaded", function () {
     let chart = echarts.init(document.getElementById("chart"));
 
-    fetch("/api/social_network")
-        .then(response => response.json())
+    fetchGraphData("/api/social_network?layout=1")  // 二进制列式格式（见 columnar.js）
         .then(data => {
             let categories = [
                 { name: "活跃用户" },
@@ -50,7 +49,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 },
                 series: [{
                     type: "graph",
-                    layout: "force",
+                    layout: hasStaticLayout(data.nodes) ? "none" : "force",
                     roam: true,
                     draggable: true,
                     force: {
@@ -67,6 +66,8 @@ document.addEventListener("DOMContentLoaded", function () {
                     categories: categories,
                     data: data.nodes.map(n => ({
                         name: n.username,
+                        x: n.x,  // 服务端布局坐标（没有时为 undefined，使用力导向布局）
+                        y: n.y,
                         id: n.id,
                         symbolSize: n.size / 100,
                         itemStyle: { color: n.color },